@@ -0,0 +1,86 @@
+"""
+Times scaling and encoding chart data, value by value as pygooglechart
+used to and a whole dataset at a time, with and without NumPy.
+
+Usage: python bench_chart.py [series] [points per series] [repeats]
+"""
+import sys
+import time
+import random
+
+import pygooglechart
+from pygooglechart import XYLineChart, ExtendedData
+
+
+def make_chart(series, points, rnd):
+    chart = XYLineChart(400, 200)
+    for _ in xrange(series):
+        score = rnd.randint(800, 2200)
+        values = []
+        for _ in xrange(points):
+            score += rnd.randint(-20, 20)
+            values.append(score if rnd.random() > 0.01 else None)
+        chart.add_data(range(points))
+        chart.add_data(values)
+    return chart
+
+
+def scale_values(chart):
+    """The value by value scaling pygooglechart used to do."""
+    x_range = chart.data_x_range()
+    y_range = chart.data_y_range()
+    return [[None if v is None else ExtendedData.scale_value(v, x_range if t == 'x' else y_range)
+             for v in dataset]
+            for (t, dataset) in chart.annotated_data()]
+
+
+def best_time(f, repeats):
+    best = None
+    for _ in xrange(repeats):
+        start = time.time()
+        result = f()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main(series, points, repeats):
+    chart = make_chart(series, points, random.Random(4711))
+    numpy = pygooglechart.numpy
+
+    scaled, scale_values_time = best_time(lambda: scale_values(chart), repeats)
+    encoded, encode_values_time = best_time(lambda: ExtendedData(scaled)._encode_values(), repeats)
+    _, url_values_time = best_time(lambda: ExtendedData(scale_values(chart))._encode_values(), repeats)
+
+    print '%d series of %d points, best of %d' % (series, points, repeats)
+    print '%-12s%14s%14s%14s%10s' % ('', 'scale', 'encode', 'total', 'speedup')
+    print '%-12s%13.2fms%13.2fms%13.2fms' % ('by value', scale_values_time * 1000,
+                                             encode_values_time * 1000, url_values_time * 1000)
+
+    for (name, module) in [('python', None), ('numpy', numpy)]:
+        if name == 'numpy' and numpy is None:
+            print '%-12s%14s' % (name, 'not installed')
+            continue
+
+        pygooglechart.numpy = module
+        try:
+            scaled_datasets, scale_time = best_time(
+                lambda: chart.scaled_data(ExtendedData), repeats)
+            encoded_datasets, encode_time = best_time(
+                lambda: repr(ExtendedData(scaled_datasets)), repeats)
+            _, total_time = best_time(lambda: chart.data_to_url(ExtendedData), repeats)
+        finally:
+            pygooglechart.numpy = numpy
+
+        if scaled_datasets != scaled or encoded_datasets != encoded:
+            raise Exception('%s scaling or encoding differs from by value' % name)
+
+        print '%-12s%13.2fms%13.2fms%13.2fms%9.1fx' % (
+            name, scale_time * 1000, encode_time * 1000, total_time * 1000,
+            url_values_time / total_time)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 30,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 1000,
+         int(sys.argv[3]) if len(sys.argv) > 3 else 5)
@@ -0,0 +1,194 @@
+"""
+Times every command handler in bot.HANDLERS against synthetic databases
+at 1x, 10x and 100x scale, and compares the timings with an earlier run.
+
+Usage: python bench_handlers.py run <data directory> <results.json> [scales]
+       python bench_handlers.py compare <baseline.json> <results.json>
+
+scales is a comma separated list and defaults to 1,10,100. The databases
+for a scale are generated into the data directory the first time it is
+used, and every run works on fresh copies of them. The derived tables in
+the log database are built first, and timed on their own, so the handler
+timings are for the steady state where only new events are folded in.
+Handlers are called directly, without the response cache.
+
+compare exits with status 1 if any handler got more than REGRESSION times
+slower.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import sqlite3
+
+import bot
+import synthetic
+from router import parse_command
+from event_rollup import EventRollup
+from kills import KillMatrix
+from skill import RatingStore
+
+SCALES = [1, 10, 100]
+REPEATS = 5
+BUDGET = 2.0
+REGRESSION = 1.25
+# Differences below this many seconds are noise, however large the ratio
+MIN_DIFFERENCE = 0.002
+
+# Handlers with side effects outside the databases
+SKIPPED = ['restart', 'update_gist']
+
+# Command text for handlers that need arguments; {0} and {1} are nicks
+# and {team} the nicks of TEAM_PLAYERS players. Splitting every player
+# in the database into teams grows exponentially with their number, so
+# team is timed for a game's worth of players.
+TEAM_PLAYERS = 10
+COMMAND_TEXT = {
+    'team': 'team include {team}',
+    'vs': 'vs {0} {1}',
+    'weapons': 'weapons {0}'
+}
+
+BUILDS = [
+    ('event_rollup', lambda connection: EventRollup(connection).rebuild()),
+    ('kill_matrix', lambda connection: KillMatrix(connection).rebuild()),
+    ('skill_rating', lambda connection: RatingStore(connection).rebuild())
+]
+
+
+def generate(data_dir, scale):
+    """
+    Returns the paths of the rankme and log databases for scale,
+    generating them if they do not exist yet.
+    """
+    rankme_path = os.path.join(data_dir, 'rankme-%s.sq3' % scale)
+    log_path = os.path.join(data_dir, 'log-%s.sq3' % scale)
+    if not os.path.exists(rankme_path) or not os.path.exists(log_path):
+        for path in (rankme_path, log_path):
+            if os.path.exists(path):
+                os.remove(path)
+        print 'Generating %d players, %d games and %d rounds...' % synthetic.scaled_sizes(scale)
+        players = synthetic.generate_rankme_db(rankme_path + '.tmp', scale)
+        synthetic.generate_log_db(log_path + '.tmp', scale, players=players)
+        os.rename(rankme_path + '.tmp', rankme_path)
+        os.rename(log_path + '.tmp', log_path)
+
+    return rankme_path, log_path
+
+
+def time_calls(f):
+    """
+    Calls f at least three and at most REPEATS times, stopping once BUDGET
+    seconds have passed, and returns the timings.
+    """
+    timings = []
+    started = time.time()
+    while len(timings) < REPEATS and (len(timings) < 3 or time.time() - started < BUDGET):
+        start = time.time()
+        f()
+        timings.append(time.time() - start)
+
+    return timings
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    return {
+        'median': timings[len(timings) / 2],
+        'min': timings[0],
+        'max': timings[-1],
+        'runs': len(timings)
+    }
+
+
+def bench_scale(data_dir, scale):
+    (rankme_path, log_path) = generate(data_dir, scale)
+
+    work_rankme_path = os.path.join(data_dir, 'work-rankme.sq3')
+    work_log_path = os.path.join(data_dir, 'work-log.sq3')
+    shutil.copyfile(rankme_path, work_rankme_path)
+    shutil.copyfile(log_path, work_log_path)
+
+    connection = sqlite3.connect(work_rankme_path)
+    log_connection = sqlite3.connect(work_log_path)
+    nicks = [name for (name,) in log_connection.execute(
+        'select name from players order by steam_id limit ?', (TEAM_PLAYERS,))]
+
+    results = {}
+    for (name, build) in BUILDS:
+        start = time.time()
+        build(log_connection)
+        results['build:' + name] = summarize([time.time() - start])
+        print '%6sx %-24s%10.1fms' % (scale, 'build:' + name, results['build:' + name]['median'] * 1000)
+
+    for name in sorted(bot.HANDLERS.keys()):
+        if name in SKIPPED:
+            continue
+
+        command = parse_command(COMMAND_TEXT.get(name, name).format(*nicks, team=', '.join(nicks)))
+        handler = bot.HANDLERS[name]
+        random.seed(4711)
+
+        results[name] = summarize(time_calls(
+            lambda: handler(command, connection, log_db_connection=log_connection)))
+        print '%6sx %-24s%10.1fms' % (scale, name, results[name]['median'] * 1000)
+
+    connection.close()
+    log_connection.close()
+
+    return results
+
+
+def run(data_dir, results_path, scales):
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+
+    results = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': sys.version.split()[0],
+        'sqlite': sqlite3.sqlite_version,
+        'scales': {}
+    }
+    for scale in scales:
+        results['scales'][str(scale)] = bench_scale(data_dir, scale)
+
+    with open(results_path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def compare(baseline_path, results_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(results_path) as f:
+        results = json.load(f)
+
+    print '%7s %-24s%12s%12s%8s' % ('Scale', 'Handler', 'Baseline', 'Now', 'Ratio')
+    regressions = 0
+    for scale in sorted(results['scales'].keys(), key=float):
+        for (name, now) in sorted(results['scales'][scale].items()):
+            before = baseline['scales'].get(scale, {}).get(name)
+            if before is None:
+                print '%6sx %-24s%12s%10.1fms' % (scale, name, '-', now['median'] * 1000)
+                continue
+
+            ratio = now['median'] / max(before['median'], 1e-6)
+            regressed = ratio > REGRESSION and now['median'] - before['median'] > MIN_DIFFERENCE
+            regressions += regressed
+            print '%6sx %-24s%10.1fms%10.1fms%7.2fx%s' % (
+                scale, name, before['median'] * 1000, now['median'] * 1000, ratio,
+                ' SLOWER' if regressed else '')
+
+    if regressions:
+        print '%d handlers got slower.' % regressions
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    if sys.argv[1] == 'run':
+        run(sys.argv[2], sys.argv[3],
+            [float(s) if '.' in s else int(s) for s in sys.argv[4].split(',')]
+            if len(sys.argv) > 4 else SCALES)
+    elif sys.argv[1] == 'compare':
+        compare(sys.argv[2], sys.argv[3])
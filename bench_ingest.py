@@ -0,0 +1,54 @@
+"""
+Times reading a synthetic server log into an empty log database.
+
+Usage: python bench_ingest.py <data directory> [scale]
+
+The log for scale, 10 by default, is generated into the data directory
+the first time it is used. Reports events per second for only parsing the
+log, and for ingesting it with the indexes on events kept up to date and
+created afterwards.
+"""
+import os
+import sys
+import time
+
+import db
+import ingest
+import synthetic
+
+
+def fresh_log_db(path):
+    if os.path.exists(path):
+        os.remove(path)
+    connection = db.connect(path)
+    connection.executescript(synthetic.LOG_SCHEMA)
+    synthetic.apply_migrations(connection, os.path.join(synthetic.MIGRATIONS_DIR, 'log'))
+    return connection
+
+
+def run(data_dir, scale):
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+    log_path = os.path.join(data_dir, 'server-%s.log' % scale)
+    if not os.path.exists(log_path):
+        print 'Generating %d players, %d games and %d rounds...' % synthetic.scaled_sizes(scale)
+        synthetic.generate_server_log(log_path + '.tmp', scale)
+        os.rename(log_path + '.tmp', log_path)
+
+    start = time.time()
+    records = sum(1 for _ in ingest.parse_lines(ingest.read_lines([log_path])))
+    print '%-24s%10d/s' % ('parse', records / (time.time() - start))
+
+    for defer_indexes in (False, True):
+        connection = fresh_log_db(os.path.join(data_dir, 'work-ingest.sq3'))
+        ingester = ingest.Ingester(connection)
+        start = time.time()
+        ingester.ingest(ingest.parse_lines(ingest.read_lines([log_path])), defer_indexes)
+        print '%-24s%10d/s' % ('ingest, deferred indexes' if defer_indexes else 'ingest',
+                               ingester.events / (time.time() - start))
+        connection.close()
+
+
+if __name__ == '__main__':
+    scale = sys.argv[2] if len(sys.argv) > 2 else '10'
+    run(sys.argv[1], float(scale) if '.' in scale else int(scale))
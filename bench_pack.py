@@ -0,0 +1,72 @@
+"""
+Compares the team balancing engine with the exhaustive bestPack search.
+
+Usage: python bench_pack.py [max players for bestPack]
+                            [max players for listing all candidates]
+                            [max players]
+
+make_teams only draws one split, through random_pack, which does not
+depend on the number of candidates.
+"""
+import sys
+import time
+import random
+
+from pack import bestPack, balanced_packs, best_pack, random_pack
+
+DIFF_PER_PLAYER = 10
+
+
+def make_players(count, rnd):
+    return [('player%d' % i, rnd.randint(800, 2200)) for i in xrange(count)]
+
+
+def timed(f, *args):
+    start = time.time()
+    result = f(*args)
+    return result, time.time() - start
+
+
+def main(max_exhaustive, max_candidates, max_players):
+    rnd = random.Random(4711)
+
+    print '%8s%14s%14s%12s%10s%14s' % ('Players', 'bestPack', 'engine', 'Candidates', 'Speedup', 'random_pack')
+    for count in xrange(4, max_players + 1, 2):
+        players = make_players(count, rnd)
+        max_diff = count * DIFF_PER_PLAYER
+
+        def sample():
+            return random_pack(players, max_diff, rnd) or best_pack(players)
+
+        _, sample_time = timed(sample)
+        if count > max_candidates:
+            print '%8d%14s%14s%12s%10s%13.3fs' % (count, '-', '-', '-', '-', sample_time)
+            continue
+
+        def engine():
+            candidates = balanced_packs(players, max_diff)
+            return candidates or [best_pack(players)]
+
+        candidates, engine_time = timed(engine)
+
+        if count <= max_exhaustive:
+            def exhaustive():
+                unfiltered = bestPack(players)
+                return [(t, d) for (t, d) in unfiltered if d < max_diff] or [unfiltered[0]]
+
+            expected, exhaustive_time = timed(exhaustive)
+            if expected != candidates:
+                raise Exception('Candidates differ from bestPack for %d players' % count)
+
+            print '%8d%13.3fs%13.3fs%12d%9.0fx%13.3fs' % (
+                count, exhaustive_time, engine_time, len(candidates),
+                exhaustive_time / max(engine_time, 1e-6), sample_time)
+        else:
+            print '%8d%14s%13.3fs%12d%10s%13.3fs' % (
+                count, '-', engine_time, len(candidates), '-', sample_time)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 18,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 24,
+         int(sys.argv[3]) if len(sys.argv) > 3 else 30)
@@ -1,15 +1,40 @@
-import sqlite3
 import time
 import os
 import sys
 import traceback
+import threading
+import Queue
 
 from slackclient import SlackClient
-from simplegist import Simplegist
 from game_tracker import GameTracker
+from cache import ResponseCache
 import handlers
+import profiling
+import db
+import derived
+import metrics
+from outbox import Outbox
+from gist import GistPublisher, render_rank
+from router import Router, CommandSpec, parse_command, RANKME_DB, LOG_DB, CHEAP, EXPENSIVE
 from custom_exceptions import HandlerInputException
 
+CHANNEL = '#lanparty'
+READ_WEBSOCKET_DELAY = 1  # 1 second delay between reading from firehose
+
+
+def parse_slack_commands(slack_rtm_output, at_bot):
+    """
+        Returns a list of (command, channel) for every message in the
+        output that is directed at the Bot, based on its ID.
+    """
+    commands = []
+    for output in slack_rtm_output or []:
+        if output and 'text' in output and at_bot in output['text']:
+            # text after the @ mention, whitespace removed
+            commands.append((output['text'].split(at_bot)[1].strip().lower(),
+                             output['channel']))
+    return commands
+
 
 def parse_slack_output(slack_rtm_output, at_bot):
     """
@@ -17,17 +42,13 @@ def parse_slack_output(slack_rtm_output, at_bot):
         this parsing function returns None unless a message is
         directed at the Bot, based on its ID.
     """
-    output_list = slack_rtm_output
-    if output_list and len(output_list) > 0:
-        for output in output_list:
-            if output and 'text' in output and at_bot in output['text']:
-                # return text after the @ mention, whitespace removed
-                return output['text'].split(at_bot)[1].strip().lower(), \
-                    output['channel']
+    commands = parse_slack_commands(slack_rtm_output, at_bot)
+    if commands:
+        return commands[0]
     return None, None
 
 
-def cleanup(slack_client, connection):
+def cleanup(outbox, connection):
     cursor = connection.cursor()
     invalids = cursor.execute('select name from rankme where steam=?',
                               ('STEAM_ID_STOP_IGNORING_RETVALS',)).fetchall()
@@ -37,95 +58,95 @@ def cleanup(slack_client, connection):
                        ('STEAM_ID_STOP_IGNORING_RETVALS',))
         cursor.execute('delete from game_stats where steam=?',
                        ('STEAM_ID_STOP_IGNORING_RETVALS',))
+        cursor.execute('delete from game_result where steam=?',
+                       ('STEAM_ID_STOP_IGNORING_RETVALS',))
+        connection.commit()
 
-        slack_client.api_call('chat.postMessage', channel=CHANNEL,
-                              text='I cleaned up these FAKE USERS: ' +
-                              ', '.join([i[0] for i in invalids]) +
-                              '. SAD!',
-                              as_user=True)
-
-
-def write_rank_to_gist(_, connection, **kwargs):
-    api_token = os.environ.get('GITHUB_API_TOKEN')
-    gist_username = os.environ.get('GIST_USERNAME')
-    gist_id = os.environ.get('GIST_ID')
+        outbox.post(CHANNEL, 'I cleaned up these FAKE USERS: ' +
+                    ', '.join([i[0] for i in invalids]) +
+                    '. SAD!')
 
-    if not api_token or not gist_username or not gist_id:
-        return
 
-    cursor = connection.cursor()
-    rows = cursor.execute("""
-        select
-            name,
-            case
-                when deaths > 0 then cast(kills as float)/deaths 
-                else 0
-            end as kdr,
-            score
-        from rankme""")
+# Set by the Bot, if GIST_ID and GITHUB_API_TOKEN are set
+GIST_PUBLISHER = None
 
-    text = '\n'.join(['%s\t%.2f\t%d' % r for r in rows])
 
-    ghgist = Simplegist(username=gist_username, api_token=api_token)
-    ghgist.profile().edit(id=gist_id, content=text)
+def write_rank_to_gist(_, connection, **kwargs):
+    if GIST_PUBLISHER is None:
+        return
 
-    return 'Wrote:\n\n```%s```' % text
+    GIST_PUBLISHER.schedule(0)
+    return 'Publishing:\n\n```%s```' % render_rank(connection)
 
 
 class SlackGameTracker(GameTracker):
-    def __init__(self, slack_client, db_connection):
+    def __init__(self, outbox, db_connection, gist_publisher=None):
         GameTracker.__init__(self, db_connection)
-        self._slack_client = slack_client
+        self._outbox = outbox
+        self._gist_publisher = gist_publisher
 
     def on_game_started(self):
         print 'The game has begun'
-        self._slack_client.api_call("chat.postMessage", channel=CHANNEL,
-                                    text='The game is on! :c4:', as_user=True)
+        metrics.GAMES_STARTED.inc()
+        self._outbox.post(CHANNEL, 'The game is on! :c4:')
 
     def on_game_ended(self):
         print 'The game has ended'
-        self._slack_client.api_call("chat.postMessage", channel=CHANNEL,
-                                    text='Game over man! Game over!\n\n' +
-                                    handlers.last_game(
-                                        '', self._connection) + '\n',
-                                    as_user=True)
-
-        try:
-            write_rank_to_gist(None, self._connection)
-        except Exception, e:
-            print 'Unexpected error updating gist.'
-            print traceback.format_exc()
-
-
-HANDLERS = {
-    'ranking': handlers.ranking,
-    'headshots': handlers.headshots,
-    'last': handlers.last_game,
-    'team': handlers.make_teams,
-    'history': handlers.history,
-    'skill': handlers.skill,
-    'killers': handlers.killers,
-    'smokes': handlers.smokes,
-    'flashbangs': handlers.flashbangs,
-    'hes': handlers.hes,
-    'bombplants': handlers.bomb_plants,
-    'bombdefuses': handlers.bomb_defuses,
-    'blinds': handlers.blinds,
-    'jumps': handlers.jumps,
-    'radios': handlers.radios,
-    'weapons': handlers.weapons,
-    'update_gist': write_rank_to_gist,
-    'restart': handlers.restart_server
-}
+        metrics.GAMES_ENDED.inc()
+        self._outbox.post(CHANNEL, 'Game over man! Game over!\n\n' +
+                          handlers.last_game(parse_command(''), self._connection) + '\n')
+
+        if self._gist_publisher:
+            self._gist_publisher.schedule()
+
+
+COMMANDS = [
+    CommandSpec('ranking', handlers.ranking, [RANKME_DB], True, CHEAP),
+    CommandSpec('headshots', handlers.headshots, [RANKME_DB], True, CHEAP),
+    CommandSpec('last', handlers.last_game, [RANKME_DB], True, CHEAP),
+    CommandSpec('team', handlers.make_teams, [RANKME_DB], False, EXPENSIVE),
+    CommandSpec('history', handlers.history, [RANKME_DB], True, EXPENSIVE),
+    CommandSpec('skill', handlers.skill, [LOG_DB], True, EXPENSIVE),
+    CommandSpec('killers', handlers.killers, [LOG_DB], True, EXPENSIVE),
+    CommandSpec('vs', handlers.versus, [LOG_DB], True, EXPENSIVE),
+    CommandSpec('smokes', handlers.smokes, [LOG_DB], True, EXPENSIVE),
+    CommandSpec('flashbangs', handlers.flashbangs, [LOG_DB], True, EXPENSIVE),
+    CommandSpec('hes', handlers.hes, [LOG_DB], True, EXPENSIVE),
+    CommandSpec('bombplants', handlers.bomb_plants, [LOG_DB], True, EXPENSIVE),
+    CommandSpec('bombdefuses', handlers.bomb_defuses, [LOG_DB], True, EXPENSIVE),
+    CommandSpec('blinds', handlers.blinds, [LOG_DB], True, EXPENSIVE),
+    CommandSpec('jumps', handlers.jumps, [LOG_DB], True, EXPENSIVE),
+    CommandSpec('radios', handlers.radios, [LOG_DB], True, EXPENSIVE),
+    CommandSpec('weapons', handlers.weapons, [LOG_DB], True, EXPENSIVE),
+    CommandSpec('update_gist', write_rank_to_gist, [RANKME_DB], False, EXPENSIVE),
+    CommandSpec('restart', handlers.restart_server, [], False, CHEAP),
+    CommandSpec('stats', handlers.stats, [], False, CHEAP)
+]
+
+ROUTER = Router(COMMANDS)
+
+HANDLERS = dict((spec.name, spec.handler) for spec in COMMANDS)
 
 
 class Bot(object):
-    def __init__(self, bot_token, bot_name, db_path, log_db_path):
-        self._slack_client = SlackClient(bot_token)
-        self._db_connection = sqlite3.connect(db_path)
-        self._log_db_connection = sqlite3.connect(log_db_path)
+    def __init__(self, bot_token, bot_name, db_path, log_db_path, slack_client=None, wal=False):
+        self._slack_client = metrics.instrument_slack_client(slack_client or SlackClient(bot_token))
+        self._db_path = db_path
+        self._log_db_path = log_db_path
+        self._db_connection = db.connect(db_path, wal=wal)
+        # Handlers only read the log database; the derived tables in it
+        # are written through a connection of their own, which creates
+        # them before anything can read them
+        self._log_db_writer = db.connect(log_db_path, wal=wal)
+        derived.ensure_schema(self._log_db_writer)
+        self._log_db_connection = db.connect(log_db_path, read_only=True, wal=wal)
+        self._cache = ResponseCache({RANKME_DB: db_path, LOG_DB: log_db_path})
+        self._outbox = Outbox(self._slack_client)
+        self._gist_publisher = GistPublisher.from_environment(db_path)
+        global GIST_PUBLISHER
+        GIST_PUBLISHER = self._gist_publisher
         self._game_tracker = SlackGameTracker(
-            self._slack_client, self._db_connection)
+            self._outbox, self._db_connection, self._gist_publisher)
 
         bot_id = self._slack_client.api_call("auth.test")["user_id"]
 
@@ -133,31 +154,159 @@ class Bot(object):
 
     def run(self):
         if self._slack_client.rtm_connect():
+            self._start_background()
             count = 0
-            while True:
-                if count % 10 == 0:
-                    self._game_tracker.check_active()
-                    cleanup(self._slack_client, self._db_connection)
-
-                count += 1
-
-                command, channel = parse_slack_output(
-                    self._slack_client.rtm_read(), self._at_bot)
-                if command and channel:
-                    self._handle_command(command, channel)
-                time.sleep(READ_WEBSOCKET_DELAY)
+            last = None
+            try:
+                while True:
+                    last = self._observe_loop_lag(last)
+                    if count % 10 == 0:
+                        self._check_active(self._game_tracker)
+                        cleanup(self._outbox, self._db_connection)
+                        self._refresh_derived(self._log_db_writer)
+
+                    count += 1
+
+                    command, channel = parse_slack_output(
+                        self._slack_client.rtm_read(), self._at_bot)
+                    if command and channel:
+                        self._handle_command(command, channel)
+                    time.sleep(READ_WEBSOCKET_DELAY)
+            finally:
+                self._stop_background()
         else:
             raise Exception(
                 'Connection failed. Invalid Slack token or bot ID?')
 
-    def _handle_command(self, command, channel):
+    def run_concurrent(self, workers=4, max_pending=32):
+        """
+            Like run, but commands are executed by a pool of worker
+            threads and the game tracking jobs run on a thread of their
+            own, so a slow command never holds up reading messages.
+            Workers take their connections from pools of read only
+            ones, since commands never write to either database.
+        """
+        if not self._slack_client.rtm_connect():
+            raise Exception(
+                'Connection failed. Invalid Slack token or bot ID?')
+
+        # The derived tables must exist before any worker reads them
+        self._refresh_derived(self._log_db_writer)
+
+        # Cheap commands get a worker of their own, so they are not
+        # stuck behind expensive ones
+        self._start_background()
+        self._db_pool = db.ConnectionPool(self._db_path, workers + 1, read_only=True)
+        self._log_db_pool = db.ConnectionPool(self._log_db_path, workers + 1, read_only=True)
+        stopped = threading.Event()
+        pending = {
+            CHEAP: Queue.Queue(max_pending),
+            EXPENSIVE: Queue.Queue(max_pending)
+        }
+        threads = [threading.Thread(target=self._run_jobs, args=(stopped,)),
+                   threading.Thread(target=self._run_worker, args=(pending[CHEAP], stopped))] + \
+            [threading.Thread(target=self._run_worker, args=(pending[EXPENSIVE], stopped))
+             for _ in xrange(workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            last = None
+            delay = READ_WEBSOCKET_DELAY
+            while True:
+                last = self._observe_loop_lag(last, delay)
+                # rtm_read returns at most one frame, so only wait when
+                # there was nothing to read
+                output = self._slack_client.rtm_read()
+                for (command, channel) in parse_slack_commands(output, self._at_bot):
+                    spec, _ = ROUTER.resolve(command)
+                    try:
+                        pending[spec.cost if spec else CHEAP].put_nowait((command, channel))
+                    except Queue.Full:
+                        self._post(channel, 'I am a bit busy right now, try again in a moment.')
+                delay = 0 if output else READ_WEBSOCKET_DELAY
+                time.sleep(delay)
+        finally:
+            stopped.set()
+            self._stop_background()
+            self._db_pool.close()
+            self._log_db_pool.close()
+
+    def _run_jobs(self, stopped):
+        connection = db.connect(self._db_path)
+        log_db_connection = db.connect(self._log_db_path)
+        game_tracker = SlackGameTracker(self._outbox, connection, self._gist_publisher)
+        while not stopped.is_set():
+            try:
+                self._check_active(game_tracker)
+                cleanup(self._outbox, connection)
+            except Exception:
+                print traceback.format_exc()
+            self._refresh_derived(log_db_connection)
+            stopped.wait(10 * READ_WEBSOCKET_DELAY)
+
+    def _refresh_derived(self, log_db_connection):
+        # The only writer of the derived tables, which handlers just read
+        try:
+            derived.refresh(log_db_connection)
+        except Exception:
+            print traceback.format_exc()
+
+    def take_over(self, other):
+        """
+        Takes over what other, a bot that has stopped running, had left
+        to post, like after reconnecting.
+        """
+        self._outbox.take_over(other._outbox)
+
+    def _start_background(self):
+        self._outbox.start()
+        if self._gist_publisher:
+            self._gist_publisher.start()
+
+    def _stop_background(self):
+        self._outbox.stop()
+        if self._gist_publisher:
+            self._gist_publisher.stop()
+
+    def _observe_loop_lag(self, last, delay=READ_WEBSOCKET_DELAY):
+        now = time.time()
+        if last is not None:
+            metrics.LOOP_LAG.observe(max(0, now - last - delay))
+        return now
+
+    def _check_active(self, game_tracker):
+        start = time.time()
+        game_tracker.check_active()
+        metrics.CHECK_ACTIVE.observe(time.time() - start)
+
+    def _run_worker(self, pending, stopped):
+        while not stopped.is_set():
+            try:
+                (command, channel) = pending.get(timeout=1)
+            except Queue.Empty:
+                continue
+
+            db_connection = self._db_pool.acquire()
+            log_db_connection = self._log_db_pool.acquire()
+            try:
+                self._handle_command(command, channel, db_connection, log_db_connection)
+            finally:
+                self._log_db_pool.release(log_db_connection)
+                self._db_pool.release(db_connection)
+
+    def _handle_command(self, command, channel, db_connection=None, log_db_connection=None):
+        db_connection = db_connection or self._db_connection
+        log_db_connection = log_db_connection or self._log_db_connection
+
         response = None
         try:
-            for (command_prefix, handler) in HANDLERS.items():
-                if command.startswith(command_prefix):
-                    response = handler(
-                        command, self._db_connection, log_db_connection=self._log_db_connection)
-                    break
+            spec, parsed = ROUTER.resolve(command)
+            if spec:
+                response = self._cache.get_or_compute(
+                    spec, parsed, lambda: self._run_handler(
+                        spec, parsed, db_connection, log_db_connection))
         except HandlerInputException, e:
             response = 'Sorry, but you missed something:' + str(e)
         except Exception, e:
@@ -166,27 +315,61 @@ class Bot(object):
 
         if not response:
             response = 'Huh? Try one of ' + \
-                ', '.join(['*' + cmd + '*' for cmd in HANDLERS.keys()])
+                ', '.join(['*' + cmd + '*' for cmd in ROUTER.names()])
+
+        self._post(channel, response)
 
+    def _run_handler(self, spec, command, db_connection, log_db_connection):
+        start = time.time()
+        error = True
+        try:
+            response = spec.handler(command, db_connection, log_db_connection=log_db_connection)
+            error = False
+            return response
+        except HandlerInputException:
+            error = False
+            raise
+        finally:
+            profiling.PROFILER.record_handler(spec.name, time.time() - start, error)
+
+    def _post(self, channel, response):
         if isinstance(response, basestring):
-            self._slack_client.api_call("chat.postMessage", channel=channel,
-                                        text=response, as_user=True)
+            self._outbox.post(channel, text=response)
         else:
-            self._slack_client.api_call("chat.postMessage", channel=channel,
-                                        attachments=response, as_user=True)
+            self._outbox.post(channel, attachments=response)
 
 
 if __name__ == "__main__":
     # constants
     BOT_NAME = os.environ.get("BOT_NAME")
     BOT_TOKEN = os.environ.get('SLACK_BOT_TOKEN')
-    CHANNEL = '#lanparty'
-    READ_WEBSOCKET_DELAY = 1  # 1 second delay between reading from firehose
+    SLACK_API_URL = os.environ.get('SLACK_API_URL')  # a fake_slack.py to talk to instead
+    WORKERS = int(os.environ.get('BOT_WORKERS', 0))  # 0 runs commands inline
+    METRICS_PORT = int(os.environ.get('METRICS_PORT', 0))  # on localhost; 0 does not serve /metrics
+    # Write ahead logging lasts for every connection to the databases, so
+    # only turn it on if the game server's SQLite supports it
+    SQLITE_WAL = bool(os.environ.get('SQLITE_WAL'))
+
+    if METRICS_PORT:
+        metrics.start_server(METRICS_PORT)
 
+    previous = None
     while True:
         try:
-            Bot(BOT_TOKEN, BOT_NAME, sys.argv[1], sys.argv[2]).run()
+            slack_client = None
+            if SLACK_API_URL:
+                from fake_slack import LocalSlackClient
+                slack_client = LocalSlackClient(BOT_TOKEN, SLACK_API_URL)
+            bot = Bot(BOT_TOKEN, BOT_NAME, sys.argv[1], sys.argv[2], slack_client, SQLITE_WAL)
+            if previous is not None:
+                bot.take_over(previous)
+            previous = bot
+            if WORKERS > 0:
+                bot.run_concurrent(WORKERS)
+            else:
+                bot.run()
         except:
             print 'Unexpected error; sleeping one minute.'
             print traceback.format_exc()
             time.sleep(60)
+            metrics.RECONNECTS.inc()
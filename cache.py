@@ -0,0 +1,58 @@
+import threading
+from collections import OrderedDict
+
+import db
+
+
+class ResponseCache(object):
+    """
+    Least recently used cache of command responses.
+
+    Responses are keyed on the command and a change token for each
+    database the command reads, so they are invalidated as soon as
+    anything, like the game server, writes to one of those databases.
+    The tokens are read through connections owned by the cache, which
+    never write themselves.
+    """
+
+    def __init__(self, db_paths, maxsize=64):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._maxsize = maxsize
+        self._connections = dict((name, db.connect(path, read_only=True, check_same_thread=False))
+                                 for (name, path) in db_paths.items())
+        self.hits = 0
+        self.misses = 0
+
+    def _tokens(self, dbs):
+        return tuple(db.data_version(self._connections[name]) for name in dbs)
+
+    def get_or_compute(self, spec, command, compute):
+        """
+        Returns the cached response for command, or the result of calling
+        compute if there is none or spec is not cacheable.
+        """
+        if not spec.cacheable:
+            return compute()
+
+        with self._lock:
+            key = (spec.name, command.args, self._tokens(spec.dbs))
+            if key in self._entries:
+                self.hits += 1
+                response = self._entries.pop(key)
+                self._entries[key] = response
+                return response
+            self.misses += 1
+
+        response = compute()
+
+        with self._lock:
+            self._entries[key] = response
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+        return response
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,278 @@
+"""
+Renders line charts locally, as PNG or SVG, instead of through the Google
+Image Charts API.
+
+Rendered charts are cached on disk under a hash of the data they show, so
+a chart is only rendered, and published, when the data has changed.
+"""
+import os
+import sys
+import json
+import zlib
+import struct
+import hashlib
+import tempfile
+from subprocess import check_output
+
+from linegraph import colors, downsample
+
+WIDTH = 500
+HEIGHT = 200
+PLOT_LEFT = 40
+PLOT_RIGHT = 380
+PLOT_TOP = 10
+PLOT_BOTTOM = 190
+LEGEND_LEFT = 390
+
+BACKGROUND = (255, 255, 255)
+AXIS = (160, 160, 160)
+TEXT = (60, 60, 60)
+
+# 5x7 glyphs, one byte per column with the top row in the lowest bit.
+# Lower case letters are drawn as upper case.
+GLYPHS = {
+    ' ': (0x00, 0x00, 0x00, 0x00, 0x00), '?': (0x02, 0x01, 0x51, 0x09, 0x06),
+    '.': (0x00, 0x60, 0x60, 0x00, 0x00), '-': (0x08, 0x08, 0x08, 0x08, 0x08),
+    '_': (0x40, 0x40, 0x40, 0x40, 0x40), "'": (0x00, 0x05, 0x03, 0x00, 0x00),
+    ':': (0x00, 0x36, 0x36, 0x00, 0x00),
+    '0': (0x3E, 0x51, 0x49, 0x45, 0x3E), '1': (0x00, 0x42, 0x7F, 0x40, 0x00),
+    '2': (0x42, 0x61, 0x51, 0x49, 0x46), '3': (0x21, 0x41, 0x45, 0x4B, 0x31),
+    '4': (0x18, 0x14, 0x12, 0x7F, 0x10), '5': (0x27, 0x45, 0x45, 0x45, 0x39),
+    '6': (0x3C, 0x4A, 0x49, 0x49, 0x30), '7': (0x01, 0x71, 0x09, 0x05, 0x03),
+    '8': (0x36, 0x49, 0x49, 0x49, 0x36), '9': (0x06, 0x49, 0x49, 0x29, 0x1E),
+    'A': (0x7C, 0x12, 0x11, 0x12, 0x7C), 'B': (0x7F, 0x49, 0x49, 0x49, 0x36),
+    'C': (0x3E, 0x41, 0x41, 0x41, 0x22), 'D': (0x7F, 0x41, 0x41, 0x22, 0x1C),
+    'E': (0x7F, 0x49, 0x49, 0x49, 0x41), 'F': (0x7F, 0x09, 0x09, 0x09, 0x01),
+    'G': (0x3E, 0x41, 0x49, 0x49, 0x7A), 'H': (0x7F, 0x08, 0x08, 0x08, 0x7F),
+    'I': (0x00, 0x41, 0x7F, 0x41, 0x00), 'J': (0x20, 0x40, 0x41, 0x3F, 0x01),
+    'K': (0x7F, 0x08, 0x14, 0x22, 0x41), 'L': (0x7F, 0x40, 0x40, 0x40, 0x40),
+    'M': (0x7F, 0x02, 0x1C, 0x02, 0x7F), 'N': (0x7F, 0x04, 0x08, 0x10, 0x7F),
+    'O': (0x3E, 0x41, 0x41, 0x41, 0x3E), 'P': (0x7F, 0x09, 0x09, 0x09, 0x06),
+    'Q': (0x3E, 0x41, 0x51, 0x21, 0x5E), 'R': (0x7F, 0x09, 0x19, 0x29, 0x46),
+    'S': (0x26, 0x49, 0x49, 0x49, 0x32), 'T': (0x01, 0x01, 0x7F, 0x01, 0x01),
+    'U': (0x3F, 0x40, 0x40, 0x40, 0x3F), 'V': (0x1F, 0x20, 0x40, 0x20, 0x1F),
+    'W': (0x3F, 0x40, 0x38, 0x40, 0x3F), 'X': (0x63, 0x14, 0x08, 0x14, 0x63),
+    'Y': (0x03, 0x04, 0x78, 0x04, 0x03), 'Z': (0x61, 0x51, 0x49, 0x45, 0x43),
+}
+
+
+def _rgb(hex_colour):
+    return tuple(int(hex_colour[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def _layout(series, max_points):
+    """
+    Returns the y range and, for every series, its name, colour and points
+    in image coordinates.
+    """
+    values = [v for (_, data) in series for v in data]
+    (low, high) = (min(values), max(values)) if values else (0, 1)
+    if high == low:
+        high = low + 1
+    length = max([len(data) for (_, data) in series] + [2])
+
+    def to_image(x, y):
+        return (PLOT_LEFT + float(x) / (length - 1) * (PLOT_RIGHT - PLOT_LEFT),
+                PLOT_BOTTOM - float(y - low) / (high - low) * (PLOT_BOTTOM - PLOT_TOP))
+
+    lines = []
+    for (i, (name, data)) in enumerate(series):
+        points = list(enumerate(data))
+        if max_points:
+            points = downsample(points, max_points)
+        lines.append((name, colors[i % len(colors)], [to_image(x, y) for (x, y) in points]))
+
+    return (low, high), lines
+
+
+class _Canvas(object):
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.pixels = bytearray(BACKGROUND * (width * height))
+
+    def set(self, x, y, colour):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            i = (y * self.width + x) * 3
+            self.pixels[i:i + 3] = bytearray(colour)
+
+    def line(self, (x0, y0), (x1, y1), colour):
+        (x0, y0, x1, y1) = (int(round(x0)), int(round(y0)), int(round(x1)), int(round(y1)))
+        dx = abs(x1 - x0)
+        dy = -abs(y1 - y0)
+        sx = 1 if x0 < x1 else -1
+        sy = 1 if y0 < y1 else -1
+        err = dx + dy
+        while True:
+            self.set(x0, y0, colour)
+            self.set(x0, y0 + 1, colour)
+            if x0 == x1 and y0 == y1:
+                break
+            e2 = 2 * err
+            if e2 >= dy:
+                err += dy
+                x0 += sx
+            if e2 <= dx:
+                err += dx
+                y0 += sy
+
+    def rect(self, x, y, width, height, colour):
+        for j in xrange(y, y + height):
+            for i in xrange(x, x + width):
+                self.set(i, j, colour)
+
+    def text(self, x, y, text, colour):
+        for c in text:
+            glyph = GLYPHS.get(c.upper(), GLYPHS['?'])
+            for (column, bits) in enumerate(glyph):
+                for row in xrange(7):
+                    if bits & (1 << row):
+                        self.set(x + column, y + row, colour)
+            x += 6
+
+    def png(self):
+        row_size = self.width * 3
+        raw = ''.join('\x00' + str(self.pixels[y * row_size:(y + 1) * row_size])
+                      for y in xrange(self.height))
+
+        def chunk(tag, data):
+            return struct.pack('>I', len(data)) + tag + data + \
+                struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+        return '\x89PNG\r\n\x1a\n' + \
+            chunk('IHDR', struct.pack('>IIBBBBB', self.width, self.height, 8, 2, 0, 0, 0)) + \
+            chunk('IDAT', zlib.compress(raw, 9)) + \
+            chunk('IEND', '')
+
+
+def render_png(series, max_points=None):
+    (low, high), lines = _layout(series, max_points)
+
+    canvas = _Canvas(WIDTH, HEIGHT)
+    canvas.line((PLOT_LEFT, PLOT_TOP), (PLOT_LEFT, PLOT_BOTTOM), AXIS)
+    canvas.line((PLOT_LEFT, PLOT_BOTTOM), (PLOT_RIGHT, PLOT_BOTTOM), AXIS)
+    canvas.text(2, PLOT_TOP, '%d' % high, TEXT)
+    canvas.text(2, PLOT_BOTTOM - 7, '%d' % low, TEXT)
+
+    for (i, (name, colour, points)) in enumerate(lines):
+        rgb = _rgb(colour)
+        for (start, end) in zip(points, points[1:]):
+            canvas.line(start, end, rgb)
+        canvas.rect(LEGEND_LEFT, PLOT_TOP + i * 12, 8, 8, rgb)
+        canvas.text(LEGEND_LEFT + 12, PLOT_TOP + i * 12, name[:16], TEXT)
+
+    return canvas.png()
+
+
+def render_svg(series, max_points=None):
+    (low, high), lines = _layout(series, max_points)
+
+    def escape(text):
+        return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+    parts = ['<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d">' % (WIDTH, HEIGHT),
+             '<rect width="100%" height="100%" fill="white"/>',
+             '<polyline points="%d,%d %d,%d %d,%d" fill="none" stroke="#a0a0a0"/>' % (
+                 PLOT_LEFT, PLOT_TOP, PLOT_LEFT, PLOT_BOTTOM, PLOT_RIGHT, PLOT_BOTTOM),
+             '<text x="2" y="%d" font-size="10">%d</text>' % (PLOT_TOP + 8, high),
+             '<text x="2" y="%d" font-size="10">%d</text>' % (PLOT_BOTTOM, low)]
+    for (i, (name, colour, points)) in enumerate(lines):
+        parts.append('<polyline points="%s" fill="none" stroke="#%s" stroke-width="2"/>' % (
+            ' '.join('%.1f,%.1f' % p for p in points), colour))
+        parts.append('<rect x="%d" y="%d" width="8" height="8" fill="#%s"/>' % (
+            LEGEND_LEFT, PLOT_TOP + i * 12, colour))
+        parts.append('<text x="%d" y="%d" font-size="10">%s</text>' % (
+            LEGEND_LEFT + 12, PLOT_TOP + i * 12 + 8, escape(name)))
+    parts.append('</svg>')
+
+    return '\n'.join(parts)
+
+
+RENDERERS = {
+    'png': render_png,
+    'svg': render_svg
+}
+
+
+def _write_file(path, data):
+    """
+    Writes data to path through a temporary file of its own, so a chart is
+    never served half written and workers writing the same chart at once
+    never write to the same file.
+    """
+    f = tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix=os.path.basename(path) + '.',
+                                    suffix='.tmp', delete=False)
+    try:
+        with f:
+            f.write(data)
+        # Readable by whatever serves the directory
+        os.chmod(f.name, 0644)
+        os.rename(f.name, path)
+    except:
+        if os.path.exists(f.name):
+            os.remove(f.name)
+        raise
+
+
+def publish_command(command):
+    """
+    Returns a publish function for ChartCache that runs command with the
+    path of a chart, like a script copying it to static hosting, and uses
+    what it prints as the url of the chart.
+    """
+    def publish(path):
+        return check_output([command, path]).strip()
+    return publish
+
+
+class ChartCache(object):
+    """
+    Renders charts into directory, named by a hash of what they show, and
+    returns their url under base_url. Charts that have already been
+    rendered are not rendered again.
+
+    If publish is given, it is called with the path of every newly
+    rendered chart and returns the url to use for it, for example after
+    uploading it somewhere; the url is remembered next to the chart.
+    """
+
+    def __init__(self, directory, base_url='', fmt='png', publish=None):
+        self._directory = directory
+        self._base_url = base_url
+        self._fmt = fmt
+        self._publish = publish
+
+    def get_chart_url(self, series, max_points=None):
+        key = hashlib.sha1(json.dumps(
+            [self._fmt, WIDTH, HEIGHT, max_points, series], sort_keys=True)).hexdigest()
+        path = os.path.join(self._directory, '%s.%s' % (key, self._fmt))
+        url_path = path + '.url'
+
+        if os.path.exists(url_path):
+            with open(url_path) as f:
+                return f.read()
+        if os.path.exists(path) and not self._publish:
+            return self._base_url + os.path.basename(path)
+
+        if not os.path.isdir(self._directory):
+            try:
+                os.makedirs(self._directory)
+            except OSError:
+                # Unless another worker just made it
+                if not os.path.isdir(self._directory):
+                    raise
+        _write_file(path, RENDERERS[self._fmt](series, max_points))
+
+        if self._publish:
+            url = self._publish(path)
+            _write_file(url_path, url)
+            return url
+
+        return self._base_url + os.path.basename(path)
+
+
+if __name__ == '__main__':
+    sys.stdout.write(RENDERERS[sys.argv[1] if len(sys.argv) > 1 else 'png']([
+        ('perl', [1141, 1141, 1162, 1168, 1168, 1190, 1197, 1208, 1232, 1230, 1263, 1260, 1258, 1287, 1301, 1326]),
+        ('larchii', [1445, 1446, 1487, 1483, 1483, 1491, 1491, 1530, 1540, 1530, 1649, 1717, 1717, 1717, 1717, 1737])
+    ]))
@@ -0,0 +1,133 @@
+"""
+Opening connections to the rankme and log databases, which the game
+server and its log plugin write to while the bot reads them.
+"""
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import profiling
+
+# Seconds to wait for the game server to release a lock
+BUSY_TIMEOUT = 10
+# Pages of the page cache, in KiB when negative
+CACHE_SIZE = -16000
+MMAP_SIZE = 64 * 1024 * 1024
+CACHED_STATEMENTS = 256
+
+
+def connect(path, read_only=False, wal=False, factory=profiling.TimedConnection, **kwargs):
+    """
+    Opens path with a larger page and statement cache, memory mapped
+    reads and a busy timeout, through a connection whose statements are
+    profiled.
+
+    Python 2.7's sqlite3 cannot open URIs, so a read_only connection is
+    one where query_only is set. wal switches the database to write ahead
+    logging, which lasts for every connection to it, so it must only be
+    set for files every writer can use it with.
+    """
+    kwargs.setdefault('timeout', BUSY_TIMEOUT)
+    kwargs.setdefault('cached_statements', CACHED_STATEMENTS)
+    connection = sqlite3.connect(path, factory=factory, **kwargs)
+    connection.execute('pragma cache_size=%d' % CACHE_SIZE)
+    connection.execute('pragma mmap_size=%d' % MMAP_SIZE)
+    if wal:
+        connection.execute('pragma journal_mode=wal')
+        connection.execute('pragma synchronous=normal')
+    if read_only:
+        connection.execute('pragma query_only=1')
+    return connection
+
+
+@contextmanager
+def immediate(connection):
+    """
+    Runs the block in a transaction that takes the write lock before
+    anything is read, so nothing it reads can change before it writes, and
+    commits it, or rolls it back if the block raises.
+
+    The sqlite3 module would commit before any DDL in the block, so it is
+    kept out of the way by switching the connection to autocommit for the
+    duration; the block must not commit itself.
+    """
+    isolation_level = connection.isolation_level
+    connection.isolation_level = None
+    try:
+        connection.execute('begin immediate')
+        try:
+            yield connection
+        except:
+            connection.execute('rollback')
+            raise
+        connection.execute('commit')
+    finally:
+        connection.isolation_level = isolation_level
+
+
+class ConnectionPool(object):
+    """
+    At most size connections to path, opened with connect and options as
+    they are first needed, handed to one thread at a time.
+    """
+
+    def __init__(self, path, size, **options):
+        self._path = path
+        self._options = options
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle = []
+
+    def acquire(self):
+        """
+        Waits for a connection to be free and returns it; give it back with
+        release.
+        """
+        self._slots.acquire()
+        try:
+            with self._lock:
+                if self._idle:
+                    return self._idle.pop()
+            return connect(self._path, check_same_thread=False, **self._options)
+        except:
+            self._slots.release()
+            raise
+
+    def release(self, connection):
+        # Whatever the last user left uncommitted, like after an error,
+        # must not hold a lock while the connection is idle
+        connection.rollback()
+        with self._lock:
+            self._idle.append(connection)
+        self._slots.release()
+
+    def close(self):
+        with self._lock:
+            for connection in self._idle:
+                connection.close()
+            self._idle = []
+
+
+def data_version(connection):
+    """
+    Returns a value that changes whenever another connection has committed
+    changes to the database connection is opened on.
+    """
+    return connection.execute('pragma data_version').fetchone()[0]
+
+
+class ChangeWatcher(object):
+    """
+    Tells whether another connection has committed changes to a database
+    since the last check, using a pragma that does not touch any table.
+    """
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._version = None
+
+    def changed(self):
+        version = data_version(self._connection)
+        changed = version != self._version
+        self._version = version
+        return changed
@@ -0,0 +1,45 @@
+"""
+The tables derived from the log database's events and rounds.
+
+Handlers only read them. They are refreshed by a single writer, the bot's
+background jobs or the ingester, so handlers can use read only
+connections to the database the game server's log plugin writes to.
+Those connections cannot create the tables, so the writer does with
+ensure_schema before any of them is opened.
+
+Usage: python derived.py <log db>
+"""
+import sys
+
+import db
+import event_rollup
+import kills
+import skill
+from event_rollup import EventRollup
+from kills import KillMatrix
+from skill import RatingStore
+
+
+def ensure_schema(connection):
+    """
+    Creates every derived table that does not exist yet, empty.
+    """
+    kills.ensure_schema(connection)
+    event_rollup.ensure_schema(connection)
+    skill.ensure_schema(connection)
+    connection.commit()
+
+
+def refresh(connection):
+    """
+    Folds what was logged since the last refresh into every derived table.
+    """
+    KillMatrix(connection).refresh()
+    EventRollup(connection).refresh()
+    RatingStore(connection).update()
+
+
+if __name__ == '__main__':
+    connection = db.connect(sys.argv[1])
+    refresh(connection)
+    connection.close()
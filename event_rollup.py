@@ -0,0 +1,95 @@
+import sys
+import sqlite3
+
+import db
+import incremental
+import partitions
+
+
+def ensure_schema(connection):
+    connection.execute("""
+        create table if not exists event_rollup (
+            type varchar(16) not null,
+            day date not null,
+            player_id varchar(16) not null,
+            round_id integer,
+            count integer not null,
+            primary key (type, day, player_id, round_id))""")
+    connection.execute("""
+        create index if not exists event_rollup_player_day_round
+        on event_rollup (player_id, day, round_id)""")
+    incremental.ensure_state_table(connection)
+    partitions.ensure_registry(connection)
+
+
+class EventRollup(object):
+    """
+    Per round, player, event type and day counts of the log database
+    events, kept up to date by folding in events added since the last
+    refresh.
+    """
+    STATE_NAME = 'event_rollup'
+
+    def __init__(self, connection):
+        self._connection = connection
+        ensure_schema(connection)
+
+    def refresh(self):
+        """
+        Folds events added since the last refresh into the rollup. Returns
+        the number of (round, player, type, day) rows that were touched.
+
+        The refresh state is read after taking the write lock, so
+        refreshes from other connections cannot fold the same events.
+        """
+        with db.immediate(self._connection):
+            return self._fold(incremental.get_last_id(self._connection, self.STATE_NAME))
+
+    def rebuild(self):
+        with db.immediate(self._connection):
+            return self._fold(0)
+
+    def _fold(self, last_id):
+        max_id = partitions.max_event_id(self._connection)
+        if max_id is None or max_id <= last_id:
+            return 0
+
+        new_events = """
+            select type, date(time), subject_id, round_id, count(*)
+            from %s
+            where id > ? and id <= ? and subject_id is not null
+            group by type, date(time), subject_id, round_id""" % partitions.events_source(self._connection, last_id)
+
+        cursor = self._connection.cursor()
+        if last_id == 0:
+            # Nothing to merge with when building from scratch
+            cursor.execute('delete from event_rollup')
+            cursor.execute("""
+                insert into event_rollup (type, day, player_id, round_id, count)
+                """ + new_events, (last_id, max_id))
+            incremental.set_last_id(self._connection, self.STATE_NAME, max_id)
+            return cursor.rowcount
+
+        rows = self._connection.execute(new_events, (last_id, max_id)).fetchall()
+        for (event_type, day, player_id, round_id, count) in rows:
+            cursor.execute("""
+                update event_rollup
+                set count = count + ?
+                where type = ? and day = ? and player_id = ? and round_id is ?""",
+                           (count, event_type, day, player_id, round_id))
+            if cursor.rowcount == 0:
+                cursor.execute("""
+                    insert into event_rollup (type, day, player_id, round_id, count)
+                    values (?, ?, ?, ?, ?)""", (event_type, day, player_id, round_id, count))
+
+        incremental.set_last_id(self._connection, self.STATE_NAME, max_id)
+
+        return len(rows)
+
+
+if __name__ == '__main__':
+    rollup = EventRollup(sqlite3.connect(sys.argv[2]))
+    if sys.argv[1] == 'rebuild':
+        print 'Rolled up %d rows.' % rollup.rebuild()
+    elif sys.argv[1] == 'refresh':
+        print 'Rolled up %d rows.' % rollup.refresh()
@@ -0,0 +1,116 @@
+"""
+A local stand-in for the gist part of the GitHub API, for publishing the
+ranking without touching a real gist.
+
+Usage: python fake_github.py [port]
+
+Runs the stand-in on its own with a gist called fake, printing what is
+written to it. Point the bot at it with GITHUB_API_URL=http://localhost:<port>,
+GIST_ID=fake and any GITHUB_API_TOKEN.
+"""
+import sys
+import json
+import time
+import threading
+import BaseHTTPServer
+import SocketServer
+
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class FakeGitHub(object):
+    """
+    Serves GET and PATCH of /gists/<id> for the gists it is given, a dict
+    of gist id to a dict of file name to content. Every PATCH is appended
+    to updates as (time, gist id, files) and passed to on_update, if
+    given.
+
+    The next fail_next requests are answered with a server error.
+    """
+
+    def __init__(self, gists=None, host='127.0.0.1', port=0, on_update=None):
+        self.gists = gists if gists is not None else {'fake': {'rank.tsv': ''}}
+        self.updates = []
+        self.requests = []
+        self.fail_next = 0
+        self._on_update = on_update
+        self._lock = threading.Lock()
+
+        fake = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def _respond(self, status, body):
+                body = json.dumps(body)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _handle(self):
+                body = self.rfile.read(int(self.headers.getheader('content-length') or 0))
+                (status, response) = fake._api_call(
+                    self.command, self.path, self.headers.getheader('authorization'),
+                    json.loads(body) if body else None)
+                self._respond(status, response)
+
+            do_GET = _handle
+            do_PATCH = _handle
+
+            def log_message(self, format, *args):
+                pass
+
+        self._http = _ThreadingHTTPServer((host, port), Handler)
+        self.api_url = 'http://%s:%d' % self._http.server_address
+
+    def start(self):
+        thread = threading.Thread(target=self._http.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self._http.shutdown()
+
+    def _gist(self, gist_id):
+        return {
+            'id': gist_id,
+            'files': dict((name, {'filename': name, 'content': content})
+                          for (name, content) in self.gists[gist_id].items())
+        }
+
+    def _api_call(self, method, path, authorization, data):
+        with self._lock:
+            self.requests.append((time.time(), method, path))
+            if self.fail_next:
+                self.fail_next -= 1
+                return 502, {'message': 'Server Error'}
+            if not authorization or not authorization.startswith('token '):
+                return 401, {'message': 'Requires authentication'}
+
+            parts = path.strip('/').split('/')
+            if len(parts) != 2 or parts[0] != 'gists' or parts[1] not in self.gists:
+                return 404, {'message': 'Not Found'}
+            gist_id = parts[1]
+
+            if method == 'PATCH':
+                files = dict((name, f['content']) for (name, f) in data['files'].items())
+                self.gists[gist_id].update(files)
+                self.updates.append((time.time(), gist_id, files))
+                if self._on_update:
+                    self._on_update(gist_id, files)
+
+            return 200, self._gist(gist_id)
+
+
+if __name__ == '__main__':
+    def print_update(gist_id, files):
+        for (name, content) in files.items():
+            print '%s/%s:\n%s\n' % (gist_id, name, content)
+
+    fake = FakeGitHub(port=int(sys.argv[1]) if len(sys.argv) > 1 else 0, on_update=print_update).start()
+    print 'GITHUB_API_URL=%s' % fake.api_url
+    while True:
+        time.sleep(60)
@@ -0,0 +1,343 @@
+"""
+A local stand-in for the parts of Slack the bot talks to: the auth.test,
+rtm.start and chat.postMessage Web API methods and the Real Time
+Messaging websocket.
+
+slackclient 1.0.2 always posts to https://slack.com/api/, so the bot is
+pointed at the stand-in through LocalSlackClient, or by setting
+SLACK_API_URL when running bot.py.
+
+Usage: python fake_slack.py [port]
+
+Runs the stand-in on its own, printing what the bot posts. Lines typed on
+standard input are sent to the bot as messages mentioning it.
+"""
+import sys
+import json
+import time
+import errno
+import base64
+import socket
+import struct
+import hashlib
+import urlparse
+import threading
+import BaseHTTPServer
+import SocketServer
+
+import requests
+from slackclient import SlackClient
+from slackclient._server import Server
+
+BOT_ID = 'U0BOT'
+BOT_NAME = 'rankme-bot'
+USER_ID = 'U0HUMAN'
+CHANNEL_ID = 'C0LANPARTY'
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+class LocalSlackRequest(object):
+    """
+    Posts Web API requests to api_url instead of https://slack.com/api/,
+    encoding them the way slackclient's SlackRequest does.
+    """
+
+    def __init__(self, api_url):
+        self._api_url = api_url.rstrip('/') + '/'
+
+    def do(self, token, request='?', post_data=None, domain=None):
+        post_data = dict(post_data or {})
+        for (k, v) in post_data.items():
+            if not isinstance(v, basestring):
+                post_data[k] = json.dumps(v)
+        post_data['token'] = token
+
+        return requests.post(self._api_url + request, data=post_data)
+
+
+class _LocalServer(Server):
+    def websocket_safe_read(self):
+        # Reading a plain, non blocking websocket that has nothing to read
+        # fails instead of returning nothing, like an encrypted one does
+        try:
+            return Server.websocket_safe_read(self)
+        except socket.error, e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return ''
+            raise
+
+
+class LocalSlackClient(SlackClient):
+    """
+    A SlackClient that talks to the Web API at api_url, like a FakeSlack's
+    api_url, and to whatever websocket its rtm.start returns.
+    """
+
+    def __init__(self, token, api_url):
+        SlackClient.__init__(self, token)
+        self.server = _LocalServer(token, False)
+        self.server.api_requester = LocalSlackRequest(api_url)
+
+
+class _WebSocket(object):
+    """
+    The server end of a websocket connection; only sends text frames and
+    answers pings and closes.
+    """
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._lock = threading.Lock()
+        self.closed = False
+
+    def handshake(self):
+        request = ''
+        while '\r\n\r\n' not in request:
+            data = self._connection.recv(4096)
+            if not data:
+                return False
+            request += data
+
+        headers = dict((name.strip().lower(), value.strip()) for (name, _, value) in
+                       [line.partition(':') for line in request.split('\r\n')[1:] if line])
+        accept = base64.b64encode(hashlib.sha1(headers['sec-websocket-key'] + WEBSOCKET_GUID).digest())
+        self._connection.sendall('HTTP/1.1 101 Switching Protocols\r\n'
+                                 'Upgrade: websocket\r\n'
+                                 'Connection: Upgrade\r\n'
+                                 'Sec-WebSocket-Accept: %s\r\n\r\n' % accept)
+        return True
+
+    def send(self, text, opcode=0x1):
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        length = len(text)
+        if length < 126:
+            header = struct.pack('>BB', 0x80 | opcode, length)
+        elif length < 1 << 16:
+            header = struct.pack('>BBH', 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack('>BBQ', 0x80 | opcode, 127, length)
+
+        with self._lock:
+            try:
+                self._connection.sendall(header + text)
+            except socket.error:
+                self.closed = True
+
+    def close(self):
+        try:
+            self._connection.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+    def _read(self, count):
+        data = ''
+        while len(data) < count:
+            chunk = self._connection.recv(count - len(data))
+            if not chunk:
+                raise EOFError()
+            data += chunk
+        return data
+
+    def serve(self):
+        """
+        Reads frames from the client until it closes the connection.
+        """
+        try:
+            while True:
+                (first, second) = struct.unpack('>BB', self._read(2))
+                opcode = first & 0x0f
+                length = second & 0x7f
+                if length == 126:
+                    (length,) = struct.unpack('>H', self._read(2))
+                elif length == 127:
+                    (length,) = struct.unpack('>Q', self._read(8))
+                mask = self._read(4) if second & 0x80 else '\x00' * 4
+                payload = ''.join(chr(ord(c) ^ ord(mask[i % 4]))
+                                  for (i, c) in enumerate(self._read(length)))
+
+                if opcode == 0x8:
+                    self.send(payload, 0x8)
+                    break
+                elif opcode == 0x9:
+                    self.send(payload, 0xa)
+        except (EOFError, socket.error):
+            pass
+        finally:
+            self.closed = True
+            self._connection.close()
+
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class FakeSlack(object):
+    """
+    Serves the Web API on api_url and the RTM websocket on a port of its
+    own. Messages sent with send_message go to every connected websocket
+    and every chat.postMessage is passed to on_post, if given, as
+    (time, channel, text, attachments).
+
+    api_latency seconds are spent on every Web API request, like a round
+    trip to Slack would. If rate_limit is given, chat.postMessage answers
+    ratelimited to posts beyond that many in a second, like Slack does.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, on_post=None, api_latency=0, rate_limit=None):
+        self._on_post = on_post
+        self._api_latency = api_latency
+        self._rate_limit = rate_limit
+        self._recent_posts = []
+        self.ratelimited = 0
+        self._websockets = []
+        self._lock = threading.Lock()
+        self._connected = threading.Condition(self._lock)
+        self.posted = []
+
+        fake = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.getheader('content-length') or 0))
+                params = dict((k, v[0]) for (k, v) in urlparse.parse_qs(body).items())
+                response = json.dumps(fake._api_call(self.path.split('/')[-1], params))
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._http = _ThreadingHTTPServer((host, port), Handler)
+        self._ws_listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._ws_listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._ws_listener.bind((host, 0))
+        self._ws_listener.listen(5)
+
+        self.api_url = 'http://%s:%d/api/' % self._http.server_address
+        self.websocket_url = 'ws://%s:%d/' % self._ws_listener.getsockname()
+
+    def start(self):
+        for target in (self._http.serve_forever, self._accept_websockets):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+        return self
+
+    def stop(self):
+        self._http.shutdown()
+        self._ws_listener.close()
+        with self._lock:
+            for ws in self._websockets:
+                ws.close()
+
+    def wait_connected(self, timeout=10):
+        """
+        Waits until a client has connected to the websocket; returns
+        whether one did.
+        """
+        deadline = time.time() + timeout
+        with self._connected:
+            while not self._websockets and time.time() < deadline:
+                self._connected.wait(deadline - time.time())
+            return bool(self._websockets)
+
+    def send_message(self, text, channel=CHANNEL_ID, user=USER_ID):
+        """
+        Sends a message event, as if user had written text in channel,
+        and returns the time it was sent.
+        """
+        event = json.dumps({
+            'type': 'message',
+            'channel': channel,
+            'user': user,
+            'text': text,
+            'ts': '%.6f' % time.time()
+        })
+        with self._lock:
+            self._websockets = [ws for ws in self._websockets if not ws.closed]
+            websockets = list(self._websockets)
+
+        sent = time.time()
+        for ws in websockets:
+            ws.send(event)
+        return sent
+
+    def mention(self, text, channel=CHANNEL_ID, user=USER_ID):
+        return self.send_message('<@%s> %s' % (BOT_ID, text), channel, user)
+
+    def _accept_websockets(self):
+        while True:
+            try:
+                (connection, _) = self._ws_listener.accept()
+            except socket.error:
+                return
+
+            ws = _WebSocket(connection)
+            if not ws.handshake():
+                continue
+            ws.send(json.dumps({'type': 'hello'}))
+            with self._connected:
+                self._websockets.append(ws)
+                self._connected.notify_all()
+
+            thread = threading.Thread(target=ws.serve)
+            thread.daemon = True
+            thread.start()
+
+    def _api_call(self, method, params):
+        if self._api_latency:
+            time.sleep(self._api_latency)
+
+        if method == 'auth.test':
+            return {'ok': True, 'user_id': BOT_ID, 'user': BOT_NAME,
+                    'team': 'LAN', 'team_id': 'T0LAN', 'url': 'https://lan.slack.com/'}
+        elif method == 'rtm.start':
+            return {
+                'ok': True,
+                'url': self.websocket_url,
+                'self': {'id': BOT_ID, 'name': BOT_NAME},
+                'team': {'id': 'T0LAN', 'name': 'LAN', 'domain': 'lan'},
+                'channels': [{'id': CHANNEL_ID, 'name': 'lanparty', 'members': [USER_ID, BOT_ID]}],
+                'groups': [],
+                'ims': [],
+                'users': [{'id': BOT_ID, 'name': BOT_NAME}, {'id': USER_ID, 'name': 'human'}]
+            }
+        elif method == 'chat.postMessage':
+            if self._rate_limit and self._is_ratelimited():
+                return {'ok': False, 'error': 'ratelimited'}
+            posted = (time.time(), params.get('channel'), params.get('text'),
+                      json.loads(params['attachments']) if 'attachments' in params else None)
+            with self._lock:
+                self.posted.append(posted)
+            if self._on_post:
+                self._on_post(*posted)
+            return {'ok': True, 'channel': params.get('channel'), 'ts': '%.6f' % posted[0]}
+
+        return {'ok': True}
+
+    def _is_ratelimited(self):
+        now = time.time()
+        with self._lock:
+            self._recent_posts = [at for at in self._recent_posts if at > now - 1]
+            if len(self._recent_posts) >= self._rate_limit:
+                self.ratelimited += 1
+                return True
+            self._recent_posts.append(now)
+            return False
+
+
+if __name__ == '__main__':
+    def print_post(_, channel, text, attachments):
+        print '%s: %s' % (channel, text if attachments is None else json.dumps(attachments))
+
+    fake = FakeSlack(port=int(sys.argv[1]) if len(sys.argv) > 1 else 0, on_post=print_post).start()
+    print 'SLACK_API_URL=%s' % fake.api_url
+    for line in iter(sys.stdin.readline, ''):
+        if line.strip():
+            fake.mention(line.strip())
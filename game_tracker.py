@@ -1,15 +1,44 @@
 import time
 
+from db import ChangeWatcher
+
+WEAPON_COLUMNS = [
+    'knife', 'glock', 'usp', 'p228', 'deagle',
+    'elite', 'fiveseven', 'm3', 'xm1014', 'mac10',
+    'tmp', 'mp5navy', 'ump45', 'p90', 'galil',
+    'ak47', 'sg550', 'famas', 'm4a1', 'aug',
+    'scout', 'sg552', 'awp', 'g3sg1', 'm249',
+    'hegrenade', 'flashbang', 'smokegrenade']
+
+STATS_COLUMNS = [
+    'steam', 'name', 'lastip', 'score', 'kills', 'deaths', 'suicides', 'tk',
+    'shots', 'hits', 'headshots', 'connected', 'rounds_tr', 'rounds_ct', 'lastconnect'] + \
+    WEAPON_COLUMNS + [
+    'head', 'chest', 'stomach', 'left_arm', 'right_arm',
+    'left_leg', 'right_leg', 'c4_planted', 'c4_exploded',
+    'c4_defused', 'ct_win', 'tr_win', 'hostages_rescued',
+    'vip_killed', 'vip_escaped', 'vip_played']
+
+# Stats summed up per player and game in game_result, besides rounds
+RESULT_COLUMNS = ['kills', 'deaths', 'suicides', 'tk', 'shots', 'hits', 'headshots', 'score'] + \
+    WEAPON_COLUMNS
+
 class GameTracker(object):
     def __init__(self, connection):
         self._connection = connection
+        self._watcher = ChangeWatcher(connection)
+        self._score = None
         self._last_score = None
         self._last_active = None
         self._is_active = False
 
     def check_active(self):
-        cursor = self._connection.cursor()
-        score = cursor.execute('select sum(score) from rankme').fetchone()[0]
+        # Only the game server writes scores, so there is no need to sum
+        # them unless it has written anything since the last check
+        if self._watcher.changed():
+            cursor = self._connection.cursor()
+            self._score = cursor.execute('select sum(score) from rankme').fetchone()[0]
+        score = self._score
         now = time.time()
 
         if not self._last_score is None and score != self._last_score:
@@ -39,33 +68,43 @@ class GameTracker(object):
         cursor.execute('insert into game (start_time) values (?)', (start_time,))
         game_id = cursor.lastrowid
 
-        cursor.execute("""insert into game_stats (game_id, steam,
-            name, lastip, score, kills, deaths, suicides, tk, shots, hits, headshots, connected, rounds_tr, rounds_ct, lastconnect,
-            knife,glock,usp,p228,deagle,
-            elite ,fiveseven ,m3 ,xm1014 ,mac10 ,
-            tmp ,mp5navy ,ump45 ,p90 ,galil ,
-            ak47 ,sg550 ,famas ,m4a1 ,aug ,
-            scout ,sg552 ,awp ,g3sg1 ,m249 ,
-            hegrenade ,flashbang ,smokegrenade , head ,
-            chest , stomach , left_arm , right_arm ,
-            left_leg , right_leg ,c4_planted ,c4_exploded ,
-            c4_defused ,ct_win , tr_win , hostages_rescued ,
-            vip_killed , vip_escaped , vip_played) select ?, steam,
-            name, lastip, score, kills, deaths, suicides, tk, shots, hits, headshots, connected, rounds_tr, rounds_ct, lastconnect,
-            knife,glock,usp,p228,deagle,
-            elite ,fiveseven ,m3 ,xm1014 ,mac10 ,
-            tmp ,mp5navy ,ump45 ,p90 ,galil ,
-            ak47 ,sg550 ,famas ,m4a1 ,aug ,
-            scout ,sg552 ,awp ,g3sg1 ,m249 ,
-            hegrenade ,flashbang ,smokegrenade , head ,
-            chest , stomach , left_arm , right_arm ,
-            left_leg , right_leg ,c4_planted ,c4_exploded ,
-            c4_defused ,ct_win , tr_win , hostages_rescued ,
-            vip_killed , vip_escaped , vip_played from rankme""", (game_id,))
+        # Only players whose stats differ from the previous snapshot are
+        # stored; game_snapshot fills in the rest
+        cursor.execute("""
+            insert into game_stats (game_id, %(columns)s)
+            select ?, %(columns)s
+            from rankme
+            where not exists (
+                select 1
+                from game_snapshot as previous
+                where
+                    previous.game_id = (select max(id) from game where id < ?)
+                    and %(unchanged)s)""" % {
+            'columns': ', '.join(STATS_COLUMNS),
+            'unchanged': ' and '.join(['previous.%s is rankme.%s' % (c, c) for c in STATS_COLUMNS])
+        }, (game_id, game_id))
         self._connection.commit()
 
     def _complete_game(self, end_time):
         cursor = self._connection.cursor()
         last_game_id = cursor.execute('select max(id) from game').fetchone()[0]
         cursor.execute('update game set end_time=? where id=?', (end_time, last_game_id))
+        cursor.execute("""
+            insert into game_result (game_id, steam, name, rounds, %(columns)s)
+            select
+                ?, lg.steam, lg.name,
+                lg.rounds_tr-pg.rounds_tr+lg.rounds_ct-pg.rounds_ct as rounds,
+                %(deltas)s
+            from rankme as lg
+            inner join game_snapshot as pg on lg.steam=pg.steam
+            where pg.game_id=? and rounds > 0""" % {
+            'columns': ', '.join(RESULT_COLUMNS),
+            'deltas': ', '.join(['lg.%s-pg.%s' % (c, c) for c in RESULT_COLUMNS])
+        }, (last_game_id, last_game_id))
+        cursor.execute("""
+            insert or replace into score_series (game_id, steam, score)
+            select game_result.game_id, game_result.steam, rankme.score
+            from game_result
+            inner join rankme on rankme.steam=game_result.steam
+            where game_result.game_id=?""", (last_game_id,))
         self._connection.commit()
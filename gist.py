@@ -0,0 +1,192 @@
+"""
+Publishes the ranking to a GitHub gist from a thread of its own.
+
+Publishing is asked for with schedule, and requests coming in quick
+succession, like the end of a game and an update_gist command, are
+published once. The ranking is only uploaded if it differs from what the
+gist already has, and failed uploads are retried with a growing delay.
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+import traceback
+import urllib2
+
+import db
+
+GITHUB_API_URL = 'https://api.github.com'
+# Seconds to wait for more requests before publishing
+DEBOUNCE = 30
+# Most seconds a publish is put off by requests that keep coming
+MAX_DELAY = 300
+MIN_BACKOFF = 10
+MAX_BACKOFF = 600
+TIMEOUT = 30
+
+
+def render_rank(connection):
+    rows = connection.cursor().execute("""
+        select
+            name,
+            case
+                when deaths > 0 then cast(kills as float)/deaths
+                else 0
+            end as kdr,
+            score
+        from rankme""")
+
+    return '\n'.join(['%s\t%.2f\t%d' % r for r in rows])
+
+
+def content_hash(text):
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return hashlib.sha1(text).hexdigest()
+
+
+class GistClient(object):
+    """
+    Reads and updates a gist through the GitHub API at api_url.
+    """
+
+    def __init__(self, api_token, gist_id, api_url=GITHUB_API_URL):
+        self._api_token = api_token
+        self._gist_url = '%s/gists/%s' % (api_url.rstrip('/'), gist_id)
+
+    def _request(self, method, data=None):
+        request = urllib2.Request(self._gist_url, data=json.dumps(data) if data is not None else None)
+        request.get_method = lambda: method
+        request.add_header('Authorization', 'token ' + self._api_token)
+        request.add_header('Accept', 'application/vnd.github.v3+json')
+        if data is not None:
+            request.add_header('Content-Type', 'application/json')
+
+        response = urllib2.urlopen(request, timeout=TIMEOUT)
+        try:
+            return json.load(response)
+        finally:
+            response.close()
+
+    def get(self):
+        """
+        Returns the gist's first file as (name, content).
+        """
+        files = self._request('GET')['files']
+        name = sorted(files.keys())[0]
+        return name, files[name].get('content')
+
+    def update(self, filename, content):
+        self._request('PATCH', {'files': {filename: {'content': content}}})
+
+
+class GistPublisher(object):
+    def __init__(self, client, db_path, debounce=DEBOUNCE):
+        self._client = client
+        self._db_path = db_path
+        self._debounce = debounce
+        self._changed = threading.Condition()
+        self._requested = None
+        self._due = None
+        self._stopped = False
+        self._thread = None
+        self._filename = None
+        self._published_hash = None
+
+    @classmethod
+    def from_environment(cls, db_path):
+        """
+        Returns a publisher for the gist GIST_ID, or None if GIST_ID or
+        GITHUB_API_TOKEN is not set. GITHUB_API_URL may point it at
+        another GitHub API, like a fake_github.py.
+        """
+        api_token = os.environ.get('GITHUB_API_TOKEN')
+        gist_id = os.environ.get('GIST_ID')
+        if not api_token or not gist_id:
+            return None
+
+        return cls(GistClient(api_token, gist_id, os.environ.get('GITHUB_API_URL', GITHUB_API_URL)),
+                   db_path)
+
+    def schedule(self, delay=None):
+        """
+        Asks for the ranking to be published in delay seconds, debounce by
+        default, unless another request comes in before that.
+        """
+        now = time.time()
+        delay = self._debounce if delay is None else delay
+        with self._changed:
+            if self._requested is None:
+                self._requested = now
+            self._due = min(now + delay, self._requested + MAX_DELAY)
+            self._changed.notify()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        with self._changed:
+            self._stopped = True
+            self._changed.notify_all()
+
+    def _wait_until_due(self):
+        """
+        Waits for a publish to become due; returns False once stopped.
+        """
+        with self._changed:
+            while not self._stopped:
+                if self._due is not None:
+                    remaining = self._due - time.time()
+                    if remaining <= 0:
+                        self._requested = self._due = None
+                        return True
+                    self._changed.wait(remaining)
+                else:
+                    self._changed.wait()
+            return False
+
+    def _retry_in(self, delay):
+        with self._changed:
+            if self._requested is None:
+                self._requested = time.time()
+            if self._due is None or self._due > time.time() + delay:
+                self._due = time.time() + delay
+
+    def publish(self, connection):
+        """
+        Uploads the ranking unless the gist already has it; returns
+        whether it was uploaded.
+        """
+        text = render_rank(connection)
+        text_hash = content_hash(text)
+        if self._filename is None:
+            (self._filename, content) = self._client.get()
+            self._published_hash = content_hash(content or '')
+
+        if text_hash == self._published_hash:
+            return False
+
+        self._client.update(self._filename, text)
+        self._published_hash = text_hash
+        return True
+
+    def _run(self):
+        # The connection belongs to this thread
+        connection = db.connect(self._db_path, read_only=True)
+        backoff = 0
+        while self._wait_until_due():
+            try:
+                if self.publish(connection):
+                    print 'Published the ranking to the gist.'
+                backoff = 0
+            except Exception:
+                print 'Unexpected error updating gist.'
+                print traceback.format_exc()
+                backoff = min(MAX_BACKOFF, backoff * 2 or MIN_BACKOFF)
+                self._retry_in(backoff)
+        connection.close()
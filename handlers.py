@@ -2,17 +2,23 @@ import sqlite3
 import sys
 import random
 import re
-import json
 import os
 
 from collections import defaultdict
-from collections import Counter
-from pack import bestPack
+from pack import random_pack, best_pack
 import linegraph
-from skill import get_skill_ranking
+from chart_render import ChartCache, publish_command
+from skill import get_skill_ranking, load_last_rounds, stored_ranking
+from kills import count_kills
+from router import parse_command
+from game_tracker import WEAPON_COLUMNS
+import profiling
 from custom_exceptions import HandlerInputException
 from subprocess import check_output, call
 
+IGNORED_WEAPONS = ['prop_physics_multiplayer', 'world']
+HISTORY_MAX_POINTS = 50
+
 
 def get_pid(name):
     return int(check_output(['pidof', '-x', name]))
@@ -30,12 +36,7 @@ def format_list(connection, query, header, format_str, params=()):
 
 
 def ranking(command, connection, **kwargs):
-    args = command.split(' ')
-    try:
-        name = ' '.join(args[1:])
-    except IndexError:
-        raise HandlerInputException('Error')
-
+    name = command.rest()
     order = 'desc'
 
     if name == 'orderby kdr':
@@ -90,57 +91,146 @@ def headshots(_, connection, **kwargs):
 
 
 def last_game(command, connection, **kwargs):
-    parts = command.split(' ')
-    try:
-        rel = int(parts[-1])
-    except ValueError:
-        rel = 1
+    rel = 1
+    for arg in command.args:
+        if arg.isdigit():
+            rel = int(arg)
+    full = 'full' in command.args
+
+    header = '%23s%7s%6s%7s%6s%5s%6s' % ('Nick', 'Rounds', 'Kills',
+                                         'Deaths', 'KDR', 'Hit%', 'Score')
+    row_format = '%2d. %19s%7d%6d%7d%6.02f%5.0f%6d'
+
+    cursor = connection.cursor()
+    game = cursor.execute('select id, end_time from game order by id desc limit 1 offset ?',
+                          (rel-1,)).fetchone()
+
+    if game is None or game[1] is None:
+        # No results until the game is over: compare with its start
+        table = format_list(connection, """
+                            select
+                                lg.name,
+                                lg.rounds_tr-pg.rounds_tr+lg.rounds_ct-pg.rounds_ct as rounds,
+                                lg.kills-pg.kills as kills,
+                                lg.deaths-pg.deaths as deaths,
+                                case
+                                    when lg.deaths-pg.deaths > 0 then (cast(lg.kills as float)-pg.kills)/(lg.deaths - pg.deaths)
+                                    else 0
+                                end as kdr,
+                                case
+                                    when lg.hits-pg.hits > 0 then (cast(lg.hits as float)-pg.hits)/(lg.shots - pg.shots)*100
+                                    else 0
+                                end as hits,
+                                lg.score-pg.score as score
+                            from rankme as lg
+                            inner join game_snapshot as pg on lg.steam=pg.steam
+                            where
+                                pg.game_id=?
+                                and rounds > 0
+                            order by score desc""",
+                            header, row_format, (game[0] if game else None,))
+
+        return '```\n' + table + '```\n:c4:'
 
     table = format_list(connection, """
                         select
-                            lg.name,
-                            lg.rounds_tr-pg.rounds_tr+lg.rounds_ct-pg.rounds_ct as rounds,
-                            lg.kills-pg.kills as kills,
-                            lg.deaths-pg.deaths as deaths,
+                            name,
+                            rounds,
+                            kills,
+                            deaths,
                             case
-                                when lg.deaths-pg.deaths > 0 then (cast(lg.kills as float)-pg.kills)/(lg.deaths - pg.deaths)
+                                when deaths > 0 then cast(kills as float)/deaths
                                 else 0
                             end as kdr,
                             case
-                                when lg.hits-pg.hits > 0 then (cast(lg.hits as float)-pg.hits)/(lg.shots - pg.shots)*100
+                                when hits > 0 then cast(hits as float)/shots*100
                                 else 0
                             end as hits,
-                            lg.score-pg.score as score
-                        from rankme as lg
-                        inner join game_stats as pg on lg.steam=pg.steam
-                        where
-                            pg.game_id=(select id from game order by id desc limit 100 offset ?)
-                            and rounds > 0
+                            score
+                        from game_result
+                        where game_id=?
                         order by score desc""",
-                        '%23s%7s%6s%7s%6s%5s%6s' %
-                        ('Nick', 'Rounds', 'Kills',
-                         'Deaths', 'KDR', 'Hit%', 'Score'),
-                        '%2d. %19s%7d%6d%7d%6.02f%5.0f%6d',
-                        (rel-1,))
+                        header, row_format, (game[0],))
+
+    if full:
+        table += '\n\n' + _game_weapons_table(connection, game[0])
 
     return '```\n' + table + '```\n:c4:'
 
 
-def history(_, connection, **kwargs):
+def _game_weapons_table(connection, game_id):
     cursor = connection.cursor()
-    game_scores = cursor.execute("""
-        select rankme.name, IFNULL(game_stats.score, 1000)
-        from rankme, game
-        left outer join game_stats on rankme.steam=game_stats.steam and game.id=game_stats.game_id
-        order by rankme.name, game_id
-        """).fetchall()
+    rows = cursor.execute("""
+        select name, headshots, %s
+        from game_result
+        where game_id=?
+        order by score desc""" % ', '.join(WEAPON_COLUMNS), (game_id,)).fetchall()
 
-    games = defaultdict(list)
-    for name, score in game_scores:
-        games[name].append(score)
-    series = games.items()
+    lines = ['%23s%7s  %s' % ('Nick', 'HShots', 'Kills by weapon')]
+    i = 1
+    for row in rows:
+        weapon_kills = sorted([(kills, weapon) for (weapon, kills)
+                               in zip(WEAPON_COLUMNS, row[2:]) if kills > 0], reverse=True)
+        lines.append('%2d. %19s%7d  %s' % (
+            i, row[0], row[1], ', '.join(['%s %d' % (weapon, kills) for (kills, weapon) in weapon_kills])))
+        i += 1
 
-    graph_url = linegraph.get_chart_url(series)
+    return '\n'.join(lines)
+
+
+def history(command, connection, **kwargs):
+    cursor = connection.cursor()
+
+    top = re.match('top\\s+(\\d+)$', command.rest())
+    if top:
+        players = cursor.execute('select steam, name from rankme order by score desc limit ?',
+                                 (int(top.group(1)),)).fetchall()
+    elif command.args:
+        separator = ',' if ',' in command.rest() else None
+        names = [n.strip() for n in command.rest().split(separator)]
+        players = cursor.execute(('select steam, name from rankme where lower(name) in (' +
+                                  ','.join('?' * len(names)) + ')'), names).fetchall()
+        unknown = set(names) - set(name.lower() for (_, name) in players)
+        if unknown:
+            raise HandlerInputException('I do not know anyone called %s' % ', '.join(sorted(unknown)))
+    else:
+        players = cursor.execute('select steam, name from rankme').fetchall()
+
+    game_ids = [game_id for (game_id,) in cursor.execute('select id from game order by id')]
+    if not players or not game_ids:
+        return 'There is no score history to chart yet.'
+
+    # Only the scores of the players charted, in game order for each
+    sql = 'select steam, game_id, score from score_series'
+    params = []
+    if top or command.args:
+        params = [steam for (steam, _) in players]
+        sql += ' where steam in (%s)' % ','.join('?' * len(params))
+    position = dict((game_id, i) for (i, game_id) in enumerate(game_ids))
+    scores = defaultdict(list)
+    for (steam, game_id, score) in cursor.execute(sql + ' order by steam, game_id', params):
+        if game_id in position:
+            scores[steam].append((position[game_id], score))
+
+    # Players keep their score from the last game they played in
+    series = []
+    for (steam, name) in sorted(players, key=lambda (steam, name): name):
+        score = 1000
+        data = []
+        for (i, game_score) in scores[steam]:
+            data.extend([score] * (i - len(data)))
+            score = game_score
+        data.extend([score] * (len(game_ids) - len(data)))
+        series.append((name, data))
+
+    chart_dir = os.environ.get('CHART_CACHE_DIR')
+    if chart_dir:
+        publish = os.environ.get('CHART_PUBLISH_COMMAND')
+        chart_cache = ChartCache(chart_dir, os.environ.get('CHART_BASE_URL', ''),
+                                 publish=publish_command(publish) if publish else None)
+        graph_url = chart_cache.get_chart_url(series, HISTORY_MAX_POINTS)
+    else:
+        graph_url = linegraph.get_chart_url(series, HISTORY_MAX_POINTS)
 
     return [
         {
@@ -154,26 +244,14 @@ def history(_, connection, **kwargs):
 
 
 def skill(command, __, log_db_connection):
-    parts = command.split(' ')
-    if len(parts) > 1:
-        last = int(parts[1])
-    else:
-        last = None
-
-    cursor = log_db_connection.cursor()
-    rounds = cursor.execute("""
-        select win_team, lose_team 
-        from rounds 
-        where win_team is not null and lose_team is not null 
-        order by id""").fetchall()
+    last = int(command.arg(0, 0))
 
     if last:
-        rounds = rounds[-last:]
-
-    rounds = [(set(json.loads(win_team.decode('utf-8'))),
-               set(json.loads(lose_team.decode('utf-8')))) for (win_team, lose_team) in rounds]
+        skills = get_skill_ranking(load_last_rounds(log_db_connection, last))
+    else:
+        skills = stored_ranking(log_db_connection)
 
-    skills = get_skill_ranking(rounds)
+    cursor = log_db_connection.cursor()
     players = dict(cursor.execute(
         'select steam_id, name from players').fetchall())
     leaderboard = zip(range(1, len(skills) + 1), skills)
@@ -188,28 +266,42 @@ def skill(command, __, log_db_connection):
 def killers(_, __, log_db_connection):
     cursor = log_db_connection.cursor()
     killers = cursor.execute("""
-        select killer.name, (
-            select killed.steam_id
-            from players as killed
-            inner join events on subject_id=killed.steam_id
-            where events.type='player_death' and indirect_id=killer.steam_id
-            group by killed.name
-            order by count(events.id) desc
-            limit 1
-           ) as killed_id, killed.name, count(events.id) as kills
-        from players as killer
-        inner join events on type='player_death' and subject_id=killed_id and indirect_id=killer.steam_id
-        inner join players as killed on killed.steam_id=killed_id
-        group by killer.name, killed.name
+        select killer.name, victim.name, max(kill_matrix.kills) as kills
+        from kill_matrix
+        inner join players as killer on killer.steam_id = killer_id
+        inner join players as victim on victim.steam_id = victim_id
+        group by killer_id
         order by kills desc
         """).fetchall()
 
     return '```' + \
         '%16s%13s%6s' % ('Killer', 'Killed', 'Kills') + '\n' + \
-        '\n'.join(['%2d.%13s%13s%6d' % (i, killer, killed, kills) for (i, (killer, ___, killed, kills)) in zip(range(1, len(killers)), killers)]) + \
+        '\n'.join(['%2d.%13s%13s%6d' % (i, killer, killed, kills) for (i, (killer, killed, kills)) in zip(range(1, len(killers) + 1), killers)]) + \
         '```'
 
 
+def versus(command, __, log_db_connection):
+    if len(command.args) != 2:
+        raise HandlerInputException(
+            'you must supply two nicknames: vs <nick> <nick>')
+
+    cursor = log_db_connection.cursor()
+
+    def steam_ids(nick):
+        ids = [steam_id for (steam_id,) in cursor.execute(
+            'select steam_id from players where lower(name) = ?', (nick,))]
+        if not ids:
+            raise HandlerInputException('I do not know anyone called %s' % nick)
+        return ids
+
+    (nick1, nick2) = command.args
+    (ids1, ids2) = (steam_ids(nick1), steam_ids(nick2))
+
+    return '*%s* killed *%s* %d times\n*%s* killed *%s* %d times' % (
+        nick1, nick2, count_kills(log_db_connection, ids1, ids2),
+        nick2, nick1, count_kills(log_db_connection, ids2, ids1))
+
+
 def smokes(command, __, log_db_connection):
     return _events(command, __, log_db_connection, 'smokegrenade_detonate', 'No. Smokes', 'Smokes/round')
 
@@ -243,30 +335,31 @@ def radios(command, __, log_db_connection):
 
 
 def _events(command, __, log_db_connection, event, event_col_name, events_per_round_col_name):
-    args = command.split(' ')
-
-    start = args[1] if len(
-        args) > 1 and args[1] is not '' > 0 else '2017-01-01'
-    end = args[2] if len(args) > 2 else '2100-01-01'
+    start = command.arg(0, '2017-01-01')
+    end = command.arg(1, '2100-01-01')
 
     sql = """
-        select 
+        with counts as (
+            select player_id, sum(count) as n
+            from event_rollup
+            where
+            type = ?
+            and day between ? and ?
+            group by player_id),
+        rounds_played as (
+            select player_id, count(distinct round_id) as rounds
+            from event_rollup
+            where
+            player_id in (select player_id from counts)
+            and day between ? and ?
+            group by player_id)
+        select
             name,
-            count(*),
-            cast(count(*) as float) / (
-                select count(*) from (
-                    select 
-                        1
-                    from events 
-                    where 
-                    subject_id=players.steam_id
-                    and date(time) between ? and ?
-                    group by subject_id, round_id)) as epr
-        from events as e
-        inner join players on steam_id = subject_id
-        where
-        type = ?
-        and date(time) between ? and ?
+            sum(n),
+            cast(sum(n) as float) / sum(rounds) as epr
+        from counts
+        inner join rounds_played using (player_id)
+        inner join players on steam_id = player_id
         group by name
         order by epr desc
         """
@@ -274,41 +367,34 @@ def _events(command, __, log_db_connection, event, event_col_name, events_per_ro
     table = format_list(log_db_connection, sql,
                         '%20s%12s%14s' % (
                             'Nick', event_col_name, events_per_round_col_name),
-                        '%2d. %16s%12d%14.2f', (start, end, event, start, end))
+                        '%2d. %16s%12d%14.2f', (event, start, end, start, end))
 
     return '```\n' + table + '\n```'
 
 
 def weapons(command, _, log_db_connection):
-    args = command.split(' ')
-    try:
-        name = ' '.join(args[1:])
-    except IndexError:
+    name = command.rest()
+    if not name:
         raise HandlerInputException(
             'you must supply a nickname: weapons <nick>')
 
     cursor = log_db_connection.cursor()
-
-    kills = cursor.execute("""
+    weapon_stats = cursor.execute("""
         select
-            data
-        from events
-        inner join players on steam_id = indirect_id
+            weapon,
+            count(*) as kills
+        from kills
         where
-            type = 'player_death'
-            and name = '""" + name.replace("'", r"''") + """';
-    """).fetchall()
-
-    weapon_stats = [json.loads(data[0].decode('utf-8'))
-                    ['weapon'] for data in kills]
-    weapon_stats_dict = dict(Counter(weapon_stats))
-
-    clean_weapon_stats(weapon_stats_dict)
+            killer_id in (select steam_id from players where lower(name) = ?)
+            and weapon not in (%s)
+        group by weapon
+        order by kills desc, weapon desc""" % ','.join('?' * len(IGNORED_WEAPONS)),
+                                  [name] + IGNORED_WEAPONS).fetchall()
 
     lines = ['%19s%8s' % ('Weapon', 'Kills')]
 
     i = 1
-    for key, value in sorted(weapon_stats_dict.iteritems(), key=lambda (k, v): (v, k), reverse=True):
+    for key, value in weapon_stats:
         lines.append('%2s. %15s%8s' % (i, key, value))
         i = i + 1
 
@@ -317,14 +403,6 @@ def weapons(command, _, log_db_connection):
     return '```\n' + table + '```\n'
 
 
-def clean_weapon_stats(weapon_stats_dict):
-    remove = ['prop_physics_multiplayer', 'world']
-
-    for to_remove in remove:
-        if to_remove in weapon_stats_dict:
-            del weapon_stats_dict[to_remove]
-
-
 def restart_server(command, _, **kwargs):
     pid = None
     try:
@@ -333,14 +411,17 @@ def restart_server(command, _, **kwargs):
     except:
         pass
 
-    args = command.split(' ')
-    start_level = args[1]
+    start_level = command.arg(0, '')
     if not re.match(r'^[A-Za-z0-9_]+$', start_level):
         raise Exception('That does not look like a proper level name.')
 
     os.system('/home/cstrk/run-server.sh %s &' % start_level)
 
-    return '%sI think we are now running %s' % ('Killed process group %d and ' % pid if pid else '', args[1])
+    return '%sI think we are now running %s' % ('Killed process group %d and ' % pid if pid else '', start_level)
+
+
+def stats(command, _, **kwargs):
+    return '```\n' + profiling.report() + '```'
 
 
 def make_teams(command, connection, **kwargs):
@@ -360,15 +441,15 @@ def make_teams(command, connection, **kwargs):
 
         return guests
 
-    use_kdr = re.search('\\skdr\\s', command)
+    use_kdr = re.search('\\skdr\\s', command.text)
     scoring = '''case
                 when deaths > 0 then cast(kills as float)/deaths 
                 else 0
             end as score''' if use_kdr else 'score'
     diff_per_player = 0.1 if use_kdr else 10
-    excludes = re.search('exclude(s|) (([^,;]+,*\\s*)+)', command)
-    includes = re.search('include(s|) (([^,;]+,*\\s*)+)', command)
-    guests = re.search('guest(s|) (([^,;]+,*\\s*)+)', command)
+    excludes = re.search('exclude(s|) (([^,;]+,*\\s*)+)', command.text)
+    includes = re.search('include(s|) (([^,;]+,*\\s*)+)', command.text)
+    guests = re.search('guest(s|) (([^,;]+,*\\s*)+)', command.text)
     if excludes:
         params = [s.lower() for s in re.split(',\\s*', excludes.group(2))]
         sql = ('select name, %s from rankme where lower(name) not in (' % scoring) + \
@@ -389,13 +470,8 @@ def make_teams(command, connection, **kwargs):
         print guests
         nicks = nicks + guests
 
-    unfiltered_candidates = bestPack(nicks)
-    candidates = [(teams, d) for (teams, d)
-                  in unfiltered_candidates if d < len(nicks) * diff_per_player]
-    if len(candidates) == 0:
-        candidates = [unfiltered_candidates[0]]
-
-    ((team1, team2), team_diff) = random.choice(candidates)
+    ((team1, team2), team_diff) = random_pack(nicks, len(nicks) * diff_per_player) or \
+        best_pack(nicks)
     sides = ['Terrorists', 'Counter Terrorists']
     side1 = random.choice(sides)
     side2 = [s for s in sides if s != side1][0]
@@ -410,7 +486,7 @@ def make_teams(command, connection, **kwargs):
 if __name__ == "__main__":
     db_connection = sqlite3.connect('sample_db.sq3')
     log_db_connection = sqlite3.connect('sample-log.db.sq3')
-    command, arguments = sys.argv[1], ' '.join(sys.argv[1:])
+    command = parse_command(' '.join(sys.argv[1:]))
 
-    print locals()[command](arguments, db_connection,
+    print locals()[sys.argv[1]](command, db_connection,
                             log_db_connection=log_db_connection)
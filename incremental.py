@@ -0,0 +1,32 @@
+"""
+Bookkeeping for tables derived from an append-only source table.
+
+Each derived table remembers the id of the last source row it has folded,
+so refreshing only has to look at rows added since then. The table
+keeping it is created by ensure_state_table, which the derived tables
+call when they are created, so reading and writing it never runs DDL in
+the middle of a transaction.
+"""
+
+
+def ensure_state_table(connection):
+    connection.execute("""
+        create table if not exists refresh_state (
+            name text primary key,
+            last_id integer not null)""")
+
+
+def get_last_id(connection, name):
+    row = connection.execute(
+        'select last_id from refresh_state where name=?', (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def set_last_id(connection, name, last_id):
+    connection.execute(
+        'insert or replace into refresh_state (name, last_id) values (?, ?)',
+        (name, last_id))
+
+
+def reset(connection, name):
+    connection.execute('delete from refresh_state where name=?', (name,))
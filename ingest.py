@@ -0,0 +1,609 @@
+"""
+Reads game server logs into the log database, for backfilling rounds the
+log plugin did not record.
+
+Usage: python ingest.py <log db> <log file>...
+
+Log files are in the format srcds writes to its logs directory, and may
+be gzipped; - reads standard input. Lines are read, parsed and written in
+a pipeline of generators, so memory use does not grow with the size of
+the logs. Events are written in batches of BATCH_SIZE, and every log is
+committed in a transaction of its own, together with the kills extracted
+from its events and a record of the log, so a log is never ingested
+twice, whether it is given again or ingesting is run again after failing
+part way. The other derived tables are brought up to date at the end;
+ratings are rated again from the first round if the logs had rounds
+played before ones already rated. When the logs look like they have more
+events than the database, the indexes on events are created again
+afterwards instead of kept up to date while writing. They are recorded in
+the database before they are dropped, so if ingesting is killed before
+creating them again, the next run does.
+
+Besides the kills, damage and bomb triggers srcds logs itself, lines like
+
+    L 01/15/2017 - 20:31:12: "nick<2><STEAM_0:1:1234><CT>" triggered "weapon_fire" (weapon "ak47")
+
+are read as events of that type, as long as it is one of EVENT_TYPES,
+with an optional against "<player>" as the indirect player and the
+properties as the event data.
+
+Logs are told apart by a hash of their first KEY_BYTES bytes, whatever
+they are called. A log that has grown since it was ingested, like the log
+of a map that was still being played, is ingested from where it was left
+off; a log that has changed in any other way is refused. A last line
+without a newline is left for when the log has grown.
+"""
+import os
+import re
+import sys
+import gzip
+import json
+import time
+import hashlib
+from cStringIO import StringIO
+
+import db
+import derived
+import partitions
+from kills import KillStore
+
+BATCH_SIZE = 10000
+# Events between commits when ingesting records that are not from a log
+COMMIT_EVERY = 500000
+# Bytes at the start of a log its hash is taken of
+KEY_BYTES = 64 * 1024
+# For guessing the number of events in a log from its size
+BYTES_PER_EVENT = 110
+GZIP_RATIO = 8
+
+EVENT_TYPES = set([
+    'item_pickup', 'weapon_fire', 'weapon_reload', 'player_jump', 'bomb_pickup',
+    'bomb_beginplant', 'bomb_planted', 'player_hurt', 'player_death', 'bomb_begindefuse',
+    'bomb_defused', 'weapon_zoom', 'bomb_dropped', 'player_avenged_teammate', 'player_blind',
+    'flashbang_detonate', 'hegrenade_detonate', 'player_radio', 'bomb_abortdefuse',
+    'smokegrenade_detonate', 'bomb_abortplant', 'player_falldamage', 'round_mvp', 'break_prop',
+    'bomb_exploded', 'break_breakable', 'player_decal', 'weapon_fire_on_empty'])
+
+# Player triggers srcds logs, and the events they are
+TRIGGERS = {
+    'Planted_The_Bomb': 'bomb_planted',
+    'Defused_The_Bomb': 'bomb_defused',
+    'Begin_Bomb_Defuse_With_Kit': 'bomb_begindefuse',
+    'Begin_Bomb_Defuse_Without_Kit': 'bomb_begindefuse',
+    'Got_The_Bomb': 'bomb_pickup',
+    'Spawned_With_The_Bomb': 'bomb_pickup',
+    'Dropped_The_Bomb': 'bomb_dropped'
+}
+
+TEAMS = {'CT': 'TERRORIST', 'TERRORIST': 'CT'}
+
+# Kinds of records parse_lines yields
+EVENT, ROUND_START, ROUND_END, ROUND_WON, NAME, TEAM, LEAVE = range(7)
+
+# Entries kept in each of the caches of parsed players and actions
+CACHE_SIZE = 10000
+
+_PLAYER_TOKEN = r'"(.*?<-?\d+><[^>]*><[^>]*>)"'
+_ACTION = re.compile(r'(killed|attacked|joined team|disconnected)'
+                     r'(?: ' + _PLAYER_TOKEN + r' with)? ?"?(.*?)"?( \(.*)?$')
+_TRIGGERED = re.compile(r'triggered "([^"]*)"(?: against ' + _PLAYER_TOKEN + r')?( \(.*)?$')
+_PLAYER = re.compile(r'(.*)<-?\d+><([^>]*)><([^>]*)>$')
+_PROPERTY = re.compile(r'\(([\w]+)(?: "([^"]*)")?\)')
+_WORLD = re.compile(r'World triggered "([^"]*)"')
+_TEAM_TRIGGERED = re.compile(r'Team "([^"]*)" triggered "([^"]*)"')
+
+# Damage properties, and the event data keys of the player_hurt event
+_HURT_KEYS = {'damage': 'dmg_health', 'damage_armor': 'dmg_armor',
+              'health': 'health', 'armor': 'armor', 'hitgroup': 'hitgroup'}
+
+
+def _lines(f, head):
+    try:
+        # Complete the last line of head
+        for line in StringIO(head + f.readline()):
+            yield line
+        for line in f:
+            yield line
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def log_key(head):
+    return hashlib.sha1(head[:KEY_BYTES]).hexdigest()
+
+
+def open_log(path):
+    """
+    Returns (head, lines) for the log at path: its first KEY_BYTES bytes,
+    uncompressed, and an iterator over its lines.
+    """
+    if path == '-':
+        f = sys.stdin
+    elif path.endswith('.gz'):
+        f = gzip.open(path, 'rb')
+    else:
+        f = open(path, 'rb')
+
+    head = f.read(KEY_BYTES)
+    return head, _lines(f, head)
+
+
+class _Counted(object):
+    """
+    Iterates over the lines that end with a newline, counting their bytes.
+    """
+
+    def __init__(self, lines):
+        self._lines = lines
+        self.bytes = 0
+
+    def __iter__(self):
+        for line in self._lines:
+            if not line.endswith('\n'):
+                # Still being written
+                break
+            self.bytes += len(line)
+            yield line
+
+    def skip(self, count):
+        """
+        Reads the first count bytes, which must end a line. Returns
+        whether there were that many.
+        """
+        lines = iter(self)
+        while self.bytes < count:
+            if next(lines, None) is None:
+                break
+        return self.bytes == count
+
+
+def read_lines(paths):
+    for path in paths:
+        for line in open_log(path)[1]:
+            yield line
+
+
+def _value(value):
+    if value is None:
+        return True
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def _properties(text):
+    return dict((key, _value(value)) for (key, value) in _PROPERTY.findall(text or ''))
+
+
+def _event_data(event_type, weapon, text):
+    """
+    Returns the event data, as JSON, of an event with the properties in
+    text, and for kills and damage, the weapon.
+    """
+    properties = _properties(text)
+    if event_type == 'player_death':
+        data = {'weapon': weapon, 'headshot': 'headshot' in properties}
+    elif event_type == 'player_hurt':
+        data = dict((_HURT_KEYS.get(key, key), value) for (key, value) in properties.items())
+        data['weapon'] = weapon
+    else:
+        data = properties
+    return json.dumps(data)
+
+
+def _parse_player(token):
+    """
+    Returns (name, steam id, team) of a player as it is logged, without
+    the quotes, or None if it is not a player.
+    """
+    match = _PLAYER.match(token)
+    if match is None:
+        return None
+    (name, steam_id, team) = match.groups()
+    return (name.decode('utf-8', 'replace'), steam_id, team)
+
+
+def _parse_action(text):
+    """
+    Parses what a player did, the part of a line after the player, into
+    the kind of record and what follows the player in it. For events,
+    that is the type, the data, the other player and whether the other
+    player is the subject.
+    """
+    if text.startswith('changed name to "'):
+        # Take the name as it is, even if it looks like it has properties
+        return (NAME, text[17:].rstrip('"').decode('utf-8', 'replace'))
+
+    match = _TRIGGERED.match(text)
+    if match:
+        (trigger, other, properties) = match.groups()
+        event_type = trigger if trigger in EVENT_TYPES else TRIGGERS.get(trigger)
+        if event_type:
+            return (EVENT, event_type, _event_data(event_type, None, properties), other, False)
+        return None
+
+    match = _ACTION.match(text)
+    if match is None:
+        return None
+    (action, other, argument, properties) = match.groups()
+
+    if other is None:
+        if action == 'joined team':
+            return (TEAM, argument)
+        elif action == 'disconnected':
+            return (LEAVE,)
+    elif action == 'killed':
+        return (EVENT, 'player_death', _event_data('player_death', argument, properties), other, True)
+    elif action == 'attacked':
+        return (EVENT, 'player_hurt', _event_data('player_hurt', argument, properties), other, True)
+    return None
+
+
+class _Cache(dict):
+    """
+    Remembers what f returns for the most common keys; all of them, until
+    there are CACHE_SIZE, when it starts over.
+    """
+
+    def __init__(self, f):
+        dict.__init__(self)
+        self._f = f
+
+    def __missing__(self, key):
+        if len(self) >= CACHE_SIZE:
+            self.clear()
+        value = self[key] = self._f(key)
+        return value
+
+
+def parse_lines(lines):
+    """
+    Yields a record for every line that says something the log database
+    keeps, as a tuple of the kind of record, the time and what follows.
+    Players are (name, steam id, team) tuples.
+
+    EVENT: type, data as JSON, subject, indirect player
+    ROUND_START, ROUND_END: nothing
+    ROUND_WON: the winning team
+    NAME: player, new name
+    TEAM: player, team joined
+    LEAVE: player
+
+    Players and what they do repeat a lot, like a player firing the same
+    weapon, so each is only parsed the first time it is seen.
+    """
+    players = _Cache(_parse_player)
+    actions = _Cache(_parse_action)
+
+    for line in lines:
+        # L 01/15/2017 - 20:31:12: <body>
+        if line[:2] != 'L ' or line[23:25] != ': ':
+            continue
+        at = line[8:12] + '-' + line[2:4] + '-' + line[5:7] + ' ' + line[15:23]
+        body = line[25:].rstrip('\r\n')
+
+        if body[:1] == '"':
+            end = body.find('>" ')
+            if end < 0:
+                continue
+            actor = players[body[1:end + 1]]
+            action = actions[body[end + 3:]]
+            if actor is None or action is None:
+                continue
+
+            kind = action[0]
+            if kind == EVENT:
+                other = players[action[3]] if action[3] else None
+                if action[4]:
+                    yield (EVENT, at, action[1], action[2], other, actor)
+                else:
+                    yield (EVENT, at, action[1], action[2], actor, other)
+            elif kind == LEAVE:
+                yield (LEAVE, at, actor)
+            else:
+                yield (kind, at, actor, action[1])
+            continue
+
+        match = _WORLD.match(body)
+        if match:
+            if match.group(1) == 'Round_Start':
+                yield (ROUND_START, at)
+            elif match.group(1) == 'Round_End':
+                yield (ROUND_END, at)
+            continue
+
+        match = _TEAM_TRIGGERED.match(body)
+        if match and match.group(1) in TEAMS:
+            yield (ROUND_WON, at, match.group(1))
+
+
+def _is_steam_id(steam_id):
+    return steam_id.startswith('STEAM_')
+
+
+class Ingester(object):
+    """
+    Writes records from parse_lines to a log database: players as they
+    show up or change names, a round from every round start to its end,
+    with the players that took part in it on the winning and losing team,
+    and events.
+    """
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._kills = KillStore(connection)
+        connection.execute("""
+            create table if not exists ingested_logs (
+                key text primary key,
+                path text not null,
+                bytes integer not null,
+                round text null,
+                ingested datetime not null)""")
+        connection.execute("""
+            create table if not exists deferred_indexes (
+                name text primary key,
+                sql text not null)""")
+        # Left behind by a run that never got to create them again
+        self._create_indexes()
+        self._names = dict(connection.execute('select steam_id, name from players'))
+        self._teams = {}
+        self._active = set()
+        self._round_id = None
+        self._round_open = False
+        self._winner = None
+        self._events = []
+        self._players = []
+        self._uncommitted = 0
+        self.events = 0
+        self.rounds = 0
+
+    def _player(self, player):
+        """
+        Notes the name and team of player and returns its steam id, or
+        None for bots and the console.
+        """
+        (name, steam_id, team) = player
+        if not _is_steam_id(steam_id):
+            return None
+        if self._names.get(steam_id) != name:
+            self._names[steam_id] = name
+            self._players.append((steam_id, name))
+        if team in TEAMS:
+            self._teams[steam_id] = team
+        self._active.add(steam_id)
+        return steam_id
+
+    def _flush(self, commit_every=None):
+        if self._players:
+            self._connection.executemany(
+                'insert or replace into players (steam_id, name) values (?, ?)', self._players)
+            self._players = []
+        if self._events:
+            self._connection.executemany("""
+                insert into events (round_id, time, type, data, subject_id, indirect_id)
+                values (?, ?, ?, ?, ?, ?)""", self._events)
+            self.events += len(self._events)
+            self._uncommitted += len(self._events)
+            self._events = []
+        if commit_every and self._uncommitted >= commit_every:
+            self._commit()
+
+    def _commit(self):
+        # Kills are extracted in the transaction their events are written in
+        self._kills.fold()
+        self._connection.commit()
+        self._uncommitted = 0
+
+    def _end_round(self, at):
+        if not self._round_open:
+            return
+
+        win_team = lose_team = None
+        if self._winner is not None:
+            win_team = json.dumps(sorted(steam_id for steam_id in self._active
+                                         if self._teams.get(steam_id) == self._winner))
+            lose_team = json.dumps(sorted(steam_id for steam_id in self._active
+                                          if self._teams.get(steam_id) == TEAMS[self._winner]))
+        self._connection.execute(
+            'update rounds set endtime=?, win_team=?, lose_team=? where id=?',
+            (at, win_team, lose_team, self._round_id))
+        self._round_open = False
+        self._winner = None
+
+    def _start_round(self, at):
+        self._end_round(at)
+        self._round_id = self._connection.execute(
+            'insert into rounds (starttime) values (?)', (at,)).lastrowid
+        self._round_open = True
+        self._active = set()
+        self.rounds += 1
+
+    def _ingested(self, head):
+        """
+        Returns (key, bytes, round) of the record of the log starting with
+        head, or None if it has not been ingested. The key of a log
+        shorter than KEY_BYTES is a hash of all of it, so it is compared
+        to the same part of head.
+        """
+        for (key, done, round_state) in self._connection.execute(
+                'select key, bytes, round from ingested_logs where key = ? or bytes < ?',
+                (log_key(head), KEY_BYTES)):
+            if len(head) >= min(done, KEY_BYTES) and key == log_key(head[:done]):
+                return (key, done, round_state)
+        return None
+
+    def _round_state(self):
+        """
+        Returns the round still being played, as JSON, or None.
+        """
+        if not self._round_open:
+            return None
+        return json.dumps({'id': self._round_id, 'winner': self._winner,
+                           'active': sorted(self._active), 'teams': self._teams})
+
+    def _resume_round(self, round_state):
+        """
+        Continues the round _round_state returned, when the end of a log
+        was ingested while it was being played.
+        """
+        if round_state is None:
+            self._round_open = False
+            return
+        state = json.loads(round_state)
+        self._round_id = state['id']
+        self._round_open = True
+        self._winner = state['winner']
+        self._active = set(state['active'])
+        self._teams = state['teams']
+
+    def _drop_indexes(self):
+        """
+        Drops the indexes on events, after committing what they are in
+        deferred_indexes.
+        """
+        indexes = self._connection.execute("""
+            select name, sql from sqlite_master
+            where type = 'index' and tbl_name = 'events' and sql is not null""").fetchall()
+        self._connection.executemany(
+            'insert or replace into deferred_indexes (name, sql) values (?, ?)', indexes)
+        self._connection.commit()
+        for (name, _) in indexes:
+            self._connection.execute('drop index %s' % name)
+
+    def _create_indexes(self):
+        """
+        Creates the indexes in deferred_indexes that do not exist.
+        """
+        indexes = self._connection.execute("""
+            select sql from deferred_indexes
+            where name not in (select name from sqlite_master where type = 'index')""").fetchall()
+        for (sql,) in indexes:
+            self._connection.execute(sql)
+        self._connection.execute('delete from deferred_indexes')
+        self._connection.commit()
+
+    def ingest(self, records, defer_indexes=False):
+        """
+        Writes records, committing every COMMIT_EVERY events. With
+        defer_indexes, the indexes on events are dropped while writing and
+        created again at the end, which is quicker when adding many events
+        to few.
+        """
+        if defer_indexes:
+            self._drop_indexes()
+        try:
+            self._ingest(records, COMMIT_EVERY)
+        finally:
+            self._flush()
+            self._commit()
+            self._create_indexes()
+
+    def ingest_logs(self, paths, defer_indexes=False):
+        """
+        Writes the logs at paths, each in a transaction of its own with a
+        record of it. Logs that have a record are only written from where
+        the last one left off. Returns the paths of the logs that had
+        nothing more to write.
+
+        Raises an exception, after writing the logs before it, for a log
+        that starts like one already ingested but is shorter than it was,
+        or does not end a line where it was left off.
+        """
+        if defer_indexes:
+            self._drop_indexes()
+        skipped = []
+        try:
+            for path in paths:
+                (head, lines) = open_log(path)
+                counted = _Counted(lines)
+                ingested = self._ingested(head)
+                if ingested:
+                    (key, done, round_state) = ingested
+                    if not counted.skip(done):
+                        lines.close()
+                        raise Exception('%s starts like a log ingested before, but does not '
+                                        'continue it; it was not ingested.' % path)
+                    self._resume_round(round_state)
+
+                try:
+                    self._ingest(parse_lines(counted))
+                    if ingested and counted.bytes == done:
+                        skipped.append(path)
+                        continue
+                    self._flush()
+                    if ingested:
+                        self._connection.execute('delete from ingested_logs where key = ?', (key,))
+                    if counted.bytes:
+                        self._connection.execute("""
+                            insert into ingested_logs (key, path, bytes, round, ingested)
+                            values (?, ?, ?, ?, datetime('now'))""",
+                                                 (log_key(head[:counted.bytes]), path, counted.bytes,
+                                                  self._round_state()))
+                    self._commit()
+                except:
+                    self._connection.rollback()
+                    raise
+        finally:
+            self._create_indexes()
+
+        return skipped
+
+    def _ingest(self, records, commit_every=None):
+        events = self._events
+        for record in records:
+            kind = record[0]
+            if kind == EVENT:
+                (_, at, event_type, data, subject, indirect) = record
+                events.append((self._round_id, at, event_type, data,
+                               self._player(subject), indirect and self._player(indirect)))
+                if len(events) >= BATCH_SIZE:
+                    self._flush(commit_every)
+                    events = self._events
+            elif kind == ROUND_START:
+                self._start_round(record[1])
+            elif kind == ROUND_END:
+                self._end_round(record[1])
+            elif kind == ROUND_WON:
+                self._winner = record[2]
+            elif kind == NAME:
+                steam_id = self._player(record[2])
+                if steam_id:
+                    self._player((record[3], steam_id, record[2][2]))
+            elif kind == TEAM:
+                steam_id = self._player(record[2])
+                if steam_id:
+                    self._teams.pop(steam_id, None)
+                    self._player((record[2][0], steam_id, record[3]))
+            elif kind == LEAVE:
+                self._teams.pop(record[2][1], None)
+
+
+def should_defer_indexes(connection, paths):
+    """
+    Guesses whether the logs at paths have more events than the database.
+    """
+    if '-' in paths:
+        return False
+
+    size = sum(os.path.getsize(path) * (GZIP_RATIO if path.endswith('.gz') else 1)
+               for path in paths)
+    events = partitions.max_event_id(connection) or 0
+    return size / BYTES_PER_EVENT > events
+
+
+if __name__ == '__main__':
+    connection = db.connect(sys.argv[1])
+    ingester = Ingester(connection)
+
+    start = time.time()
+    skipped = ingester.ingest_logs(sys.argv[2:], should_defer_indexes(connection, sys.argv[2:]))
+    elapsed = time.time() - start
+    for path in skipped:
+        print 'Skipped %s, which was already ingested.' % path
+    print 'Ingested %d events in %d rounds in %.1fs, %d events/s.' % (
+        ingester.events, ingester.rounds, elapsed, ingester.events / max(elapsed, 1e-6))
+
+    derived.refresh(connection)
+    connection.close()
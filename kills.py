@@ -0,0 +1,197 @@
+import sys
+import json
+import sqlite3
+
+import db
+import incremental
+import partitions
+
+BATCH_SIZE = 10000
+
+
+def ensure_schema(connection):
+    """
+    Creates the kills table and the kill matrix counted from it.
+    """
+    connection.execute("""
+        create table if not exists kills (
+            event_id integer primary key,
+            killer_id varchar(16) null,
+            victim_id varchar(16) null,
+            weapon varchar(32) null,
+            round_id integer,
+            time datetime)""")
+    connection.execute("""
+        create index if not exists kills_killer_weapon on kills (killer_id, weapon)""")
+    connection.execute("""
+        create index if not exists kills_killer_victim on kills (killer_id, victim_id)""")
+    connection.execute("""
+        create index if not exists kills_time on kills (time)""")
+    connection.execute("""
+        create table if not exists kill_matrix (
+            killer_id varchar(16) not null,
+            victim_id varchar(16) not null,
+            kills integer not null,
+            primary key (killer_id, victim_id))""")
+    incremental.ensure_state_table(connection)
+    partitions.ensure_registry(connection)
+
+
+def count_kills(connection, killer_ids, victim_ids):
+    """
+    Returns the number of times any of killer_ids killed any of
+    victim_ids, as counted by KillMatrix. Only reads the kill matrix.
+    """
+    total = 0
+    for killer_id in killer_ids:
+        for victim_id in victim_ids:
+            row = connection.execute(
+                'select kills from kill_matrix where killer_id = ? and victim_id = ?',
+                (killer_id, victim_id)).fetchone()
+            if row:
+                total += row[0]
+
+    return total
+
+
+class KillStore(object):
+    """
+    One row per player_death event in the log database, with the weapon
+    extracted from the event data, so kills can be aggregated in SQL
+    without decoding every event.
+
+    The ingester extracts kills in the transaction it writes their events
+    in; derived.refresh extracts the ones the log plugin writes.
+    """
+    STATE_NAME = 'kills'
+
+    def __init__(self, connection):
+        self._connection = connection
+        ensure_schema(connection)
+
+    def refresh(self):
+        """
+        Extracts kills from player_death events added since the last
+        refresh. Returns the number of kills added.
+        """
+        with db.immediate(self._connection):
+            return self.fold()
+
+    def rebuild(self):
+        with db.immediate(self._connection):
+            self._connection.execute('delete from kills')
+            incremental.reset(self._connection, self.STATE_NAME)
+            return self.fold()
+
+    def fold(self):
+        """
+        Like refresh, but in the transaction the caller holds the write
+        lock in, so the refresh state cannot change while it is read.
+        """
+        last_id = incremental.get_last_id(self._connection, self.STATE_NAME)
+        max_id = partitions.max_event_id(self._connection)
+        if max_id is None or max_id <= last_id:
+            return 0
+
+        events = self._connection.cursor()
+        events.execute("""
+            select id, indirect_id, subject_id, data, round_id, time
+            from %s
+            where type = 'player_death' and id > ? and id <= ?""" % partitions.events_source(self._connection, last_id),
+                       (last_id, max_id))
+
+        count = 0
+        while True:
+            rows = events.fetchmany(BATCH_SIZE)
+            if not rows:
+                break
+
+            self._connection.executemany("""
+                insert or replace into kills (event_id, killer_id, victim_id, weapon, round_id, time)
+                values (?, ?, ?, ?, ?, ?)""",
+                                         [(event_id, killer_id, victim_id, extract_weapon(data), round_id, time)
+                                          for (event_id, killer_id, victim_id, data, round_id, time) in rows])
+            count += len(rows)
+
+        incremental.set_last_id(self._connection, self.STATE_NAME, max_id)
+
+        return count
+
+
+class KillMatrix(object):
+    """
+    Number of kills for every killer and victim pair, folded in from the
+    kills table as it grows.
+    """
+    STATE_NAME = 'kill_matrix'
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._kills = KillStore(connection)
+
+    def refresh(self):
+        """
+        Refreshes the kills table and counts kills added since the last
+        refresh. Returns the number of pairs that were touched.
+        """
+        with db.immediate(self._connection):
+            self._kills.fold()
+            return self._fold(incremental.get_last_id(self._connection, self.STATE_NAME))
+
+    def rebuild(self):
+        with db.immediate(self._connection):
+            self._kills.fold()
+            return self._fold(0)
+
+    def _fold(self, last_id):
+        max_id = self._connection.execute('select max(event_id) from kills').fetchone()[0]
+        if max_id is None or max_id <= last_id:
+            return 0
+
+        new_kills = """
+            select killer_id, victim_id, count(*)
+            from kills
+            where
+                event_id > ? and event_id <= ?
+                and killer_id is not null and victim_id is not null
+            group by killer_id, victim_id"""
+
+        cursor = self._connection.cursor()
+        if last_id == 0:
+            cursor.execute('delete from kill_matrix')
+            cursor.execute('insert into kill_matrix (killer_id, victim_id, kills) ' + new_kills,
+                           (last_id, max_id))
+            incremental.set_last_id(self._connection, self.STATE_NAME, max_id)
+            return cursor.rowcount
+
+        rows = self._connection.execute(new_kills, (last_id, max_id)).fetchall()
+        for (killer_id, victim_id, kills) in rows:
+            cursor.execute("""
+                update kill_matrix
+                set kills = kills + ?
+                where killer_id = ? and victim_id = ?""", (kills, killer_id, victim_id))
+            if cursor.rowcount == 0:
+                cursor.execute("""
+                    insert into kill_matrix (killer_id, victim_id, kills)
+                    values (?, ?, ?)""", (killer_id, victim_id, kills))
+
+        incremental.set_last_id(self._connection, self.STATE_NAME, max_id)
+
+        return len(rows)
+
+
+def extract_weapon(data):
+    if data is None:
+        return None
+
+    return json.loads(data.decode('utf-8')).get('weapon')
+
+
+if __name__ == '__main__':
+    connection = sqlite3.connect(sys.argv[2])
+    if sys.argv[1] == 'rebuild':
+        print 'Extracted %d kills.' % KillStore(connection).rebuild()
+        print 'Counted %d killer/victim pairs.' % KillMatrix(connection).rebuild()
+    elif sys.argv[1] == 'refresh':
+        print 'Extracted %d kills.' % KillStore(connection).refresh()
+        print 'Counted %d killer/victim pairs.' % KillMatrix(connection).refresh()
@@ -1,17 +1,68 @@
-from pygooglechart import SimpleLineChart
+from pygooglechart import SimpleLineChart, XYLineChart
 
 colors = ['7cb5ec', '434348', '90ed7d', 'f7a35c', '8085e9',
    'f15c80', 'e4d354', '2b908f', 'f45b5b', '91e8e1']
 
-def get_chart_url(series):
-    chart = SimpleLineChart(400, 200)
+def downsample(data, threshold):
+    """
+    Picks at most threshold points of data, a list of (x, y) pairs sorted
+    on x, that preserve the shape of the line, using the largest triangle
+    three buckets algorithm. The first and last points are always kept.
+    """
+    if threshold >= len(data) or threshold < 3:
+        return data
+
+    sampled = [data[0]]
+    bucket_size = float(len(data) - 2) / (threshold - 2)
+    a = 0
+    for i in xrange(threshold - 2):
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+
+        # Average of the next bucket, which the triangle's third point
+        next_start = end
+        next_end = min(int((i + 2) * bucket_size) + 1, len(data))
+        next_bucket = data[next_start:next_end]
+        avg_x = sum(x for (x, _) in next_bucket) / float(len(next_bucket))
+        avg_y = sum(y for (_, y) in next_bucket) / float(len(next_bucket))
+
+        (ax, ay) = data[a]
+        best_area = -1
+        for j in xrange(start, end):
+            (x, y) = data[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best_area = area
+                best = j
+
+        sampled.append(data[best])
+        a = best
+
+    sampled.append(data[-1])
+    return sampled
+
+
+def get_chart_url(series, max_points=None):
+    """
+    series is a list of (name, values) pairs. If max_points is given, each
+    series is downsampled to at most that many points, keeping the url
+    short however long the series are.
+    """
+    if max_points is None:
+        chart = SimpleLineChart(400, 200)
+    else:
+        chart = XYLineChart(400, 200)
 
     chart.set_legend([name for (name, _) in series])
     chart.set_colours_within_series(colors[0:len(series)])
 
     for (_, data) in series:
-        chart.add_data(data)
-
+        if max_points is None:
+            chart.add_data(data)
+        else:
+            points = downsample(list(enumerate(data)), max_points)
+            chart.add_data([x for (x, _) in points])
+            chart.add_data([y for (_, y) in points])
 
     return chart.get_url()
 
@@ -0,0 +1,202 @@
+"""
+Counters and histograms for the bot process, served over HTTP in the
+Prometheus text format.
+
+Updating a metric only takes a lock and a few additions, so they can be
+updated from the bot's loop. Handler latencies are not kept here but
+read from profiling.PROFILER when metrics are scraped.
+"""
+import time
+import bisect
+import threading
+import BaseHTTPServer
+
+import profiling
+
+PREFIX = 'rankme_bot_'
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = zip(names, values) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('%s="%s"' % (name, _escape(value)) for (name, value) in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric(object):
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = PREFIX + name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help),
+                 '# TYPE %s %s' % (self.name, self.kind)]
+        with self._lock:
+            for (label_values, value) in sorted(self._values.items()):
+                lines += self._render_value(label_values, value)
+        return lines
+
+    def _render_value(self, label_values, value):
+        return ['%s%s %s' % (self.name, _labels(self.label_names, label_values), _format_value(value))]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *label_values, **kwargs):
+        amount = kwargs.get('amount', 1)
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        _Metric.__init__(self, name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                # One count per bucket, and the sum
+                counts = self._values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def _render_value(self, label_values, counts):
+        lines = []
+        cumulative = 0
+        for (bound, count) in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            lines.append('%s_bucket%s %d' % (
+                self.name, _labels(self.label_names, label_values, [('le', _format_value(bound))]),
+                cumulative))
+        labels = _labels(self.label_names, label_values)
+        lines.append('%s_sum%s %s' % (self.name, labels, _format_value(counts[-1])))
+        lines.append('%s_count%s %d' % (self.name, labels, cumulative))
+        return lines
+
+
+LOOP_LAG = Histogram('loop_lag_seconds',
+                     'Time a loop iteration took beyond READ_WEBSOCKET_DELAY.')
+SLACK_API = Histogram('slack_api_seconds', 'Duration of Slack Web API calls.', ['method'])
+SLACK_API_FAILURES = Counter('slack_api_failures_total',
+                             'Slack Web API calls that raised or were not ok.', ['method'])
+CHECK_ACTIVE = Histogram('check_active_seconds', 'Duration of game tracker checks.')
+GAMES_STARTED = Counter('games_started_total', 'Games the tracker saw start.')
+GAMES_ENDED = Counter('games_ended_total', 'Games the tracker saw end.')
+RECONNECTS = Counter('reconnects_total', 'Times the bot was restarted after an error.')
+OUTBOX_DEPTH = Gauge('outbox_depth', 'Messages waiting to be posted to Slack.')
+OUTBOX_SEND_LATENCY = Histogram('outbox_send_seconds',
+                                'Time from queueing a message to Slack accepting it.')
+OUTBOX_RATELIMITED = Counter('outbox_ratelimited_total', 'Posts Slack answered ratelimited.')
+OUTBOX_DROPPED = Counter('outbox_dropped_total',
+                         'Messages dropped because the queue was full, Slack turned them down '
+                         'or posting kept failing.')
+
+METRICS = [LOOP_LAG, SLACK_API, SLACK_API_FAILURES, CHECK_ACTIVE,
+           GAMES_STARTED, GAMES_ENDED, RECONNECTS,
+           OUTBOX_DEPTH, OUTBOX_SEND_LATENCY, OUTBOX_RATELIMITED, OUTBOX_DROPPED]
+
+
+def _render_handlers(profiler):
+    name = PREFIX + 'handler_seconds'
+    lines = ['# HELP %s Duration of command handlers, over their recent calls.' % name,
+             '# TYPE %s summary' % name]
+    errors = []
+    for (handler, stats) in profiler.handlers():
+        for quantile in (0.5, 0.95, 0.99):
+            lines.append('%s%s %s' % (name, _labels(['handler', 'quantile'], [handler, quantile]),
+                                      _format_value(stats.percentile(quantile * 100))))
+        lines.append('%s_sum%s %s' % (name, _labels(['handler'], [handler]), _format_value(stats.total)))
+        lines.append('%s_count%s %d' % (name, _labels(['handler'], [handler]), stats.count))
+        errors.append('%shandler_errors_total%s %d' % (PREFIX, _labels(['handler'], [handler]), stats.errors))
+
+    return lines + ['# HELP %shandler_errors_total Command handlers that raised.' % PREFIX,
+                    '# TYPE %shandler_errors_total counter' % PREFIX] + errors
+
+
+def render(metrics=None, profiler=profiling.PROFILER):
+    lines = []
+    for metric in metrics or METRICS:
+        lines += metric.render()
+    lines += _render_handlers(profiler)
+    return '\n'.join(lines) + '\n'
+
+
+def instrument_slack_client(slack_client):
+    """
+    Times the api_call of slack_client, counting calls that raise or
+    answer with ok set to false as failures.
+    """
+    api_call = slack_client.api_call
+
+    def timed_api_call(method, **kwargs):
+        start = time.time()
+        ok = False
+        try:
+            result = api_call(method, **kwargs)
+            ok = not isinstance(result, dict) or result.get('ok', True)
+            return result
+        finally:
+            SLACK_API.observe(time.time() - start, method)
+            if not ok:
+                SLACK_API_FAILURES.inc(method)
+
+    slack_client.api_call = timed_api_call
+    return slack_client
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        body = render()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port, host='127.0.0.1'):
+    """
+    Serves /metrics on port of host, only locally by default, from a
+    thread of its own and returns the server.
+    """
+    server = BaseHTTPServer.HTTPServer((host, port), _Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
@@ -0,0 +1,95 @@
+create index if not exists game_stats_steam_game on game_stats (steam, game_id);
+
+-- game_stats only holds a player's stats when they changed since the
+-- previous game; this view has every player's stats for every game
+create view game_snapshot as
+select
+    game.id as game_id,
+    s.steam, s.name, s.lastip, s.score, s.kills, s.deaths, s.suicides, s.tk, s.shots, s.hits, s.headshots, s.connected, s.rounds_tr, s.rounds_ct, s.lastconnect,
+    s.knife, s.glock, s.usp, s.p228, s.deagle,
+    s.elite, s.fiveseven, s.m3, s.xm1014, s.mac10,
+    s.tmp, s.mp5navy, s.ump45, s.p90, s.galil,
+    s.ak47, s.sg550, s.famas, s.m4a1, s.aug,
+    s.scout, s.sg552, s.awp, s.g3sg1, s.m249,
+    s.hegrenade, s.flashbang, s.smokegrenade, s.head, s.chest,
+    s.stomach, s.left_arm, s.right_arm, s.left_leg, s.right_leg,
+    s.c4_planted, s.c4_exploded, s.c4_defused, s.ct_win, s.tr_win,
+    s.hostages_rescued, s.vip_killed, s.vip_escaped, s.vip_played
+from game
+inner join (select distinct steam from game_stats) as player
+inner join game_stats as s on s.steam = player.steam and s.game_id = (
+    select max(game_id)
+    from game_stats as latest
+    where latest.steam = player.steam and latest.game_id <= game.id);
+
+-- Drop snapshot rows that are identical to the player's previous one
+delete from game_stats
+where exists (
+    select 1
+    from game_stats as previous
+    where
+        previous.steam = game_stats.steam
+        and previous.game_id = (
+            select max(game_id)
+            from game_stats as latest
+            where latest.steam = game_stats.steam and latest.game_id < game_stats.game_id)
+        and previous.name is game_stats.name
+        and previous.lastip is game_stats.lastip
+        and previous.score is game_stats.score
+        and previous.kills is game_stats.kills
+        and previous.deaths is game_stats.deaths
+        and previous.suicides is game_stats.suicides
+        and previous.tk is game_stats.tk
+        and previous.shots is game_stats.shots
+        and previous.hits is game_stats.hits
+        and previous.headshots is game_stats.headshots
+        and previous.connected is game_stats.connected
+        and previous.rounds_tr is game_stats.rounds_tr
+        and previous.rounds_ct is game_stats.rounds_ct
+        and previous.lastconnect is game_stats.lastconnect
+        and previous.knife is game_stats.knife
+        and previous.glock is game_stats.glock
+        and previous.usp is game_stats.usp
+        and previous.p228 is game_stats.p228
+        and previous.deagle is game_stats.deagle
+        and previous.elite is game_stats.elite
+        and previous.fiveseven is game_stats.fiveseven
+        and previous.m3 is game_stats.m3
+        and previous.xm1014 is game_stats.xm1014
+        and previous.mac10 is game_stats.mac10
+        and previous.tmp is game_stats.tmp
+        and previous.mp5navy is game_stats.mp5navy
+        and previous.ump45 is game_stats.ump45
+        and previous.p90 is game_stats.p90
+        and previous.galil is game_stats.galil
+        and previous.ak47 is game_stats.ak47
+        and previous.sg550 is game_stats.sg550
+        and previous.famas is game_stats.famas
+        and previous.m4a1 is game_stats.m4a1
+        and previous.aug is game_stats.aug
+        and previous.scout is game_stats.scout
+        and previous.sg552 is game_stats.sg552
+        and previous.awp is game_stats.awp
+        and previous.g3sg1 is game_stats.g3sg1
+        and previous.m249 is game_stats.m249
+        and previous.hegrenade is game_stats.hegrenade
+        and previous.flashbang is game_stats.flashbang
+        and previous.smokegrenade is game_stats.smokegrenade
+        and previous.head is game_stats.head
+        and previous.chest is game_stats.chest
+        and previous.stomach is game_stats.stomach
+        and previous.left_arm is game_stats.left_arm
+        and previous.right_arm is game_stats.right_arm
+        and previous.left_leg is game_stats.left_leg
+        and previous.right_leg is game_stats.right_leg
+        and previous.c4_planted is game_stats.c4_planted
+        and previous.c4_exploded is game_stats.c4_exploded
+        and previous.c4_defused is game_stats.c4_defused
+        and previous.ct_win is game_stats.ct_win
+        and previous.tr_win is game_stats.tr_win
+        and previous.hostages_rescued is game_stats.hostages_rescued
+        and previous.vip_killed is game_stats.vip_killed
+        and previous.vip_escaped is game_stats.vip_escaped
+        and previous.vip_played is game_stats.vip_played);
+
+vacuum;
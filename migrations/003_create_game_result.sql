@@ -0,0 +1,70 @@
+CREATE TABLE `game_result` (
+    game_id INTEGER,
+    steam TEXT,
+    name TEXT,
+    rounds NUMERIC,
+    kills NUMERIC, deaths NUMERIC, suicides NUMERIC, tk NUMERIC, shots NUMERIC,
+    hits NUMERIC, headshots NUMERIC, score NUMERIC, knife NUMERIC, glock NUMERIC,
+    usp NUMERIC, p228 NUMERIC, deagle NUMERIC, elite NUMERIC, fiveseven NUMERIC,
+    m3 NUMERIC, xm1014 NUMERIC, mac10 NUMERIC, tmp NUMERIC, mp5navy NUMERIC,
+    ump45 NUMERIC, p90 NUMERIC, galil NUMERIC, ak47 NUMERIC, sg550 NUMERIC,
+    famas NUMERIC, m4a1 NUMERIC, aug NUMERIC, scout NUMERIC, sg552 NUMERIC,
+    awp NUMERIC, g3sg1 NUMERIC, m249 NUMERIC, hegrenade NUMERIC, flashbang NUMERIC,
+    smokegrenade NUMERIC,
+    FOREIGN KEY(game_id) REFERENCES game(id)
+);
+
+create index game_result_game on game_result (game_id);
+
+-- Results of completed games, from the snapshot taken at the start of the
+-- game and the one taken at the start of the next
+insert into game_result (game_id, steam, name, rounds,
+    kills, deaths, suicides, tk, shots,
+    hits, headshots, score, knife, glock,
+    usp, p228, deagle, elite, fiveseven,
+    m3, xm1014, mac10, tmp, mp5navy,
+    ump45, p90, galil, ak47, sg550,
+    famas, m4a1, aug, scout, sg552,
+    awp, g3sg1, m249, hegrenade, flashbang,
+    smokegrenade)
+select
+    g.id, e.steam, e.name,
+    e.rounds_tr-s.rounds_tr+e.rounds_ct-s.rounds_ct as rounds,
+    e.kills-s.kills, e.deaths-s.deaths, e.suicides-s.suicides, e.tk-s.tk, e.shots-s.shots,
+    e.hits-s.hits, e.headshots-s.headshots, e.score-s.score, e.knife-s.knife, e.glock-s.glock,
+    e.usp-s.usp, e.p228-s.p228, e.deagle-s.deagle, e.elite-s.elite, e.fiveseven-s.fiveseven,
+    e.m3-s.m3, e.xm1014-s.xm1014, e.mac10-s.mac10, e.tmp-s.tmp, e.mp5navy-s.mp5navy,
+    e.ump45-s.ump45, e.p90-s.p90, e.galil-s.galil, e.ak47-s.ak47, e.sg550-s.sg550,
+    e.famas-s.famas, e.m4a1-s.m4a1, e.aug-s.aug, e.scout-s.scout, e.sg552-s.sg552,
+    e.awp-s.awp, e.g3sg1-s.g3sg1, e.m249-s.m249, e.hegrenade-s.hegrenade, e.flashbang-s.flashbang,
+    e.smokegrenade-s.smokegrenade
+from game as g
+inner join game_snapshot as s on s.game_id=g.id
+inner join game_snapshot as e on e.steam=s.steam and e.game_id=(select min(id) from game where id > g.id)
+where g.end_time is not null and rounds > 0;
+
+-- The last game, if completed, ends with the current stats
+insert into game_result (game_id, steam, name, rounds,
+    kills, deaths, suicides, tk, shots,
+    hits, headshots, score, knife, glock,
+    usp, p228, deagle, elite, fiveseven,
+    m3, xm1014, mac10, tmp, mp5navy,
+    ump45, p90, galil, ak47, sg550,
+    famas, m4a1, aug, scout, sg552,
+    awp, g3sg1, m249, hegrenade, flashbang,
+    smokegrenade)
+select
+    g.id, e.steam, e.name,
+    e.rounds_tr-s.rounds_tr+e.rounds_ct-s.rounds_ct as rounds,
+    e.kills-s.kills, e.deaths-s.deaths, e.suicides-s.suicides, e.tk-s.tk, e.shots-s.shots,
+    e.hits-s.hits, e.headshots-s.headshots, e.score-s.score, e.knife-s.knife, e.glock-s.glock,
+    e.usp-s.usp, e.p228-s.p228, e.deagle-s.deagle, e.elite-s.elite, e.fiveseven-s.fiveseven,
+    e.m3-s.m3, e.xm1014-s.xm1014, e.mac10-s.mac10, e.tmp-s.tmp, e.mp5navy-s.mp5navy,
+    e.ump45-s.ump45, e.p90-s.p90, e.galil-s.galil, e.ak47-s.ak47, e.sg550-s.sg550,
+    e.famas-s.famas, e.m4a1-s.m4a1, e.aug-s.aug, e.scout-s.scout, e.sg552-s.sg552,
+    e.awp-s.awp, e.g3sg1-s.g3sg1, e.m249-s.m249, e.hegrenade-s.hegrenade, e.flashbang-s.flashbang,
+    e.smokegrenade-s.smokegrenade
+from game as g
+inner join game_snapshot as s on s.game_id=g.id
+inner join rankme as e on e.steam=s.steam
+where g.id=(select max(id) from game) and g.end_time is not null and rounds > 0;
@@ -0,0 +1,12 @@
+create table score_series (
+    game_id integer,
+    steam text,
+    score numeric,
+    primary key (steam, game_id),
+    FOREIGN KEY(game_id) REFERENCES game(id));
+
+-- Score at the end of every game a player took part in
+insert into score_series (game_id, steam, score)
+select r.game_id, r.steam, s.score + r.score
+from game_result as r
+inner join game_snapshot as s on s.game_id=r.game_id and s.steam=r.steam;
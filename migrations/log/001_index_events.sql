@@ -0,0 +1,5 @@
+create index if not exists events_type_subject_time on events (type, subject_id, time);
+
+create index if not exists events_type_indirect on events (type, indirect_id, subject_id);
+
+create index if not exists events_subject_time_round on events (subject_id, time, round_id);
@@ -0,0 +1,187 @@
+"""
+A queue of outgoing chat messages, posted to Slack by a thread of its own
+so a slow or rate limited Web API never holds up the bot's loop.
+
+Text messages to the same channel that are queued within COALESCE_WINDOW
+of each other are posted as one message. When Slack answers ratelimited,
+posting waits, twice as long every time in a row it happens, up to
+MAX_BACKOFF seconds. Messages Slack turns down for good, like to a
+channel that does not exist, are dropped.
+"""
+import time
+import threading
+import traceback
+from collections import deque
+
+import metrics
+
+COALESCE_WINDOW = 0.2
+# Slack truncates longer messages
+MAX_TEXT = 4000
+MAX_DEPTH = 1000
+MIN_BACKOFF = 1
+MAX_BACKOFF = 60
+# Attempts at posting a message that fails for other reasons than rate
+# limiting before it is dropped
+MAX_ATTEMPTS = 3
+# Errors Slack answers with that posting again may get past
+TRANSIENT_ERRORS = set(['internal_error', 'fatal_error', 'request_timeout', 'service_unavailable'])
+
+
+class _Message(object):
+    def __init__(self, channel, text, attachments):
+        self.channel = channel
+        self.text = text
+        self.attachments = attachments
+        self.queued = time.time()
+        self.attempts = 0
+
+    def can_merge(self, other, window):
+        return self.attachments is None and other.attachments is None and \
+            self.channel == other.channel and \
+            other.queued - self.queued <= window and \
+            len(self.text) + len(other.text) + 2 <= MAX_TEXT
+
+
+class Outbox(object):
+    def __init__(self, slack_client, coalesce_window=COALESCE_WINDOW):
+        self._slack_client = slack_client
+        self._coalesce_window = coalesce_window
+        self._messages = deque()
+        self._changed = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    def post(self, channel, text=None, attachments=None):
+        """
+        Queues a message for channel, either text or attachments. Returns
+        False if the queue is full and the message was dropped.
+        """
+        with self._changed:
+            if len(self._messages) >= MAX_DEPTH:
+                metrics.OUTBOX_DROPPED.inc()
+                return False
+            self._messages.append(_Message(channel, text, attachments))
+            metrics.OUTBOX_DEPTH.set(len(self._messages))
+            self._changed.notify()
+        return True
+
+    def depth(self):
+        with self._changed:
+            return len(self._messages)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops posting once the message being posted, if any, is done.
+        Messages still queued stay queued, for another outbox to take
+        over.
+        """
+        with self._changed:
+            self._stopped = True
+            self._changed.notify_all()
+
+    def take_over(self, other):
+        """
+        Queues the messages other, a stopped outbox, has left, ahead of
+        the ones queued here.
+        """
+        with other._changed:
+            messages = list(other._messages)
+            other._messages.clear()
+
+        with self._changed:
+            self._messages.extendleft(reversed(messages))
+            while len(self._messages) > MAX_DEPTH:
+                self._messages.pop()
+                metrics.OUTBOX_DROPPED.inc()
+            metrics.OUTBOX_DEPTH.set(len(self._messages))
+            self._changed.notify()
+
+    def _next(self):
+        """
+        Waits for a message and the window other messages are merged into
+        it during, and returns it, or None once stopped.
+        """
+        with self._changed:
+            while not self._messages and not self._stopped:
+                self._changed.wait()
+            if self._stopped:
+                return None
+
+            first = self._messages[0]
+            if first.attachments is None:
+                while not self._stopped:
+                    remaining = first.queued + self._coalesce_window - time.time()
+                    if remaining <= 0:
+                        break
+                    self._changed.wait(remaining)
+
+            message = self._messages.popleft()
+            while self._messages and message.can_merge(self._messages[0], self._coalesce_window):
+                message.text += '\n\n' + self._messages.popleft().text
+            metrics.OUTBOX_DEPTH.set(len(self._messages))
+            return message
+
+    def _requeue(self, message):
+        with self._changed:
+            self._messages.appendleft(message)
+            metrics.OUTBOX_DEPTH.set(len(self._messages))
+
+    def _send(self, message):
+        if message.attachments is None:
+            return self._slack_client.api_call('chat.postMessage', channel=message.channel,
+                                               text=message.text, as_user=True)
+        return self._slack_client.api_call('chat.postMessage', channel=message.channel,
+                                           attachments=message.attachments, as_user=True)
+
+    def _wait(self, seconds):
+        deadline = time.time() + seconds
+        with self._changed:
+            while not self._stopped and time.time() < deadline:
+                self._changed.wait(deadline - time.time())
+
+    def _run(self):
+        backoff = 0
+        while True:
+            message = self._next()
+            if message is None:
+                return
+
+            message.attempts += 1
+            try:
+                result = self._send(message)
+            except Exception:
+                print traceback.format_exc()
+                result = None
+
+            error = None
+            if not isinstance(result, dict):
+                error = 'no response'
+            elif not result.get('ok'):
+                error = result.get('error', 'unknown error')
+
+            if error == 'ratelimited':
+                metrics.OUTBOX_RATELIMITED.inc()
+                backoff = min(MAX_BACKOFF, backoff * 2 or MIN_BACKOFF)
+                message.attempts -= 1
+            elif (error == 'no response' or error in TRANSIENT_ERRORS) and \
+                    message.attempts < MAX_ATTEMPTS:
+                backoff = MIN_BACKOFF
+            else:
+                backoff = 0
+                if error:
+                    print 'Dropped a message to %s: %s' % (message.channel, error)
+                    metrics.OUTBOX_DROPPED.inc()
+                else:
+                    metrics.OUTBOX_SEND_LATENCY.observe(time.time() - message.queued)
+                continue
+
+            self._requeue(message)
+            self._wait(backoff)
@@ -1,8 +1,14 @@
 import math
+import heapq
+import random
+from bisect import bisect_left, bisect_right
+
+SKILL_FACTOR = 1.01
+
 
 def bestPack(items):
     bestDiff = 1e9
-    skillFactor = 1.01
+    skillFactor = SKILL_FACTOR
     teams = []
     for x in xrange(1, 2**len(items) / 2 + 1):
         b = 1
@@ -24,3 +30,304 @@ def bestPack(items):
     teams.sort(lambda a, b: cmp(a[1], b[1]))
 
     return teams
+
+
+def _size_penalty(size1, size2):
+    return 1 + math.ceil(abs(size1 - size2) / 2.0)
+
+
+def _pack_diff(powered, mask):
+    """
+    Team difference of the split where team one is the items whose bits are
+    set in mask, summed in item order exactly like bestPack does.
+    """
+    b = 1
+    size1 = 0
+    ts1 = 0
+    ts2 = 0
+    for p in powered:
+        if mask & b:
+            ts1 += p
+            size1 += 1
+        else:
+            ts2 += p
+        b = b << 1
+
+    return abs(ts1 - ts2) * _size_penalty(size1, len(powered) - size1)
+
+
+def _subset_sums(values):
+    """
+    Returns (sums, sizes), where index mask holds the sum and number of
+    the values whose bits are set in mask.
+    """
+    sums = [0.0]
+    sizes = [0]
+    for v in values:
+        sums = sums + [s + v for s in sums]
+        sizes = sizes + [s + 1 for s in sizes]
+
+    return sums, sizes
+
+
+class _SplitSearch(object):
+    """
+    Meet in the middle search over the splits bestPack enumerates.
+
+    bestPack enumerates masks 1 .. 2^(n-1): every non-empty subset of all
+    but the last item as team one, plus the last item on its own. The free
+    items are split in two halves whose subset sums are precomputed. For a
+    subset of the first half and a team size, the subsets of the second
+    half that can give a small enough difference form a contiguous range
+    of sums, found by bisection. Memory is O(2^(n/2)), independent of the
+    number of splits examined.
+    """
+    def __init__(self, powered):
+        self.powered = powered
+        self.n = len(powered)
+        self.last = 1 << (self.n - 1)
+        self.total = sum(powered)
+
+        free = powered[:-1]
+        self.half = len(free) // 2
+        self.a_sums, self.a_sizes = _subset_sums(free[:self.half])
+        b_sums, b_sizes = _subset_sums(free[self.half:])
+
+        b_by_size = {}
+        for b_mask in xrange(len(b_sums)):
+            b_by_size.setdefault(b_sizes[b_mask], []).append((b_sums[b_mask], b_mask))
+        for group in b_by_size.values():
+            group.sort()
+        self.b_groups = [(size, [s for (s, _) in group], [m for (_, m) in group])
+                         for (size, group) in b_by_size.items()]
+
+    def _slack(self, max_diff):
+        return 1e-9 * (abs(self.total) + abs(max_diff)) + 1e-9
+
+    def _range(self, a_sum, size1, sums, max_diff):
+        # |2 * (a_sum + b_sum) - total| * penalty < max_diff
+        bound = float(max_diff) / _size_penalty(size1, self.n - size1)
+        slack = self._slack(max_diff)
+        lo = bisect_left(sums, (self.total - bound) / 2 - a_sum - slack)
+        hi = bisect_right(sums, (self.total + bound) / 2 - a_sum + slack)
+        return lo, hi
+
+    def ranges(self, max_diff):
+        """
+        Yields (a_mask, b_masks, lo, hi), where a_mask | b_masks[i] << half
+        for lo <= i < hi covers every split (other than the last item on
+        its own) with a difference below max_diff, plus a few that are only
+        within rounding distance of it.
+        """
+        for a_mask in xrange(len(self.a_sums)):
+            a_sum = self.a_sums[a_mask]
+            a_size = self.a_sizes[a_mask]
+            for (b_size, sums, masks) in self.b_groups:
+                size1 = a_size + b_size
+                if size1 == 0:
+                    continue
+                lo, hi = self._range(a_sum, size1, sums, max_diff)
+                if lo < hi:
+                    yield a_mask, masks, lo, hi
+
+    def below(self, max_diff):
+        """
+        Yields (mask, diff) for every split with a difference below
+        max_diff, in no particular order.
+        """
+        diff = _pack_diff(self.powered, self.last)
+        if diff < max_diff:
+            yield self.last, diff
+
+        for (a_mask, masks, lo, hi) in self.ranges(max_diff):
+            for i in xrange(lo, hi):
+                mask = a_mask | (masks[i] << self.half)
+                diff = _pack_diff(self.powered, mask)
+                if diff < max_diff:
+                    yield mask, diff
+
+    def smallest(self, k):
+        """
+        Returns the k splits with the smallest difference as (mask, diff)
+        pairs, sorted like bestPack sorts them. The search bound shrinks to
+        the k:th best difference seen so far, so memory stays O(k).
+        """
+        # Max-heap on (diff, mask) through negated keys
+        heap = []
+
+        def offer(mask, diff):
+            entry = (-diff, -mask)
+            if len(heap) < k:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+
+        def bound():
+            if len(heap) < k:
+                return float('inf')
+            # Ties with the current k:th split can still win on mask
+            return -heap[0][0] + self._slack(-heap[0][0])
+
+        offer(self.last, _pack_diff(self.powered, self.last))
+        for a_mask in xrange(len(self.a_sums)):
+            a_sum = self.a_sums[a_mask]
+            a_size = self.a_sizes[a_mask]
+            for (b_size, sums, masks) in self.b_groups:
+                size1 = a_size + b_size
+                if size1 == 0:
+                    continue
+                max_diff = bound()
+                if max_diff == float('inf'):
+                    lo, hi = 0, len(sums)
+                else:
+                    lo, hi = self._range(a_sum, size1, sums, max_diff)
+                for i in xrange(lo, hi):
+                    mask = a_mask | (masks[i] << self.half)
+                    offer(mask, _pack_diff(self.powered, mask))
+
+        return [(split, diff) for (diff, split) in
+                sorted([(-neg_diff, -neg_mask) for (neg_diff, neg_mask) in heap])]
+
+    def sample(self, max_diff, rnd):
+        """
+        Returns a uniformly chosen (mask, diff) among the splits with a
+        difference below max_diff, or None if there are none, without
+        enumerating them: candidates are drawn from the bisected ranges by
+        index and the few that only pass within rounding are rejected.
+        """
+        chunks = []
+        offsets = []
+        count = 0
+        diff = _pack_diff(self.powered, self.last)
+        if diff < max_diff:
+            chunks.append((self.last, [0], 0, 1))
+            offsets.append(count)
+            count += 1
+        for chunk in self.ranges(max_diff):
+            chunks.append(chunk)
+            offsets.append(count)
+            count += chunk[3] - chunk[2]
+
+        for _ in xrange(100):
+            if count == 0:
+                return None
+            index = rnd.randrange(count)
+            chunk = bisect_right(offsets, index) - 1
+            (a_mask, masks, lo, _) = chunks[chunk]
+            mask = a_mask | (masks[lo + index - offsets[chunk]] << self.half)
+            diff = _pack_diff(self.powered, mask)
+            if diff < max_diff:
+                return mask, diff
+
+        # Practically unreachable: nearly every drawn candidate was only
+        # within rounding of the bound
+        candidates = list(self.below(max_diff))
+        return rnd.choice(candidates) if candidates else None
+
+    def min_diff(self):
+        """
+        Approximate smallest difference of any split.
+        """
+        best = _pack_diff(self.powered, self.last)
+        for a_mask in xrange(len(self.a_sums)):
+            a_sum = self.a_sums[a_mask]
+            a_size = self.a_sizes[a_mask]
+            for (b_size, sums, _) in self.b_groups:
+                size1 = a_size + b_size
+                if size1 == 0:
+                    continue
+                penalty = _size_penalty(size1, self.n - size1)
+                i = bisect_left(sums, self.total / 2.0 - a_sum)
+                for j in (i - 1, i):
+                    if 0 <= j < len(sums):
+                        best = min(best, abs(2 * (a_sum + sums[j]) - self.total) * penalty)
+
+        return best
+
+
+def _search(items):
+    powered = [n[1]**SKILL_FACTOR for n in items]
+    if not powered:
+        raise ValueError('Can not make teams without players.')
+
+    return _SplitSearch(powered)
+
+
+def render_pack(items, mask):
+    """
+    Returns the teams, as lists of names, for a split mask of items.
+    """
+    t1 = []
+    t2 = []
+    b = 1
+    for n in items:
+        if mask & b:
+            t1.append(n[0])
+        else:
+            t2.append(n[0])
+        b = b << 1
+
+    return (t1, t2)
+
+
+def iter_packs(items, max_diff):
+    """
+    Yields (mask, diff) for every split of items with a team difference
+    below max_diff, in no particular order. Bit i of mask is set when
+    items[i] is on team one; use render_pack to get the teams.
+    """
+    if not items:
+        return iter([])
+
+    return _search(items).below(max_diff)
+
+
+def top_packs(items, k):
+    """
+    Returns the k splits of items with the smallest team difference as
+    (mask, diff) pairs; the same splits as the first k of bestPack(items).
+    """
+    if not items:
+        return []
+
+    return _search(items).smallest(k)
+
+
+def random_pack(items, max_diff, rnd=random):
+    """
+    Returns a split of items, chosen uniformly among those with a team
+    difference below max_diff, as ((team1, team2), diff), or None if there
+    is no such split.
+    """
+    if not items:
+        return None
+
+    chosen = _search(items).sample(max_diff, rnd)
+    if chosen is None:
+        return None
+
+    (mask, diff) = chosen
+    return (render_pack(items, mask), diff)
+
+
+def balanced_packs(items, max_diff):
+    """
+    Returns the splits of items, a list of (name, score) pairs, with a
+    team difference below max_diff, sorted by difference.
+
+    The result is the same as filtering bestPack(items) on difference,
+    but only splits that are close to the threshold are ever evaluated.
+    """
+    packs = sorted(iter_packs(items, max_diff), key=lambda (mask, diff): (diff, mask))
+
+    return [(render_pack(items, mask), diff) for (mask, diff) in packs]
+
+
+def best_pack(items):
+    """
+    Returns the split of items with the smallest team difference; the same
+    as bestPack(items)[0].
+    """
+    [(mask, diff)] = _search(items).smallest(1)
+
+    return (render_pack(items, mask), diff)
@@ -0,0 +1,203 @@
+"""
+Month partitions of the log database's events.
+
+The log plugin keeps appending to events. Once the tables derived from
+events have folded in a month's worth, the archiver moves the month out of
+events into a table of its own, events_YYYY_MM, and seals it with
+triggers that refuse any change. events stays small, which keeps the
+plugin's inserts and its indexes cheap.
+
+events_all is a view of events and every sealed partition, for reading
+all events ever logged. Code that only needs some of them, like the
+derived tables folding in events after an id, gets a relation made of
+only the partitions that can hold them from events_source.
+
+Usage: python partitions.py archive <log db> [months to keep]
+       python partitions.py list <log db>
+"""
+import sys
+import time
+
+import db
+import incremental
+
+COLUMNS = 'id, round_id, time, type, data, subject_id, indirect_id'
+# Derived tables, by the name they keep their refresh state under, that
+# must have folded in events before they are archived
+DERIVED_STATES = ['kills', 'event_rollup']
+# Months kept in events, the current one included
+KEEP_MONTHS = 2
+
+
+def ensure_registry(connection):
+    """
+    Creates the registry of sealed partitions. Tables derived from events
+    do when they are created, so it exists wherever events are read.
+    """
+    connection.execute("""
+        create table if not exists event_partitions (
+            name text primary key,
+            month text not null unique,
+            min_id integer,
+            max_id integer,
+            rows integer not null)""")
+
+
+def partition_name(month):
+    return 'events_' + month.replace('-', '_')
+
+
+def _next_month(month):
+    (year, number) = [int(part) for part in month.split('-')]
+    return '%04d-%02d' % (year + number / 12, number % 12 + 1)
+
+
+def _months_ago(months):
+    now = time.localtime()
+    index = now.tm_year * 12 + now.tm_mon - 1 - months
+    return '%04d-%02d' % (index / 12, index % 12 + 1)
+
+
+def partitions(connection, after_id=0):
+    """
+    Returns the names of the sealed partitions that can have events with
+    an id greater than after_id, oldest first.
+    """
+    return [name for (name,) in connection.execute(
+        'select name from event_partitions where max_id > ? order by month', (after_id,))]
+
+
+def _union(names):
+    return ' union all '.join('select %s from %s' % (COLUMNS, name) for name in ['events'] + names)
+
+
+def events_source(connection, after_id=0):
+    """
+    Returns a relation, to select from, with the events with an id
+    greater than after_id, and maybe others. It is events itself unless
+    any sealed partition can have some of them.
+    """
+    names = partitions(connection, after_id)
+    if not names:
+        return 'events'
+    return '(%s)' % _union(names)
+
+
+def max_event_id(connection):
+    return connection.execute("""
+        select max(
+            coalesce((select max(id) from events), 0),
+            coalesce((select max(max_id) from event_partitions), 0))""").fetchone()[0] or None
+
+
+def _create_view(connection):
+    connection.execute('drop view if exists events_all')
+    connection.execute('create view events_all as ' +
+                       _union([name for (name,) in connection.execute(
+                           'select name from event_partitions order by month')]))
+
+
+def _unregistered(connection):
+    """
+    Returns the months of partition tables missing from the registry, like
+    ones a failed archive left behind.
+    """
+    return [name[7:11] + '-' + name[12:14] for (name,) in connection.execute("""
+        select name from sqlite_master
+        where type = 'table' and name glob 'events_[0-9][0-9][0-9][0-9]_[0-9][0-9]'
+        and name not in (select name from event_partitions)""")]
+
+
+def _seal(connection, month, max_id):
+    """
+    Moves the events of month with an id of at most max_id to a partition
+    of their own and seals it. Returns the number of events in it.
+
+    Run in a transaction, so the events are either moved, sealed and
+    registered or still in events. It picks up what is already in a
+    partition table, so a month can be sealed again after a failure left
+    one unregistered.
+    """
+    name = partition_name(month)
+    period = (month + '-01', _next_month(month) + '-01', max_id)
+    for action in ('insert', 'update', 'delete'):
+        connection.execute('drop trigger if exists %s_sealed_%s' % (name, action))
+    connection.execute("""
+        create table if not exists %s (
+            id integer primary key,
+            round_id integer,
+            time datetime,
+            type varchar(16),
+            data text,
+            subject_id varchar(16) null,
+            indirect_id varchar(16) null)""" % name)
+    connection.execute("""
+        insert or ignore into %s (%s)
+        select %s from events
+        where time >= ? and time < ? and id <= ?""" % (name, COLUMNS, COLUMNS), period)
+    (min_id, last_id, rows) = connection.execute(
+        'select min(id), max(id), count(*) from %s' % name).fetchone()
+    connection.execute('delete from events where time >= ? and time < ? and id <= ?', period)
+
+    for action in ('insert', 'update', 'delete'):
+        connection.execute("""
+            create trigger %s_sealed_%s before %s on %s
+            begin
+                select raise(abort, 'events of %s are archived');
+            end""" % (name, action, action, name, month))
+
+    connection.execute("""
+        insert into event_partitions (name, month, min_id, max_id, rows)
+        values (?, ?, ?, ?, ?)""", (name, month, min_id, last_id, rows))
+    return rows
+
+
+def archive(connection, before):
+    """
+    Seals every month before the month before, like 2017-03, that still
+    has events in events, once the derived tables have folded them in.
+    Returns (month, events in it) for every partition sealed.
+
+    Each month is sealed in a transaction of its own, partition table,
+    triggers, registry and view included.
+
+    Events that show up for a month after it was sealed, like from a
+    backfill, stay in events.
+    """
+    from kills import KillStore
+    from event_rollup import EventRollup
+
+    KillStore(connection).refresh()
+    EventRollup(connection).refresh()
+    max_id = min(incremental.get_last_id(connection, state) for state in DERIVED_STATES)
+
+    ensure_registry(connection)
+    months = set(month for (month,) in connection.execute("""
+        select distinct substr(time, 1, 7) from events
+        where time < ? and id <= ?""", (before + '-01', max_id)))
+    months.update(_unregistered(connection))
+
+    archived = []
+    for month in sorted(months):
+        with db.immediate(connection):
+            if connection.execute('select 1 from event_partitions where month = ?',
+                                  (month,)).fetchone():
+                continue
+            archived.append((month, _seal(connection, month, max_id)))
+            _create_view(connection)
+
+    return archived
+
+
+if __name__ == '__main__':
+    connection = db.connect(sys.argv[2])
+    if sys.argv[1] == 'archive':
+        keep = int(sys.argv[3]) if len(sys.argv) > 3 else KEEP_MONTHS
+        for (month, rows) in archive(connection, _months_ago(keep - 1)):
+            print 'Archived %d events of %s.' % (rows, month)
+    elif sys.argv[1] == 'list':
+        ensure_registry(connection)
+        for row in connection.execute(
+                'select month, name, min_id, max_id, rows from event_partitions order by month'):
+            print '%s %-16s ids %s-%s, %d events' % row
+        print 'events: %d events' % connection.execute('select count(*) from events').fetchone()
@@ -0,0 +1,226 @@
+"""
+Latency statistics for command handlers and SQL statements.
+
+Python 2.7's sqlite3 has no set_trace_callback, and it would not tell how
+long statements take anyway, so statements are timed by the cursors of
+TimedConnections, which db.connect opens.
+"""
+import re
+import time
+import sqlite3
+import threading
+from collections import deque
+
+# Number of recent samples percentiles are computed from
+RECENT_SAMPLES = 500
+# Number of recent statements the slowest are picked from
+RECENT_QUERIES = 200
+
+
+class LatencyStats(object):
+    """
+    Call count, error count, total and max of all samples, and the most
+    recent samples for percentiles.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def add(self, seconds, error=False):
+        self.count += 1
+        self.errors += error
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+
+    def percentile(self, p):
+        if not self.recent:
+            return 0.0
+        samples = sorted(self.recent)
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100.0))]
+
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+
+
+def normalize_query(sql):
+    """
+    Collapses whitespace and replaces literals and lists of parameters, so
+    statements that only differ in those are counted together.
+    """
+    sql = ' '.join(sql.split())
+    sql = _LITERALS.sub('?', sql)
+    return _LISTS.sub('(...)', sql)
+
+
+class Profiler(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._handlers = {}
+        self._queries = {}
+        self._normalized = {}
+        self._recent_queries = deque(maxlen=RECENT_QUERIES)
+
+    def record_handler(self, name, seconds, error=False):
+        with self._lock:
+            stats = self._handlers.get(name)
+            if stats is None:
+                stats = self._handlers[name] = LatencyStats()
+            stats.add(seconds, error)
+
+    def record_query(self, sql, seconds):
+        normalized = self._normalized.get(sql)
+        if normalized is None:
+            normalized = normalize_query(sql)
+            if len(self._normalized) < 10000:
+                self._normalized[sql] = normalized
+
+        with self._lock:
+            stats = self._queries.get(normalized)
+            if stats is None:
+                stats = self._queries[normalized] = LatencyStats()
+            stats.add(seconds)
+            self._recent_queries.append((seconds, normalized, time.time()))
+
+    def handlers(self):
+        """
+        Returns (name, LatencyStats) for every handler, by name.
+        """
+        with self._lock:
+            return sorted(self._handlers.items())
+
+    def queries(self):
+        """
+        Returns (normalized query, LatencyStats) for every query, the ones
+        that took the most time in total first.
+        """
+        with self._lock:
+            return sorted(self._queries.items(), key=lambda (_, stats): stats.total, reverse=True)
+
+    def slowest_recent_queries(self, count):
+        """
+        Returns (seconds, normalized query, time) for the slowest of the
+        recently run queries.
+        """
+        with self._lock:
+            return sorted(self._recent_queries, reverse=True)[:count]
+
+
+PROFILER = Profiler()
+
+
+class TimedCursor(sqlite3.Cursor):
+    """
+    Records the time spent executing a statement and fetching its rows
+    as one sample, once the rows run out or the next statement is run.
+    """
+    _sql = None
+    _elapsed = 0.0
+
+    def _finish(self):
+        if self._sql is not None:
+            PROFILER.record_query(self._sql, self._elapsed)
+            self._sql = None
+
+    def _timed(self, sql, f, *args):
+        self._finish()
+        start = time.time()
+        try:
+            return f(self, sql, *args)
+        finally:
+            self._sql = sql
+            self._elapsed = time.time() - start
+
+    def execute(self, sql, *args):
+        return self._timed(sql, sqlite3.Cursor.execute, *args)
+
+    def executemany(self, sql, *args):
+        return self._timed(sql, sqlite3.Cursor.executemany, *args)
+
+    def executescript(self, sql):
+        return self._timed(sql, sqlite3.Cursor.executescript)
+
+    def _fetched(self, start, done):
+        self._elapsed += time.time() - start
+        if done:
+            self._finish()
+
+    def fetchone(self):
+        start = time.time()
+        row = sqlite3.Cursor.fetchone(self)
+        self._fetched(start, row is None)
+        return row
+
+    def fetchmany(self, *args):
+        start = time.time()
+        rows = sqlite3.Cursor.fetchmany(self, *args)
+        self._fetched(start, not rows)
+        return rows
+
+    def fetchall(self):
+        start = time.time()
+        rows = sqlite3.Cursor.fetchall(self)
+        self._fetched(start, True)
+        return rows
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        start = time.time()
+        try:
+            row = sqlite3.Cursor.next(self)
+        except StopIteration:
+            self._fetched(start, True)
+            raise
+        self._elapsed += time.time() - start
+        return row
+
+    def close(self):
+        self._finish()
+        sqlite3.Cursor.close(self)
+
+    def __del__(self):
+        self._finish()
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    A connection whose cursors, also the ones execute creates, are timed.
+    """
+
+    def cursor(self, factory=TimedCursor):
+        return sqlite3.Connection.cursor(self, factory)
+
+
+def _ms(seconds):
+    return seconds * 1000
+
+
+def report(profiler=PROFILER, queries=5):
+    """
+    Formats the handler and query statistics as tables.
+    """
+    lines = ['%-14s%7s%7s%9s%9s%9s' % ('Command', 'Calls', 'Errors', 'p50 ms', 'p95 ms', 'Max ms')]
+    for (name, stats) in profiler.handlers():
+        lines.append('%-14s%7d%7d%9.1f%9.1f%9.1f' % (
+            name[:14], stats.count, stats.errors, _ms(stats.percentile(50)),
+            _ms(stats.percentile(95)), _ms(stats.max)))
+
+    lines += ['', '%-44s%7s%9s%9s%9s' % ('Query', 'Calls', 'p50 ms', 'p95 ms', 'Max ms')]
+    for (sql, stats) in profiler.queries()[:queries]:
+        lines.append('%-44s%7d%9.1f%9.1f%9.1f' % (
+            sql[:44], stats.count, _ms(stats.percentile(50)),
+            _ms(stats.percentile(95)), _ms(stats.max)))
+
+    lines += ['', '%-44s%9s%10s' % ('Slowest recent query', 'ms', 'At')]
+    for (seconds, sql, at) in profiler.slowest_recent_queries(queries):
+        lines.append('%-44s%9.1f%10s' % (sql[:44], _ms(seconds),
+                                         time.strftime('%H:%M:%S', time.localtime(at))))
+
+    return '\n'.join(lines)
@@ -31,11 +31,13 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import division
 
 import os
+import sys
 import math
 import random
 import re
 import warnings
 import copy
+import itertools
 
 try:
     # we're on Python3
@@ -47,6 +49,12 @@ except ImportError:
     from urllib2 import urlopen
     from urllib import quote
 
+try:
+    # Scales and encodes whole datasets at once when available
+    import numpy
+except ImportError:
+    numpy = None
+
 
 # Helper variables and functions
 # -----------------------------------------------------------------------------
@@ -68,6 +76,30 @@ def _reset_warnings():
     globals()['__warningregistry__'] = None
 
 
+def _to_array(values):
+    """Converts a dataset to a float array, with None as NaN."""
+    return numpy.array(values, dtype=float)
+
+
+def _round_array(values):
+    """Rounds an array the way round() does on this Python version."""
+    if sys.version_info[0] >= 3:
+        return numpy.rint(values)
+    # Python 2 rounds halves away from zero
+    magnitude = numpy.abs(values)
+    rounded = numpy.floor(magnitude)
+    rounded += (magnitude - rounded) >= 0.5
+    return numpy.copysign(rounded, values)
+
+
+def _array_to_list(values, missing):
+    """Converts an array back to a dataset, with None where missing."""
+    dataset = values.tolist()
+    for i in numpy.flatnonzero(missing).tolist():
+        dataset[i] = None
+    return dataset
+
+
 # Exception Classes
 # -----------------------------------------------------------------------------
 
@@ -142,8 +174,50 @@ class Data(object):
     @staticmethod
     def check_clip(scaled, clipped):
         if clipped != scaled:
-            warnings.warn('One or more of of your data points has been '
-                'clipped because it is out of range.')
+            Data.warn_clipped()
+
+    @staticmethod
+    def warn_clipped():
+        warnings.warn('One or more of of your data points has been '
+            'clipped because it is out of range.')
+
+    @classmethod
+    def scale_dataset(cls, dataset, range):
+        """Scales a whole dataset, like scale_value does for every value
+        that is not None.
+        """
+        if not any(value is not None for value in dataset):
+            return list(dataset)
+        lower, upper = range
+        assert(upper > lower)
+        factor = cls.max_value / (upper - lower)
+        if numpy is not None:
+            values = _to_array(dataset)
+            missing = numpy.isnan(values)
+            values[missing] = lower
+            scaled = cls._round_scaled_array((values - lower) * factor)
+            clipped = numpy.clip(scaled, 0, cls.max_value)
+            if (scaled != clipped).any():
+                Data.warn_clipped()
+            return _array_to_list(clipped, missing)
+
+        round_scaled = cls._round_scaled
+        scaled_dataset = [None if value is None else round_scaled((value - lower) * factor)
+                          for value in dataset]
+        present = [value for value in scaled_dataset if value is not None]
+        if min(present) < 0 or max(present) > cls.max_value:
+            scaled_dataset = [None if value is None else cls.clip_value(value)
+                              for value in scaled_dataset]
+            Data.warn_clipped()
+        return scaled_dataset
+
+    @staticmethod
+    def _round_scaled(value):
+        return int(round(value))
+
+    @staticmethod
+    def _round_scaled_array(values):
+        return _round_array(values).astype(int)
 
 
 class SimpleData(Data):
@@ -194,14 +268,54 @@ class TextData(Data):
         Data.check_clip(scaled, clipped)
         return clipped
 
+    @staticmethod
+    def _round_scaled(value):
+        return value
+
+    @staticmethod
+    def _round_scaled_array(values):
+        return values
+
 
 class ExtendedData(Data):
 
     max_value = 4095
     enc_map = \
         'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-.'
+    # The two character code of every value from 0 to max_value
+    enc_pairs = [''.join(pair) for pair in itertools.product(enc_map, repeat=2)]
+    if numpy is not None:
+        enc_pairs_array = numpy.array(enc_pairs, dtype='S2')
 
     def __repr__(self):
+        try:
+            return 'chd=e:' + ','.join([self.encode_dataset(data)
+                                        for data in self.data])
+        except DataOutOfRangeException:
+            # Encode value by value, to tell which value is out of range
+            return self._encode_values()
+
+    @classmethod
+    def encode_dataset(cls, data):
+        if numpy is not None:
+            values = _to_array(data)
+            missing = numpy.isnan(values)
+            present = values[~missing]
+            if len(present) and (present.min() < 0 or present.max() > cls.max_value):
+                raise DataOutOfRangeException()
+            values[missing] = 0
+            codes = cls.enc_pairs_array[values.astype(int)]
+            codes[missing] = '__'
+            return codes.tobytes().decode('ascii')
+
+        present = [value for value in data if value is not None]
+        if present and (min(present) < 0 or max(present) > cls.max_value):
+            raise DataOutOfRangeException()
+        enc_pairs = cls.enc_pairs
+        return ''.join(['__' if value is None else enc_pairs[int(value)]
+                        for value in data])
+
+    def _encode_values(self):
         encoded_data = []
         enc_size = len(ExtendedData.enc_map)
         for data in self.data:
@@ -553,35 +667,41 @@ class Chart(object):
     def _filter_none(self, data):
         return [r for r in data if r is not None]
 
+    def data_ranges(self):
+        """Return a dict from axis type ('x' or 'y') to a 2-tuple giving
+        the minimum and maximum data range of that axis, found in a single
+        pass over the datasets. The y-axis maximum is one more than the
+        largest value. An axis without datasets, or with a dataset without
+        any values, has no range.
+        """
+        ranges = {}
+        for type, s in self.annotated_data():
+            if type not in ('x', 'y') or ranges.get(type, True) is None:
+                continue
+            values = self._filter_none(s)
+            if not values:
+                ranges[type] = None
+                continue
+            lower, upper = min(values), max(values)
+            if type == 'y':
+                upper += 1
+            if type in ranges:
+                lower = min(ranges[type][0], lower)
+                upper = max(ranges[type][1], upper)
+            ranges[type] = (lower, upper)
+        return ranges
+
     def data_x_range(self):
         """Return a 2-tuple giving the minimum and maximum x-axis
         data range.
         """
-        try:
-            lower = min([min(self._filter_none(s))
-                         for type, s in self.annotated_data()
-                         if type == 'x'])
-            upper = max([max(self._filter_none(s))
-                         for type, s in self.annotated_data()
-                         if type == 'x'])
-            return (lower, upper)
-        except ValueError:
-            return None     # no x-axis datasets
+        return self.data_ranges().get('x')
 
     def data_y_range(self):
         """Return a 2-tuple giving the minimum and maximum y-axis
         data range.
         """
-        try:
-            lower = min([min(self._filter_none(s))
-                         for type, s in self.annotated_data()
-                         if type == 'y'])
-            upper = max([max(self._filter_none(s)) + 1
-                         for type, s in self.annotated_data()
-                         if type == 'y'])
-            return (lower, upper)
-        except ValueError:
-            return None     # no y-axis datasets
+        return self.data_ranges().get('y')
 
     def scaled_data(self, data_class, x_range=None, y_range=None):
         """Scale `self.data` as appropriate for the given data encoding
@@ -599,18 +719,14 @@ class Chart(object):
         """
         self.scaled_data_class = data_class
 
-        # Determine the x-axis range for scaling.
-        if x_range is None:
-            x_range = self.data_x_range()
-            if x_range and x_range[0] > 0:
-                x_range = (x_range[0], x_range[1])
+        # Determine the axis ranges for scaling.
+        if x_range is None or y_range is None:
+            ranges = self.data_ranges()
+            if x_range is None:
+                x_range = ranges.get('x')
+            if y_range is None:
+                y_range = ranges.get('y')
         self.scaled_x_range = x_range
-
-        # Determine the y-axis range for scaling.
-        if y_range is None:
-            y_range = self.data_y_range()
-            if y_range and y_range[0] > 0:
-                y_range = (y_range[0], y_range[1])
         self.scaled_y_range = y_range
 
         scaled_data = []
@@ -621,14 +737,7 @@ class Chart(object):
                 scale_range = y_range
             elif type == 'marker-size':
                 scale_range = (0, max(dataset))
-            scaled_dataset = []
-            for v in dataset:
-                if v is None:
-                    scaled_dataset.append(None)
-                else:
-                    scaled_dataset.append(
-                        data_class.scale_value(v, scale_range))
-            scaled_data.append(scaled_dataset)
+            scaled_data.append(data_class.scale_dataset(dataset, scale_range))
         return scaled_data
 
     def add_data(self, data):
@@ -0,0 +1,163 @@
+"""
+Replays mention traffic at a bot running against fake_slack.py and
+measures how long commands take to be answered and how many never are.
+
+Usage: python replay.py <rankme db> <log db> [rate] [count] [workers] [commands file]
+
+Sends count commands (default 100) at an average of rate per second
+(default 2), with the bot running commands inline or, if workers is more
+than 0, with run_concurrent. The commands are drawn from every handler,
+like bench_handlers.py calls them, or taken in turn from the commands
+file, one per line. A line may start with the number of seconds since the
+start of a recording and a tab, in which case it is sent at that time
+instead.
+
+The databases are written to, since the bot keeps derived tables in the
+log database; replay against copies.
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import threading
+
+import bot
+from fake_slack import FakeSlack, LocalSlackClient, BOT_NAME
+from bench_handlers import COMMAND_TEXT, SKIPPED, TEAM_PLAYERS
+
+# Seconds to wait for the last replies
+TIMEOUT = 30
+BUSY_REPLY = 'I am a bit busy'
+
+
+def synthetic_commands(log_db_path, count, rate, rnd):
+    """
+    Returns count (time, command) pairs for every handler, arriving at
+    rate per second on average.
+    """
+    connection = sqlite3.connect(log_db_path)
+    nicks = [name for (name,) in connection.execute(
+        'select name from players order by steam_id limit ?', (TEAM_PLAYERS,))]
+    connection.close()
+
+    names = [name for name in sorted(bot.HANDLERS.keys()) if name not in SKIPPED]
+    commands = []
+    at = 0
+    for _ in xrange(count):
+        name = rnd.choice(names)
+        commands.append((at, COMMAND_TEXT.get(name, name).format(*nicks, team=', '.join(nicks))))
+        at += rnd.expovariate(rate)
+
+    return commands
+
+
+def recorded_commands(path, count, rate):
+    commands = []
+    at = 0
+    with open(path) as f:
+        lines = [line.rstrip('\n') for line in f if line.strip()]
+    for line in lines[:count]:
+        (offset, tab, text) = line.partition('\t')
+        if tab:
+            at = float(offset)
+            commands.append((at, text))
+        else:
+            commands.append((at, line))
+            at += 1.0 / rate
+
+    return commands
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def replay(db_path, log_db_path, commands, workers=0):
+    """
+    Sends commands, (time, text) pairs, to a bot and returns a dict with
+    the number of commands sent, answered, turned down as busy and
+    dropped, and the reply latencies.
+    """
+    sent = {}
+    replies = {}
+    lock = threading.Lock()
+    answered = threading.Condition(lock)
+
+    # Every command is sent from a channel of its own, so its reply can
+    # be told apart from the others
+    def on_post(at, channel, text, attachments):
+        with answered:
+            if channel in sent and channel not in replies:
+                replies[channel] = (at, text)
+                answered.notify_all()
+
+    fake = FakeSlack(on_post=on_post).start()
+
+    # The bot's connections belong to the thread it is created in
+    def run_bot():
+        slack_bot = bot.Bot('token', BOT_NAME, db_path, log_db_path,
+                            LocalSlackClient('token', fake.api_url))
+        if workers:
+            slack_bot.run_concurrent(workers)
+        else:
+            slack_bot.run()
+
+    thread = threading.Thread(target=run_bot)
+    thread.daemon = True
+    thread.start()
+    if not fake.wait_connected():
+        raise Exception('The bot never connected to the websocket.')
+
+    started = time.time()
+    for (i, (at, text)) in enumerate(commands):
+        delay = started + at - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        channel = 'C%07d' % i
+        with lock:
+            sent[channel] = fake.mention(text, channel)
+
+    deadline = time.time() + TIMEOUT
+    with answered:
+        while len(replies) < len(sent) and time.time() < deadline:
+            answered.wait(deadline - time.time())
+
+    fake.stop()
+
+    latencies = [replies[replied][0] - sent[replied]
+                 for replied in replies if not (replies[replied][1] or '').startswith(BUSY_REPLY)]
+    return {
+        'sent': len(sent),
+        'answered': len(latencies),
+        'busy': len(replies) - len(latencies),
+        'dropped': len(sent) - len(replies),
+        'latencies': latencies
+    }
+
+
+if __name__ == '__main__':
+    rate = float(sys.argv[3]) if len(sys.argv) > 3 else 2
+    count = int(sys.argv[4]) if len(sys.argv) > 4 else 100
+    workers = int(sys.argv[5]) if len(sys.argv) > 5 else 0
+    if len(sys.argv) > 6:
+        commands = recorded_commands(sys.argv[6], count, rate)
+    else:
+        commands = synthetic_commands(sys.argv[2], count, rate, random.Random(4711))
+
+    result = replay(sys.argv[1], sys.argv[2], commands, workers)
+    latencies = result.pop('latencies')
+    print json.dumps(result, sort_keys=True)
+    if latencies:
+        print 'Latency p50 %.3fs, p90 %.3fs, p99 %.3fs, max %.3fs' % (
+            percentile(latencies, 50), percentile(latencies, 90),
+            percentile(latencies, 99), max(latencies))
+
+    # The bot has no way to stop it, so leave its threads behind
+    # instead of having them fail during interpreter shutdown
+    sys.stdout.flush()
+    os._exit(0)
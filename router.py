@@ -0,0 +1,79 @@
+from collections import namedtuple
+
+# Databases a command reads from
+RANKME_DB = 'rankme'
+LOG_DB = 'log'
+
+# Expected cost of running a command
+CHEAP = 'cheap'
+EXPENSIVE = 'expensive'
+
+
+class Command(namedtuple('Command', ['name', 'args', 'text'])):
+    """
+    A parsed command: name is the first word, args the remaining words and
+    text the whole command as it was typed.
+    """
+    __slots__ = ()
+
+    def arg(self, index, default=None):
+        return self.args[index] if index < len(self.args) else default
+
+    def rest(self):
+        """
+        The arguments joined back together, for arguments that may
+        contain spaces, like nicks.
+        """
+        return ' '.join(self.args)
+
+
+class CommandSpec(namedtuple('CommandSpec', ['name', 'handler', 'dbs', 'cacheable', 'cost'])):
+    """
+    A command handler together with what is known about it: the databases
+    it reads, whether its response only depends on the contents of those
+    databases (and can be cached) and how expensive it is to run.
+    """
+    __slots__ = ()
+
+
+def parse_command(text):
+    words = text.split()
+    return Command(words[0] if words else '', tuple(words[1:]), text)
+
+
+class Router(object):
+    """
+    Resolves command text to a CommandSpec by looking up its first word.
+
+    A word that is not a command name but starts with one, like "rankings",
+    resolves to the longest such command name.
+    """
+
+    def __init__(self, specs):
+        self._specs = dict((spec.name, spec) for spec in specs)
+        self._by_length = sorted(self._specs.keys(), key=len, reverse=True)
+
+    def resolve(self, text):
+        """
+        Returns (spec, command), where spec is None if the command is not
+        known.
+        """
+        command = parse_command(text)
+        spec = self._specs.get(command.name)
+        if spec is None:
+            for name in self._by_length:
+                if command.name.startswith(name):
+                    spec = self._specs[name]
+                    command = command._replace(name=name)
+                    break
+
+        return spec, command
+
+    def spec(self, name):
+        return self._specs.get(name)
+
+    def names(self):
+        return sorted(self._specs.keys())
+
+    def specs(self):
+        return [self._specs[name] for name in self.names()]
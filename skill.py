@@ -1,17 +1,24 @@
+import sys
+import json
+import sqlite3
 from collections import defaultdict
 import trueskill
 
-def get_skill_ranking(rounds):
-    """
-    Returns an array of player rankings from calculated skill.
+import db
+import incremental
 
-    rounds is an iterable of pairs, where first element is a list of winning team members,
-    and seconds is a list of losing team members
-    """
-    skiller = trueskill.TrueSkill(draw_probability=0)
 
-    players = defaultdict(skiller.create_rating)
+def create_skiller():
+    return trueskill.TrueSkill(draw_probability=0)
 
+
+def rate_rounds(skiller, players, rounds):
+    """
+    Folds rounds into players, a mapping from player id to rating.
+
+    Players not yet in the mapping are expected to be created on access,
+    like with a defaultdict(skiller.create_rating).
+    """
     for (winners, losers) in rounds:
         if len(winners.intersection(losers)) > 0:
             raise Exception('Teams have overlapping members:\n%s\n%s' % (winners, losers))
@@ -27,7 +34,203 @@ def get_skill_ranking(rounds):
             for (player_id, rating) in zip(losers, lose_team_rated):
                 players[player_id] = rating
 
+
+def rank(skiller, players):
     leaderboard = [p for p in players.items()]
     leaderboard.sort(key=lambda x: skiller.expose(x[1]), reverse=True)
 
     return leaderboard
+
+
+def get_skill_ranking(rounds):
+    """
+    Returns an array of player rankings from calculated skill.
+
+    rounds is an iterable of pairs, where first element is a list of winning team members,
+    and seconds is a list of losing team members
+    """
+    skiller = create_skiller()
+    players = defaultdict(skiller.create_rating)
+    rate_rounds(skiller, players, rounds)
+
+    return rank(skiller, players)
+
+
+def decode_team(team):
+    return set(json.loads(team.decode('utf-8')))
+
+
+def load_rounds(connection, after_id=0):
+    """
+    Yields (id, winners, losers) for every decided round in the log
+    database with an id greater than after_id, in the order they were
+    played. Backfilled rounds have larger ids than the ones played after
+    them, so that is not the order of their ids.
+    """
+    rows = connection.execute("""
+        select id, win_team, lose_team
+        from rounds
+        where id > ? and win_team is not null and lose_team is not null
+        order by starttime, id""", (after_id,))
+
+    for (round_id, win_team, lose_team) in rows:
+        yield round_id, decode_team(win_team), decode_team(lose_team)
+
+
+def ensure_schema(connection):
+    connection.execute("""
+        create table if not exists skill_rating (
+            steam_id varchar(16) primary key,
+            mu real not null,
+            sigma real not null)""")
+    incremental.ensure_state_table(connection)
+
+
+def load_ratings(connection, skiller):
+    """
+    Returns the stored ratings, as a mapping from player id to rating that
+    creates the ratings of players not in it on access.
+    """
+    players = defaultdict(skiller.create_rating)
+    for (steam_id, mu, sigma) in connection.execute(
+            'select steam_id, mu, sigma from skill_rating'):
+        players[steam_id] = skiller.create_rating(mu, sigma)
+
+    return players
+
+
+def stored_ranking(connection):
+    """
+    Returns the ranking from the ratings RatingStore keeps, without
+    writing anything.
+    """
+    skiller = create_skiller()
+    return rank(skiller, load_ratings(connection, skiller))
+
+
+def load_last_rounds(connection, count):
+    rows = connection.execute("""
+        select win_team, lose_team
+        from rounds
+        where win_team is not null and lose_team is not null
+        order by starttime desc, id desc
+        limit ?""", (count,)).fetchall()
+
+    return [(decode_team(win_team), decode_team(lose_team))
+            for (win_team, lose_team) in reversed(rows)]
+
+
+class RatingStore(object):
+    """
+    Player ratings persisted in the log database.
+
+    Ratings are stored together with the id of the last round folded into
+    them, so that only rounds added since the last update have to be
+    rated. Since TrueSkill updates are applied in the order rounds were
+    played, the stored ratings are identical to rating the whole history
+    from scratch. Rounds added that were played before ones already rated,
+    like from a backfill, make the update rate the whole history again.
+
+    Ratings are only written by update, which derived.refresh calls, and
+    rebuild. Both create the table if it is missing; stored_ranking reads
+    the ratings as they are.
+    """
+    STATE_NAME = 'skill_rating'
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._skiller = create_skiller()
+
+    def _load(self):
+        return load_ratings(self._connection, self._skiller)
+
+    def update(self):
+        """
+        Rates rounds added since the last update. Returns the number of
+        rounds that were folded into the stored ratings.
+
+        The stored ratings are read after taking the write lock, so
+        updates from other connections cannot rate the same rounds.
+        """
+        with db.immediate(self._connection):
+            ensure_schema(self._connection)
+            return self._update(incremental.get_last_id(self._connection, self.STATE_NAME))
+
+    def _played_before_rated(self, last_id):
+        """
+        Tells whether any round added after last_id was played before the
+        last round that was rated.
+        """
+        return self._connection.execute("""
+            select exists (
+                select 1 from rounds
+                where
+                    id > ? and win_team is not null and lose_team is not null
+                    and starttime < (
+                        select max(starttime) from rounds
+                        where id <= ? and win_team is not null and lose_team is not null))""",
+                                        (last_id, last_id)).fetchone()[0]
+
+    def _update(self, last_id):
+        if last_id and self._played_before_rated(last_id):
+            last_id = 0
+        if last_id == 0:
+            self._connection.execute('delete from skill_rating')
+
+        new_rounds = list(load_rounds(self._connection, last_id))
+        if not new_rounds:
+            return 0
+
+        players = self._load()
+        before = dict(players)
+        rate_rounds(self._skiller, players,
+                    [(winners, losers) for (_, winners, losers) in new_rounds])
+
+        changed = [(steam_id, rating.mu, rating.sigma)
+                   for (steam_id, rating) in players.items()
+                   if before.get(steam_id) is not rating]
+        self._connection.executemany(
+            'insert or replace into skill_rating (steam_id, mu, sigma) values (?, ?, ?)',
+            changed)
+        incremental.set_last_id(self._connection, self.STATE_NAME,
+                                max(round_id for (round_id, _, _) in new_rounds))
+
+        return len(new_rounds)
+
+    def rebuild(self):
+        with db.immediate(self._connection):
+            ensure_schema(self._connection)
+            return self._update(0)
+
+    def check(self, tolerance=1e-6):
+        """
+        Compares the stored ratings with ratings calculated from the whole
+        round history. Returns a list of (steam_id, stored, expected) for
+        players that differ; an empty list means the store is consistent.
+        """
+        self.update()
+        stored = self._load()
+        expected = dict(get_skill_ranking(
+            [(winners, losers) for (_, winners, losers) in load_rounds(self._connection)]))
+
+        mismatches = []
+        for steam_id in set(stored.keys()) | set(expected.keys()):
+            s = stored.get(steam_id)
+            e = expected.get(steam_id)
+            if s is None or e is None or \
+                    abs(s.mu - e.mu) > tolerance or abs(s.sigma - e.sigma) > tolerance:
+                mismatches.append((steam_id, s, e))
+
+        return mismatches
+
+
+if __name__ == '__main__':
+    store = RatingStore(sqlite3.connect(sys.argv[2]))
+    if sys.argv[1] == 'rebuild':
+        print 'Rated %d rounds.' % store.rebuild()
+    elif sys.argv[1] == 'check':
+        mismatches = store.check()
+        for (steam_id, stored, expected) in mismatches:
+            print '%s: stored %s, expected %s' % (steam_id, stored, expected)
+        print '%d mismatching players.' % len(mismatches)
+        sys.exit(1 if mismatches else 0)
@@ -0,0 +1,372 @@
+"""
+Generates synthetic rankme and log databases, for trying out and
+benchmarking the bot at sizes the sample database does not reach.
+
+Usage: python synthetic.py <rankme db> <log db> [scale] [seed]
+
+At scale 1 there are 12 players, 20 games and 100 rounds of about 100
+events each. Games, rounds and events grow linearly with the scale and
+players with its square root, like a group that plays more and more
+often while slowly picking up new players.
+
+generate_server_log writes the same kind of rounds as a server log, for
+ingest.py.
+"""
+import os
+import sys
+import glob
+import json
+import time
+import bisect
+import random
+import sqlite3
+
+from game_tracker import GameTracker, WEAPON_COLUMNS
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+PLAYERS = 12
+GAMES = 20
+ROUNDS = 100
+EVENTS_PER_ROUND = 100
+ROUNDS_PER_GAME = 25
+TEAM_SIZE = 5
+
+START_TIME = 1483264800  # 2017-01-01 10:00 UTC
+DAY = 24 * 60 * 60
+
+# Stats that start out at zero for a new player
+STAT_COLUMNS = [
+    'kills', 'deaths', 'suicides', 'tk', 'shots', 'hits', 'headshots',
+    'connected', 'rounds_tr', 'rounds_ct'] + WEAPON_COLUMNS + [
+    'head', 'chest', 'stomach', 'left_arm', 'right_arm', 'left_leg', 'right_leg',
+    'c4_planted', 'c4_exploded', 'c4_defused', 'ct_win', 'tr_win',
+    'hostages_rescued', 'vip_killed', 'vip_escaped', 'vip_played']
+
+RANKME_SCHEMA = """
+    CREATE TABLE `rankme` (id INTEGER PRIMARY KEY, steam TEXT, name TEXT, lastip TEXT, score NUMERIC, kills NUMERIC, deaths NUMERIC, suicides NUMERIC, tk NUMERIC, shots NUMERIC, hits NUMERIC, headshots NUMERIC, connected NUMERIC, rounds_tr NUMERIC, rounds_ct NUMERIC, lastconnect NUMERIC,knife NUMERIC,glock NUMERIC,usp NUMERIC,p228 NUMERIC,deagle NUMERIC,elite NUMERIC,fiveseven NUMERIC,m3 NUMERIC,xm1014 NUMERIC,mac10 NUMERIC,tmp NUMERIC,mp5navy NUMERIC,ump45 NUMERIC,p90 NUMERIC,galil NUMERIC,ak47 NUMERIC,sg550 NUMERIC,famas NUMERIC,m4a1 NUMERIC,aug NUMERIC,scout NUMERIC,sg552 NUMERIC,awp NUMERIC,g3sg1 NUMERIC,m249 NUMERIC,hegrenade NUMERIC,flashbang NUMERIC,smokegrenade NUMERIC, head NUMERIC, chest NUMERIC, stomach NUMERIC, left_arm NUMERIC, right_arm NUMERIC, left_leg NUMERIC, right_leg NUMERIC,c4_planted NUMERIC,c4_exploded NUMERIC,c4_defused NUMERIC,ct_win NUMERIC, tr_win NUMERIC, hostages_rescued NUMERIC, vip_killed NUMERIC, vip_escaped NUMERIC, vip_played NUMERIC);
+    """
+
+LOG_SCHEMA = """
+    CREATE TABLE rounds (
+                id integer primary key autoincrement,
+                starttime datetime,
+                endtime datetime null,
+                win_team text null,
+                lose_team text null);
+    CREATE TABLE players (
+                steam_id varchar(16) primary key,
+                name varchar(32));
+    CREATE TABLE `events` (
+                id integer primary key autoincrement,
+                round_id integer references rounds,
+                time datetime,
+                type varchar(16),
+                data text,
+                subject_id varchar(16) null references players,
+                indirect_id varchar(16) null references players);
+    """
+
+# Relative frequency of the event types found in the server logs
+EVENT_WEIGHTS = [
+    ('weapon_fire', 400), ('player_hurt', 80), ('item_pickup', 60),
+    ('weapon_reload', 40), ('player_jump', 40), ('player_death', 30),
+    ('player_radio', 20), ('weapon_zoom', 15), ('player_blind', 12),
+    ('flashbang_detonate', 8), ('hegrenade_detonate', 6), ('smokegrenade_detonate', 6),
+    ('weapon_fire_on_empty', 4), ('break_prop', 4), ('bomb_pickup', 3),
+    ('bomb_dropped', 3), ('player_decal', 3),
+    ('player_avenged_teammate', 2), ('bomb_beginplant', 2), ('bomb_planted', 1),
+    ('bomb_begindefuse', 1), ('bomb_abortplant', 1), ('bomb_abortdefuse', 1),
+    ('bomb_defused', 1), ('bomb_exploded', 1), ('round_mvp', 1),
+    ('player_falldamage', 1), ('break_breakable', 1)]
+
+# Events with a player that caused them, besides the subject
+INDIRECT_EVENTS = set(['player_death', 'player_hurt', 'player_blind', 'player_avenged_teammate'])
+
+KILL_WEAPONS = ['ak47', 'm4a1', 'awp', 'deagle', 'usp', 'glock', 'famas', 'galil',
+                'mp5navy', 'p90', 'scout', 'knife', 'hegrenade', 'world', 'prop_physics_multiplayer']
+KILL_WEAPON_WEIGHTS = [30, 25, 12, 10, 5, 5, 4, 4, 3, 2, 2, 1, 1, 1, 1]
+
+ITEMS = ['kevlar', 'assaultsuit', 'flashbang', 'hegrenade', 'smokegrenade', 'defuser'] + \
+    KILL_WEAPONS[:11]
+
+NAME_SYLLABLES = ['per', 'lar', 'chii', 'kam', 'bo', 'zed', 'ni', 'tor', 'mag', 'ru',
+                  'fi', 'sko', 'dan', 'el', 'vik', 'sa', 'ja', 'mo', 'len', 'ix']
+
+
+def scaled_sizes(scale):
+    """
+    Returns (players, games, rounds) at scale.
+    """
+    return (max(TEAM_SIZE * 2, int(round(PLAYERS * scale ** 0.5))),
+            max(1, int(round(GAMES * scale))),
+            max(1, int(round(ROUNDS * scale))))
+
+
+def make_players(count, rnd):
+    """
+    Returns count (steam id, nick) pairs. Nicks are lower case, like the
+    bot sees them in commands, and unique.
+    """
+    players = []
+    names = set()
+    for i in xrange(count):
+        name = rnd.choice(NAME_SYLLABLES) + rnd.choice(NAME_SYLLABLES)
+        if name in names:
+            name += str(i)
+        names.add(name)
+        players.append(('STEAM_0:%d:%d' % (i % 2, 1000 + i), name))
+
+    return players
+
+
+class _WeightedChoice(object):
+    def __init__(self, items, weights, rnd):
+        self._items = items
+        self._cumulative = []
+        total = 0
+        for weight in weights:
+            total += weight
+            self._cumulative.append(total)
+        self._rnd = rnd
+
+    def __call__(self):
+        return self._items[bisect.bisect_right(
+            self._cumulative, self._rnd.random() * self._cumulative[-1])]
+
+
+def apply_migrations(connection, directory):
+    for path in sorted(glob.glob(os.path.join(directory, '*.sql'))):
+        with open(path) as f:
+            connection.executescript(f.read())
+
+
+def generate_rankme_db(path, scale=1, seed=4711):
+    """
+    Creates the rankme database at path, with the game, game_stats,
+    game_result and score_series tables filled in the way GameTracker
+    fills them, one game at a time.
+    """
+    rnd = random.Random(seed)
+    (player_count, game_count, _) = scaled_sizes(scale)
+    players = make_players(player_count, rnd)
+    weapon = _WeightedChoice(WEAPON_COLUMNS, [20 if w in ('ak47', 'm4a1') else
+                                              8 if w in ('awp', 'deagle') else 1
+                                              for w in WEAPON_COLUMNS], rnd)
+
+    connection = sqlite3.connect(path)
+    connection.executescript(RANKME_SCHEMA)
+    apply_migrations(connection, MIGRATIONS_DIR)
+
+    connection.executemany("""
+        insert into rankme (%s) values (%s)""" % (
+        ', '.join(['steam', 'name', 'lastip', 'score', 'lastconnect'] + STAT_COLUMNS),
+        ', '.join('?' * (5 + len(STAT_COLUMNS)))),
+        [(steam, name, '10.0.0.%d' % (i % 250 + 1), 1000, START_TIME) + (0,) * len(STAT_COLUMNS)
+         for (i, (steam, name)) in enumerate(players)])
+    connection.commit()
+
+    # Games are recorded by the tracker itself, so the tables end up just
+    # like the bot leaves them
+    tracker = GameTracker(connection)
+    for game in xrange(game_count):
+        start_time = START_TIME + game * DAY / 2
+        tracker._create_game(start_time)
+
+        rounds = rnd.randint(ROUNDS_PER_GAME - 10, ROUNDS_PER_GAME + 10)
+        playing = rnd.sample(players, rnd.randint(TEAM_SIZE * 2 - 2, min(len(players), TEAM_SIZE * 4)))
+        for (steam, _) in playing:
+            kills = int(rounds * rnd.uniform(0.2, 1.4))
+            deaths = int(rounds * rnd.uniform(0.4, 1.0))
+            shots = kills * rnd.randint(8, 20)
+            hits = int(shots * rnd.uniform(0.15, 0.4))
+            deltas = {
+                'score': kills * 2 - deaths + rnd.randint(-5, 10),
+                'kills': kills,
+                'deaths': deaths,
+                'suicides': rnd.randint(0, 1),
+                'tk': rnd.randint(0, 1),
+                'shots': shots,
+                'hits': hits,
+                'headshots': int(kills * rnd.uniform(0.1, 0.5)),
+                'connected': rounds * 120,
+                'rounds_tr': rounds / 2,
+                'rounds_ct': rounds - rounds / 2,
+                'head': hits / 6, 'chest': hits / 3, 'stomach': hits / 6,
+                'left_arm': hits / 12, 'right_arm': hits / 12,
+                'left_leg': hits / 12, 'right_leg': hits / 12,
+                'c4_planted': rnd.randint(0, 3), 'c4_exploded': rnd.randint(0, 2),
+                'c4_defused': rnd.randint(0, 2),
+                'ct_win': rnd.randint(0, rounds / 2), 'tr_win': rnd.randint(0, rounds / 2)
+            }
+            for _ in xrange(kills):
+                column = weapon()
+                deltas[column] = deltas.get(column, 0) + 1
+
+            columns = sorted(deltas.keys())
+            connection.execute('update rankme set %s, lastconnect = ? where steam = ?' % (
+                ', '.join(['%s = %s + ?' % (c, c) for c in columns])),
+                [deltas[c] for c in columns] + [start_time + rounds * 120, steam])
+
+        tracker._complete_game(start_time + rounds * 120)
+
+    connection.close()
+    return players
+
+
+def _format_time(timestamp):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(timestamp))
+
+
+def _event_data(event_type, rnd, kill_weapon):
+    if event_type == 'player_death':
+        return {'weapon': kill_weapon(), 'headshot': rnd.random() < 0.3}
+    elif event_type == 'player_hurt':
+        return {'weapon': kill_weapon(), 'dmg_health': rnd.randint(5, 100),
+                'hitgroup': rnd.randint(0, 7)}
+    elif event_type in ('weapon_fire', 'weapon_reload', 'weapon_zoom', 'weapon_fire_on_empty'):
+        return {'weapon': rnd.choice(KILL_WEAPONS[:11])}
+    elif event_type == 'item_pickup':
+        return {'item': rnd.choice(ITEMS)}
+    elif event_type == 'player_radio':
+        return {'slot': rnd.randint(1, 30)}
+    elif event_type == 'player_falldamage':
+        return {'damage': rnd.uniform(1, 50)}
+    return {}
+
+
+def generate_log_db(path, scale=1, seed=4711, players=None):
+    """
+    Creates the log database at path, with rounds of events played by
+    players, (steam id, nick) pairs that default to the ones
+    generate_rankme_db picks for the same scale and seed.
+    """
+    rnd = random.Random(seed)
+    (player_count, _, round_count) = scaled_sizes(scale)
+    if players is None:
+        players = make_players(player_count, random.Random(seed))
+    event_type = _WeightedChoice([t for (t, w) in EVENT_WEIGHTS],
+                                 [w for (t, w) in EVENT_WEIGHTS], rnd)
+    kill_weapon = _WeightedChoice(KILL_WEAPONS, KILL_WEAPON_WEIGHTS, rnd)
+
+    connection = sqlite3.connect(path)
+    connection.executescript(LOG_SCHEMA)
+    connection.executemany('insert into players (steam_id, name) values (?, ?)', players)
+
+    steam_ids = [steam for (steam, name) in players]
+    rounds_per_day = max(ROUNDS_PER_GAME, round_count / 365 + 1)
+    for round_number in xrange(round_count):
+        start = START_TIME + (round_number / rounds_per_day) * DAY + \
+            (round_number % rounds_per_day) * 120
+        playing = rnd.sample(steam_ids, TEAM_SIZE * 2)
+        (winners, losers) = (playing[:TEAM_SIZE], playing[TEAM_SIZE:])
+
+        cursor = connection.execute("""
+            insert into rounds (starttime, endtime, win_team, lose_team)
+            values (?, ?, ?, ?)""", (_format_time(start), _format_time(start + 115),
+                                     json.dumps(winners), json.dumps(losers)))
+        round_id = cursor.lastrowid
+
+        events = []
+        event_count = rnd.randint(EVENTS_PER_ROUND / 2, EVENTS_PER_ROUND * 3 / 2)
+        for i in xrange(event_count):
+            t = event_type()
+            subject = rnd.choice(playing)
+            indirect = rnd.choice(winners if subject in losers else losers) \
+                if t in INDIRECT_EVENTS else None
+            events.append((round_id, _format_time(start + i * 115 / event_count), t,
+                           json.dumps(_event_data(t, rnd, kill_weapon)), subject, indirect))
+        connection.executemany("""
+            insert into events (round_id, time, type, data, subject_id, indirect_id)
+            values (?, ?, ?, ?, ?, ?)""", events)
+
+    connection.commit()
+    apply_migrations(connection, os.path.join(MIGRATIONS_DIR, 'log'))
+    connection.close()
+
+
+
+# Lines srcds logs for the bomb events, instead of the event type
+BOMB_TRIGGERS = {
+    'bomb_planted': 'Planted_The_Bomb',
+    'bomb_defused': 'Defused_The_Bomb',
+    'bomb_begindefuse': 'Begin_Bomb_Defuse_With_Kit',
+    'bomb_pickup': 'Got_The_Bomb',
+    'bomb_dropped': 'Dropped_The_Bomb'
+}
+HITGROUPS = ['generic', 'head', 'chest', 'stomach', 'left arm', 'right arm', 'left leg', 'right leg']
+
+
+def _log_line(timestamp, text):
+    return time.strftime('L %m/%d/%Y - %H:%M:%S: ', time.gmtime(timestamp)) + text + '\n'
+
+
+def generate_server_log(path, scale=1, seed=4711, players=None):
+    """
+    Writes a server log at path with the rounds and events
+    generate_log_db would put in a log database, as srcds and a plugin
+    logging every event as a trigger would log them.
+    """
+    rnd = random.Random(seed)
+    (player_count, _, round_count) = scaled_sizes(scale)
+    if players is None:
+        players = make_players(player_count, random.Random(seed))
+    event_type = _WeightedChoice([t for (t, w) in EVENT_WEIGHTS],
+                                 [w for (t, w) in EVENT_WEIGHTS], rnd)
+    kill_weapon = _WeightedChoice(KILL_WEAPONS, KILL_WEAPON_WEIGHTS, rnd)
+    user_ids = dict((steam, i + 2) for (i, (steam, _)) in enumerate(players))
+    names = dict(players)
+
+    with open(path, 'w') as f:
+        rounds_per_day = max(ROUNDS_PER_GAME, round_count / 365 + 1)
+        for round_number in xrange(round_count):
+            start = START_TIME + (round_number / rounds_per_day) * DAY + \
+                (round_number % rounds_per_day) * 120
+            playing = rnd.sample(names.keys(), TEAM_SIZE * 2)
+            teams = dict([(steam, 'CT') for steam in playing[:TEAM_SIZE]] +
+                         [(steam, 'TERRORIST') for steam in playing[TEAM_SIZE:]])
+
+            def player(steam):
+                return '"%s<%d><%s><%s>"' % (names[steam], user_ids[steam], steam, teams[steam])
+
+            f.write(_log_line(start, 'World triggered "Round_Start"'))
+            event_count = rnd.randint(EVENTS_PER_ROUND / 2, EVENTS_PER_ROUND * 3 / 2)
+            for i in xrange(event_count):
+                at = start + i * 115 / event_count
+                t = event_type()
+                subject = rnd.choice(playing)
+                other = rnd.choice([steam for steam in playing if teams[steam] != teams[subject]])
+                if t == 'player_death':
+                    f.write(_log_line(at, '%s killed %s with "%s"%s' % (
+                        player(other), player(subject), kill_weapon(),
+                        ' (headshot)' if rnd.random() < 0.3 else '')))
+                elif t == 'player_hurt':
+                    f.write(_log_line(at, '%s attacked %s with "%s" (damage "%d") (damage_armor "0") '
+                                      '(health "50") (armor "0") (hitgroup "%s")' % (
+                                          player(other), player(subject), kill_weapon(),
+                                          rnd.randint(5, 100), rnd.choice(HITGROUPS))))
+                elif t in BOMB_TRIGGERS:
+                    f.write(_log_line(at, '%s triggered "%s"' % (player(subject), BOMB_TRIGGERS[t])))
+                else:
+                    properties = ''.join(' (%s "%s")' % item for item in
+                                         sorted(_event_data(t, rnd, kill_weapon).items()))
+                    against = ' against %s' % player(other) if t in INDIRECT_EVENTS else ''
+                    f.write(_log_line(at, '%s triggered "%s"%s%s' % (player(subject), t, against, properties)))
+
+            winner = rnd.choice(['CT', 'TERRORIST'])
+            f.write(_log_line(start + 115, 'Team "%s" triggered "%s"' % (
+                winner, 'CTs_Win' if winner == 'CT' else 'Terrorists_Win')))
+            f.write(_log_line(start + 115, 'World triggered "Round_End"'))
+
+
+if __name__ == '__main__':
+    scale = float(sys.argv[3]) if len(sys.argv) > 3 else 1
+    seed = int(sys.argv[4]) if len(sys.argv) > 4 else 4711
+
+    for path in sys.argv[1:3]:
+        if os.path.exists(path):
+            raise Exception('%s already exists' % path)
+
+    players = generate_rankme_db(sys.argv[1], scale, seed)
+    generate_log_db(sys.argv[2], scale, seed, players)
+    print 'Generated %d players, %d games and %d rounds.' % scaled_sizes(scale)